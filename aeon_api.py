@@ -1,31 +1,302 @@
 # aeon_api.py
-from fastapi import FastAPI
-from pydantic import BaseModel
+#
+# POST /code answers a prompt with the Azure OpenAI deployment.
+#   {"prompt": "..."}                 -> {"output": "...", "metrics": {...}}
+#   {"prompt": "...", "stream": true} -> Server-Sent Events: "token" events as
+#                                        the completion arrives, then "done"
+#                                        with the metrics (or "error")
+#
+# The endpoint is async on a single AsyncAzureOpenAI client with one shared
+# connection pool, so a slow completion holds no thread. At most
+# AEON_MAX_CONCURRENCY completions run at once; a request that cannot get a
+# slot within AEON_QUEUE_TIMEOUT seconds gets 503 with Retry-After.
+#
+# Every request reports time to first token and tokens per second; GET /stats
+# summarizes the recent ones.
+#
+# Answers are cached (see aeon_cache.py): a repeated prompt is served from the
+# cache without taking a slot, streamed or not, with "cached": true in the
+# response or done event. Cache-Control: no-cache skips the lookup and
+# refreshes the entry.
+#
+# Configuration (environment, besides the AZURE_OPENAI_* settings):
+#   AEON_MAX_CONCURRENCY   Completions running at once (default 8)
+#   AEON_QUEUE_TIMEOUT     Seconds to wait for a slot (default 10)
+#   AEON_MAX_TOKENS        max_completion_tokens per request (default 2048)
+#   AEON_REQUEST_TIMEOUT   Seconds before a completion is abandoned (default 120)
+#   AEON_POOL_CONNECTIONS  Connections in the shared pool (default 20)
+
 import os
+import json
+import time
+import asyncio
+import logging
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
+
+import httpx
+from fastapi import FastAPI, Header, HTTPException
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
 from dotenv import load_dotenv
-from openai import AzureOpenAI
+from openai import AsyncAzureOpenAI, APIError, RateLimitError
 
 load_dotenv()
 
-app = FastAPI()
+# After load_dotenv: aeon_cache reads its AEON_CACHE* settings on import
+from aeon_cache import CACHE_ENABLED, cache_key, response_cache  # noqa: E402
+
+logger = logging.getLogger("aeon_api")
+
+MAX_CONCURRENCY = int(os.getenv("AEON_MAX_CONCURRENCY", "8"))
+QUEUE_TIMEOUT = float(os.getenv("AEON_QUEUE_TIMEOUT", "10"))
+MAX_TOKENS = int(os.getenv("AEON_MAX_TOKENS", "2048"))
+REQUEST_TIMEOUT = float(os.getenv("AEON_REQUEST_TIMEOUT", "120"))
+POOL_CONNECTIONS = int(os.getenv("AEON_POOL_CONNECTIONS", "20"))
+
+SYSTEM_PROMPT = "You are an expert software engineer."
+
+# Requests summarized by /stats
+RECENT_REQUESTS = 256
+
+client: Optional[AsyncAzureOpenAI] = None
+slots = asyncio.Semaphore(MAX_CONCURRENCY)
+recent: deque = deque(maxlen=RECENT_REQUESTS)
+counters = {"completed": 0, "failed": 0, "rejected": 0, "in_flight": 0}
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global client
+    client = AsyncAzureOpenAI(
+        api_key=os.getenv("AZURE_OPENAI_API_KEY"),
+        azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
+        api_version=os.getenv("AZURE_OPENAI_API_VERSION"),
+        timeout=REQUEST_TIMEOUT,
+        http_client=httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=POOL_CONNECTIONS, max_keepalive_connections=POOL_CONNECTIONS),
+            timeout=REQUEST_TIMEOUT,
+        ),
+    )
+    yield
+    await client.close()
+
+
+app = FastAPI(lifespan=lifespan)
 
-client = AzureOpenAI(
-    api_key=os.getenv("AZURE_OPENAI_API_KEY"),
-    azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
-    api_version=os.getenv("AZURE_OPENAI_API_VERSION"),
-)
 
 class Prompt(BaseModel):
     prompt: str
+    stream: bool = False
 
-@app.post("/code")
-def code(prompt: Prompt):
-    response = client.chat.completions.create(
-        model=os.getenv("AZURE_OPENAI_DEPLOYMENT_NAME"),
-        messages=[
-            {"role": "system", "content": "You are an expert software engineer."},
-            {"role": "user", "content": prompt.prompt}
+
+class Completion:
+    """Timing of one completion: time to first token and tokens per second"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.first_token: Optional[float] = None
+        self.finished: Optional[float] = None
+        self.tokens = 0
+        self.chunks = 0
+
+    def token(self) -> None:
+        if self.first_token is None:
+            self.first_token = time.perf_counter()
+        self.chunks += 1
+
+    def finish(self, completion_tokens: Optional[int]) -> dict:
+        self.finished = time.perf_counter()
+        # Usage is exact; the chunk count is close when usage is not reported
+        self.tokens = completion_tokens if completion_tokens is not None else self.chunks
+        metrics = self.metrics()
+        recent.append(metrics)
+        counters["completed"] += 1
+        logger.info("completion tokens=%d ttft_ms=%s tokens_per_second=%s total_ms=%s",
+                    self.tokens, metrics["ttft_ms"], metrics["tokens_per_second"], metrics["total_ms"])
+        return metrics
+
+    def metrics(self) -> dict:
+        end = self.finished or time.perf_counter()
+        first = self.first_token or end
+        generating = end - first
+        return {
+            "ttft_ms": round((first - self.started) * 1000, 1),
+            "total_ms": round((end - self.started) * 1000, 1),
+            "completion_tokens": self.tokens,
+            # Decode rate after the first token, so queueing does not dilute it
+            "tokens_per_second": round(self.tokens / generating, 1) if generating > 0 else None,
+        }
+
+
+async def acquire_slot() -> None:
+    try:
+        await asyncio.wait_for(slots.acquire(), timeout=QUEUE_TIMEOUT)
+    except asyncio.TimeoutError:
+        counters["rejected"] += 1
+        raise HTTPException(status_code=503, detail="Too many completions in flight",
+                            headers={"Retry-After": str(max(1, round(QUEUE_TIMEOUT)))})
+    counters["in_flight"] += 1
+
+
+def release_slot() -> None:
+    counters["in_flight"] -= 1
+    slots.release()
+
+
+class SlotStreamingResponse(StreamingResponse):
+    """Releases the slot acquired by /code however the response ends, even unstarted"""
+
+    async def __call__(self, scope, receive, send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            release_slot()
+
+
+def upstream_error(err: APIError) -> HTTPException:
+    counters["failed"] += 1
+    if isinstance(err, RateLimitError):
+        return HTTPException(status_code=503, detail=f"Azure OpenAI is rate limiting: {err}",
+                             headers={"Retry-After": err.response.headers.get("retry-after", "5")})
+    return HTTPException(status_code=502, detail=f"Azure OpenAI error: {err}")
+
+
+def chat_request(prompt: str) -> dict:
+    return {
+        "model": os.getenv("AZURE_OPENAI_DEPLOYMENT_NAME"),
+        "messages": [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": prompt},
         ],
-        max_completion_tokens=2048,
+        "max_completion_tokens": MAX_TOKENS,
+    }
+
+
+def cacheable(finish_reason: Optional[str]) -> bool:
+    # A filtered answer may pass on the next attempt, so it is not kept
+    return finish_reason in ("stop", "length")
+
+
+@app.post("/code")
+async def code(prompt: Prompt, cache_control: Optional[str] = Header(None)):
+    key = None
+    if CACHE_ENABLED:
+        key = cache_key(os.getenv("AZURE_OPENAI_DEPLOYMENT_NAME"), SYSTEM_PROMPT, prompt.prompt, MAX_TOKENS)
+        if "no-cache" in (cache_control or "").lower():
+            response_cache.bypassed += 1
+        elif (cached := await response_cache.get(key)) is not None:
+            return cached_response(cached, prompt.stream)
+
+    # The slot is taken before a stream starts, so a full server answers 503
+    # instead of an empty stream
+    await acquire_slot()
+    if prompt.stream:
+        return SlotStreamingResponse(
+            stream_completion(prompt.prompt, key),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+
+    try:
+        timing = Completion()
+        try:
+            response = await client.chat.completions.create(**chat_request(prompt.prompt))
+        except APIError as err:
+            raise upstream_error(err)
+        # Without streaming the first token arrives with the last, so there is
+        # no decode rate to report
+        completion_tokens = response.usage.completion_tokens if response.usage else None
+        metrics = timing.finish(completion_tokens)
+    finally:
+        release_slot()
+    choice = response.choices[0]
+    if key is not None and choice.message.content and cacheable(choice.finish_reason):
+        await response_cache.set(key, {"chunks": [choice.message.content], "completion_tokens": completion_tokens})
+    return {"output": choice.message.content, "metrics": metrics, "cached": False}
+
+
+def cached_response(cached: dict, stream: bool):
+    """Answer from the cache: the stored chunks, streamed back without delay"""
+    started = time.perf_counter()
+
+    def metrics() -> dict:
+        elapsed = round((time.perf_counter() - started) * 1000, 1)
+        return {"ttft_ms": elapsed, "total_ms": elapsed,
+                "completion_tokens": cached["completion_tokens"], "tokens_per_second": None}
+
+    if not stream:
+        return {"output": "".join(cached["chunks"]), "metrics": metrics(), "cached": True}
+
+    async def replay() -> AsyncIterator[str]:
+        for content in cached["chunks"]:
+            yield sse("token", {"content": content})
+        yield sse("done", {**metrics(), "cached": True})
+
+    return StreamingResponse(
+        replay(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
     )
-    return {"output": response.choices[0].message.content}
+
+
+def sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def stream_completion(prompt: str, key: Optional[str] = None) -> AsyncIterator[str]:
+    """Forward tokens as they arrive; the slot is released by SlotStreamingResponse"""
+    timing = Completion()
+    usage = None
+    chunks = []
+    finish_reason = None
+    try:
+        stream = await client.chat.completions.create(
+            **chat_request(prompt), stream=True, stream_options={"include_usage": True}
+        )
+        try:
+            async for chunk in stream:
+                if chunk.usage is not None:
+                    usage = chunk.usage.completion_tokens
+                # Azure sends content-filter results in chunks without choices
+                if not chunk.choices:
+                    continue
+                finish_reason = chunk.choices[0].finish_reason or finish_reason
+                content = chunk.choices[0].delta.content
+                if content:
+                    timing.token()
+                    chunks.append(content)
+                    yield sse("token", {"content": content})
+        finally:
+            # Also stops generation upstream when the client went away
+            await stream.close()
+        metrics = timing.finish(usage)
+        # Only a completion that ran to the end is cached
+        if key is not None and chunks and cacheable(finish_reason):
+            await response_cache.set(key, {"chunks": chunks, "completion_tokens": metrics["completion_tokens"]})
+        yield sse("done", {**metrics, "cached": False})
+    except APIError as err:
+        error = upstream_error(err)
+        yield sse("error", {"status_code": error.status_code, "detail": error.detail, **timing.metrics()})
+
+
+def percentile(values: list, p: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+
+
+@app.get("/stats")
+async def stats():
+    ttft = [m["ttft_ms"] for m in recent]
+    rates = [m["tokens_per_second"] for m in recent if m["tokens_per_second"] is not None]
+    return {
+        **counters,
+        "max_concurrency": MAX_CONCURRENCY,
+        "recent": len(recent),
+        "ttft_ms": {"p50": percentile(ttft, 50), "p95": percentile(ttft, 95)},
+        "tokens_per_second": {"p50": percentile(rates, 50), "p5": percentile(rates, 5)},
+        "cache": response_cache.stats(),
+    }
@@ -0,0 +1,185 @@
+# aeon_cache.py
+#
+# Response cache for aeon_api's /code endpoint.
+#
+# Entries are keyed by deployment, system message, max tokens and the prompt
+# after normalization: leading and trailing whitespace trimmed, and optionally
+# runs of whitespace collapsed and case folded. Whitespace inside a prompt is
+# kept by default, since for code indentation changes the answer. Entries keep the completion's content chunks, so a streamed hit
+# replays the same token events, without delay.
+#
+# Two tiers: an in-memory LRU in front of a SQLite file that survives
+# restarts and is shared by the workers on one host. Both expire entries
+# after AEON_CACHE_TTL and are bounded in size.
+#
+# Configuration (environment):
+#   AEON_CACHE                  "0" disables the cache (default 1)
+#   AEON_CACHE_SIZE             Entries in memory (default 512)
+#   AEON_CACHE_TTL              Seconds before an entry expires (default 86400)
+#   AEON_CACHE_DB               SQLite file; empty for memory only (default aeon_cache.db)
+#   AEON_CACHE_DB_SIZE          Entries kept in SQLite (default 10000)
+#   AEON_CACHE_FOLD_WHITESPACE  "1" to collapse runs of whitespace in prompts (default 0)
+#   AEON_CACHE_FOLD_CASE        "1" to ignore case in prompts (default 0)
+
+import os
+import re
+import json
+import time
+import asyncio
+import hashlib
+import logging
+import sqlite3
+from collections import OrderedDict
+from typing import Optional
+
+logger = logging.getLogger("aeon_cache")
+
+CACHE_ENABLED = os.getenv("AEON_CACHE", "1") != "0"
+CACHE_SIZE = int(os.getenv("AEON_CACHE_SIZE", "512"))
+CACHE_TTL = float(os.getenv("AEON_CACHE_TTL", "86400"))
+CACHE_DB = os.getenv("AEON_CACHE_DB", "aeon_cache.db")
+CACHE_DB_SIZE = int(os.getenv("AEON_CACHE_DB_SIZE", "10000"))
+FOLD_WHITESPACE = os.getenv("AEON_CACHE_FOLD_WHITESPACE", "0") == "1"
+FOLD_CASE = os.getenv("AEON_CACHE_FOLD_CASE", "0") == "1"
+
+# Expired rows are swept and the table trimmed every this many writes
+PRUNE_EVERY = 100
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize(prompt: str) -> str:
+    prompt = prompt.strip()
+    if FOLD_WHITESPACE:
+        prompt = _WHITESPACE.sub(" ", prompt)
+    if FOLD_CASE:
+        prompt = prompt.casefold()
+    return prompt
+
+
+def cache_key(deployment: Optional[str], system: str, prompt: str, max_tokens: int) -> str:
+    material = json.dumps([deployment, system, max_tokens, normalize(prompt)])
+    return hashlib.sha256(material.encode()).hexdigest()
+
+
+class ResponseCache:
+    """Memory LRU in front of an optional SQLite tier, with hit/miss counters"""
+
+    def __init__(self, max_entries: int, ttl: float, db_path: Optional[str], db_max_entries: int):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.db_path = db_path or None
+        self.db_max_entries = db_max_entries
+        self._memory: OrderedDict[str, tuple[float, dict]] = OrderedDict()
+        self._writes = 0
+        self.hits = 0
+        self.db_hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.stored = 0
+        if self.db_path:
+            conn = self._connect()
+            try:
+                # WAL lets other workers read during a write
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS responses ("
+                    "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+                )
+                conn.execute("CREATE INDEX IF NOT EXISTS responses_expires ON responses(expires_at)")
+                conn.commit()
+            finally:
+                conn.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path, timeout=5.0)
+
+    def _remember(self, key: str, value: dict, expires_at: float) -> None:
+        self._memory[key] = (expires_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _db_get(self, key: str) -> Optional[tuple[float, dict]]:
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                "SELECT expires_at, value FROM responses WHERE key = ? AND expires_at >= ?",
+                (key, time.time())
+            ).fetchone()
+        finally:
+            conn.close()
+        return (row[0], json.loads(row[1])) if row else None
+
+    def _db_set(self, key: str, value: dict, expires_at: float) -> None:
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO responses (key, value, expires_at) VALUES (?, ?, ?)",
+                    (key, json.dumps(value), expires_at)
+                )
+                self._writes += 1
+                if self._writes % PRUNE_EVERY == 0:
+                    conn.execute("DELETE FROM responses WHERE expires_at < ?", (time.time(),))
+                    conn.execute(
+                        "DELETE FROM responses WHERE key NOT IN "
+                        "(SELECT key FROM responses ORDER BY expires_at DESC LIMIT ?)",
+                        (self.db_max_entries,)
+                    )
+        finally:
+            conn.close()
+
+    async def get(self, key: str) -> Optional[dict]:
+        """{"chunks": [...], "completion_tokens": n} cached for key, or None"""
+        entry = self._memory.get(key)
+        if entry is not None:
+            if entry[0] >= time.time():
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            del self._memory[key]
+
+        if self.db_path:
+            try:
+                entry = await asyncio.to_thread(self._db_get, key)
+            except sqlite3.Error as err:
+                logger.warning("response cache read failed: %s", err)
+                entry = None
+            if entry is not None:
+                self._remember(key, entry[1], entry[0])
+                self.hits += 1
+                self.db_hits += 1
+                return entry[1]
+
+        self.misses += 1
+        return None
+
+    async def set(self, key: str, value: dict) -> None:
+        expires_at = time.time() + self.ttl
+        self._remember(key, value, expires_at)
+        self.stored += 1
+        if self.db_path:
+            try:
+                await asyncio.to_thread(self._db_set, key, value, expires_at)
+            except sqlite3.Error as err:
+                logger.warning("response cache write failed: %s", err)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": CACHE_ENABLED,
+            "entries": len(self._memory),
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "db_hits": self.db_hits,
+            "misses": self.misses,
+            "bypassed": self.bypassed,
+            "stored": self.stored,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+            "db": self.db_path,
+        }
+
+
+response_cache = ResponseCache(CACHE_SIZE, CACHE_TTL, CACHE_DB if CACHE_ENABLED else None, CACHE_DB_SIZE)
@@ -6,27 +6,120 @@ Run with: uvicorn api:app --reload --port 8000
 """
 
 import os
+import json
+import math
+import time
+import base64
 import uuid
 import httpx
 import asyncio
-from typing import Optional
-from fastapi import FastAPI, File, UploadFile, Form, HTTPException
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
+from fastapi import FastAPI, File, UploadFile, Form, HTTPException, Depends, Request
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import FileResponse, PlainTextResponse, Response, StreamingResponse
+from pydantic import BaseModel, Field, TypeAdapter, ValidationError
 
 from prompt_generator import (
     build_kitchen_refacing_prompt,
+    build_kitchen_refacing_prompts,
     analyze_kitchen_image,
+    analysis_cache,
     DoorStyle,
     HardwareStyle,
     HardwareFinish,
     LightingType
 )
+from http_client import start_http_client, close_http_client, get_http_client, pool_stats
+from predictions import (
+    REPLICATE_API_BASE,
+    RateLimitedError,
+    ReplicateError,
+    run_prediction,
+    resume_unfinished,
+    stop_following,
+    registry,
+    verify_webhook_signature,
+    prediction_stats
+)
+from jobs import job_queue, QueueFullError, StageCallback
+from cache import content_key, url_key, build_cache, SingleFlight
+from timings import StageTimer
+from resilience import CircuitOpenError, DeadlineExceeded, breaker_stats, deadline
+from telemetry import (
+    RequestIdMiddleware,
+    CallbackMetric,
+    configure_logging,
+    register,
+    render_metrics,
+    span
+)
+from ingest import BodyLimitMiddleware, ingest_upload, ingest_stats, read_upload
+from progress import ClientDisconnected, report, stream as progress_stream, until_disconnected
+from images import (
+    CACHE_CONTROL,
+    ImageNotFound,
+    etag,
+    etag_matches,
+    image_stats,
+    media_type,
+    negotiate_format,
+    original,
+    proxy_url,
+    record_not_modified,
+    record_response,
+    remember as remember_image,
+    snap_width,
+    variant
+)
+from storage import CONTENT_TYPES, LocalStorage, StorageError, storage, stats as upload_stats, storage_stats
+from hedging import HEDGED_RENDERS, hedge_stats, hedged
+from speculation import (
+    SPECULATIVE_RENDER,
+    Guess,
+    guess_analysis,
+    matches,
+    speculation_stats,
+    stats as speculation
+)
+
+configure_logging()
+
+# Longest we wait on a Nano-Banana render before giving up
+NANO_BANANA_TIMEOUT = float(os.environ.get("NANO_BANANA_TIMEOUT", "120"))
+
+# Render output URLs keyed by image + prompt. Replicate delivery URLs expire
+# after an hour, so the default TTL stays under that.
+render_cache = build_cache("RENDER_CACHE", default_size=512, default_ttl=3000)
+render_flight = SingleFlight(cancel_orphans=True)
+
+# Uploads up to this size are analyzed from an inline data URI while the
+# upload to temporary storage is still in flight (0 disables)
+ANALYZE_INLINE_MAX_BYTES = int(os.environ.get("ANALYZE_INLINE_MAX_BYTES", str(256 * 1024)))
+
+# Batch visualization: variants per request and renders running at once
+BATCH_MAX_VARIANTS = int(os.environ.get("BATCH_MAX_VARIANTS", "8"))
+BATCH_RENDER_CONCURRENCY = int(os.environ.get("BATCH_RENDER_CONCURRENCY", "4"))
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # One pooled client for every outbound Replicate call
+    await start_http_client()
+    await job_queue.start()
+    # Follow the predictions the previous process left running (see ledger.py)
+    await resume_unfinished(get_http_client(), os.environ.get("REPLICATE_API_TOKEN"))
+    yield
+    await job_queue.stop()
+    await stop_following()
+    await close_http_client()
+
 
 app = FastAPI(
     title="AEON Visualizer API",
     description="Kitchen cabinet refacing visualization powered by AEON prompt generation",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # CORS for Next.js frontend
@@ -36,27 +129,54 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Request-ID"],
 )
 
+# Oversized bodies are refused before the form parser spools them
+app.add_middleware(BodyLimitMiddleware)
 
-class VisualizerRequest(BaseModel):
-    image_url: str
+# Outermost, so the request id covers CORS preflights and every log line
+app.add_middleware(RequestIdMiddleware)
+
+
+class RenderOptions(BaseModel):
     door_style: DoorStyle
     color_hex: str
     color_name: str
     hardware_style: HardwareStyle
     hardware_finish: HardwareFinish
+
+
+class VisualizerRequest(RenderOptions):
+    image_url: str
     name: str
     phone: str
     skip_analysis: bool = False  # Skip BLIP-2 analysis for faster processing
+    bypass_cache: bool = False  # Force a fresh render instead of reusing a cached one
+
+
+class BatchVisualizerRequest(BaseModel):
+    image_url: str
+    variants: list[RenderOptions] = Field(min_length=1, max_length=BATCH_MAX_VARIANTS)
+    name: str
+    phone: str
+    skip_analysis: bool = False
+    bypass_cache: bool = False
 
 
 class VisualizerResponse(BaseModel):
     success: bool
     original_url: str
     final_url: str
+    proxy_url: Optional[str] = None
     prompt_used: str
     analysis: Optional[dict] = None
+    timings: Optional[dict] = None
+    speculation: Optional[dict] = None
+
+
+class PresignRequest(BaseModel):
+    content_type: str = "image/jpeg"
 
 
 class PromptOnlyRequest(BaseModel):
@@ -82,8 +202,18 @@ async def root():
         "endpoints": {
             "POST /visualize": "Full visualization pipeline",
             "POST /visualize/upload": "Upload image and visualize",
+            "POST /uploads/presign": "Signed target for uploading an image straight to storage",
             "POST /prompt/generate": "Generate prompt only (no image processing)",
-            "POST /analyze": "Analyze kitchen image only"
+            "POST /analyze": "Analyze kitchen image only",
+            "POST /visualize/batch": "Render several variants of one image (NDJSON or SSE stream)",
+            "POST /visualize/batch/upload": "Upload image and render several variants",
+            "POST /jobs/visualize": "Queue a visualization job (returns job id)",
+            "POST /jobs/visualize/upload": "Upload image and queue a visualization job",
+            "GET /jobs/{id}": "Job status and result",
+            "GET /jobs/{id}/events": "Job progress stream (SSE)",
+            "POST /webhooks/replicate": "Replicate prediction completion webhook",
+            "GET /stats": "Connection pool and prediction counters",
+            "GET /metrics": "Prometheus metrics (stage and prediction latency histograms)"
         }
     }
 
@@ -113,76 +243,384 @@ async def generate_prompt_only(request: PromptOnlyRequest):
 
 
 @app.post("/analyze")
-async def analyze_image(image_url: str = Form(...)):
+async def analyze_image(
+    image_url: str = Form(...),
+    client: httpx.AsyncClient = Depends(get_http_client)
+):
     """
     Analyze a kitchen image using BLIP-2 vision model.
     Returns structured analysis for prompt generation.
     """
-    analysis = await analyze_kitchen_image(image_url)
+    analysis = await analyze_kitchen_image(image_url, client=client)
     return {"success": True, "analysis": analysis}
 
 
 @app.post("/visualize", response_model=VisualizerResponse)
-async def visualize(request: VisualizerRequest):
+async def visualize(
+    request: VisualizerRequest,
+    http_request: Request,
+    client: httpx.AsyncClient = Depends(get_http_client)
+):
     """
     Full visualization pipeline:
     1. Analyze image with BLIP-2 (optional)
     2. Generate AEON prompt
     3. Run Nano-Banana transformation
     4. Return results
+    If the client disconnects first, the pipeline and its predictions are cancelled.
     """
-    replicate_token = os.environ.get("REPLICATE_API_TOKEN")
-    if not replicate_token:
-        raise HTTPException(status_code=500, detail="REPLICATE_API_TOKEN not configured")
+    replicate_token = require_replicate_token()
 
-    # Step 1: Analyze image (optional)
-    if request.skip_analysis:
-        analysis = {
-            "image_description": "Kitchen with cabinets",
-            "drawers_missing": False,
-            "is_angled_photo": False,
-            "has_arched_doors": False,
-            "lighting": "neutral",
-            "needs_cleanup": False,
-            "warped_perspective": False
-        }
-    else:
-        analysis = await analyze_kitchen_image(request.image_url)
+    result = await unless_disconnected(http_request, lambda: run_visualization_pipeline(
+        image_url=request.image_url,
+        options=request,
+        skip_analysis=request.skip_analysis,
+        bypass_cache=request.bypass_cache,
+        replicate_token=replicate_token,
+        client=client
+    ))
 
-    # Step 2: Generate AEON prompt
-    prompt = build_kitchen_refacing_prompt(
-        image_description=analysis["image_description"],
-        door_style=request.door_style,
-        color_hex=request.color_hex,
-        color_name=request.color_name,
-        hardware_style=request.hardware_style,
-        hardware_finish=request.hardware_finish,
-        drawers_missing=analysis["drawers_missing"],
-        is_angled_photo=analysis["is_angled_photo"],
-        has_arched_doors=analysis["has_arched_doors"],
-        lighting=analysis["lighting"],
-        needs_cleanup=analysis["needs_cleanup"],
-        warped_perspective=analysis["warped_perspective"]
+    return VisualizerResponse(success=True, **result)
+
+
+@app.post("/visualize/upload")
+async def visualize_upload(
+    http_request: Request,
+    image: UploadFile = File(...),
+    door_style: DoorStyle = Form(...),
+    color_hex: str = Form(...),
+    color_name: str = Form(...),
+    hardware_style: HardwareStyle = Form(...),
+    hardware_finish: HardwareFinish = Form(...),
+    name: str = Form(...),
+    phone: str = Form(...),
+    skip_analysis: bool = Form(False),
+    bypass_cache: bool = Form(False),
+    client: httpx.AsyncClient = Depends(get_http_client)
+):
+    """
+    Upload image directly and run full visualization pipeline.
+    The upload to temporary storage overlaps with hashing, the analysis
+    cache lookup and (for small images) the analysis itself. Cancelled if
+    the client disconnects, like /visualize.
+    """
+    replicate_token = require_replicate_token()
+
+    # Bounded streaming read, then downscale / strip EXIF off the event loop
+    image_bytes, content_type = await ingest_upload(image)
+
+    result = await unless_disconnected(http_request, lambda: run_upload_pipeline(
+        image_bytes=image_bytes,
+        content_type=content_type,
+        options=RenderOptions(
+            door_style=door_style,
+            color_hex=color_hex,
+            color_name=color_name,
+            hardware_style=hardware_style,
+            hardware_finish=hardware_finish
+        ),
+        skip_analysis=skip_analysis,
+        bypass_cache=bypass_cache,
+        replicate_token=replicate_token,
+        client=client
+    ))
+
+    return {"success": True, **result, "lead": {"name": name, "phone": phone}}
+
+
+async def unless_disconnected(http_request: Request, run) -> dict:
+    """Run a pipeline, cancelling it (and its predictions) when the client goes away"""
+    try:
+        return await until_disconnected(run, http_request.is_disconnected)
+    except ClientDisconnected as err:
+        # Nobody reads this answer; 499 is the conventional "client closed request"
+        raise HTTPException(status_code=499, detail=str(err))
+
+
+@app.post("/visualize/stream")
+async def visualize_stream(
+    request: VisualizerRequest,
+    http_request: Request,
+    format: Optional[str] = None,
+    client: httpx.AsyncClient = Depends(get_http_client)
+):
+    """
+    /visualize with progress: streams an event as each stage completes
+    (upload, analysis, prompt, prediction status changes, Replicate log
+    lines) and finally "result" with the /visualize response body, or
+    "error". SSE by default; format=ndjson for NDJSON.
+    """
+    replicate_token = require_replicate_token()
+
+    async def run() -> dict:
+        result = await run_visualization_pipeline(
+            image_url=request.image_url,
+            options=request,
+            skip_analysis=request.skip_analysis,
+            bypass_cache=request.bypass_cache,
+            replicate_token=replicate_token,
+            client=client
+        )
+        return {"success": True, **result}
+
+    return event_stream_response(
+        progress_stream(run, disconnected=http_request.is_disconnected), http_request, format or "sse"
     )
 
-    # Step 3: Run Nano-Banana
-    final_url = await run_nano_banana(
-        image_url=request.image_url,
-        prompt=prompt,
-        replicate_token=replicate_token
+
+@app.post("/visualize/upload/stream")
+async def visualize_upload_stream(
+    http_request: Request,
+    image: UploadFile = File(...),
+    door_style: DoorStyle = Form(...),
+    color_hex: str = Form(...),
+    color_name: str = Form(...),
+    hardware_style: HardwareStyle = Form(...),
+    hardware_finish: HardwareFinish = Form(...),
+    name: str = Form(...),
+    phone: str = Form(...),
+    skip_analysis: bool = Form(False),
+    bypass_cache: bool = Form(False),
+    format: Optional[str] = None,
+    client: httpx.AsyncClient = Depends(get_http_client)
+):
+    """Upload variant of /visualize/stream"""
+    replicate_token = require_replicate_token()
+    image_bytes, content_type = await ingest_upload(image)
+
+    async def run() -> dict:
+        result = await run_upload_pipeline(
+            image_bytes=image_bytes,
+            content_type=content_type,
+            options=RenderOptions(
+                door_style=door_style,
+                color_hex=color_hex,
+                color_name=color_name,
+                hardware_style=hardware_style,
+                hardware_finish=hardware_finish
+            ),
+            skip_analysis=skip_analysis,
+            bypass_cache=bypass_cache,
+            replicate_token=replicate_token,
+            client=client
+        )
+        return {"success": True, **result, "lead": {"name": name, "phone": phone}}
+
+    return event_stream_response(
+        progress_stream(run, disconnected=http_request.is_disconnected), http_request, format or "sse"
     )
 
-    return VisualizerResponse(
-        success=True,
-        original_url=request.image_url,
-        final_url=final_url,
-        prompt_used=prompt,
-        analysis=analysis
+
+@app.post("/uploads/presign")
+async def presign_upload(request: PresignRequest, http_request: Request):
+    """
+    Issue a short-lived upload target so the browser sends the photo straight
+    to object storage. POST a multipart form to `url` with every entry of
+    `fields` followed by the image as `file`, then call /visualize with
+    `image_url`. Only available when STORAGE_BACKEND is set.
+    """
+    if storage is None:
+        raise HTTPException(status_code=404, detail="Direct uploads are not enabled (STORAGE_BACKEND)")
+    try:
+        upload = await asyncio.to_thread(storage.presign, request.content_type, str(http_request.base_url))
+    except StorageError as err:
+        raise HTTPException(status_code=err.status_code, detail=str(err))
+    upload_stats.presigned += 1
+    return {"success": True, **upload.to_dict()}
+
+
+def local_storage() -> LocalStorage:
+    """The local storage stand-in; its routes do not exist with other backends"""
+    if not isinstance(storage, LocalStorage):
+        raise HTTPException(status_code=404, detail="Not found")
+    return storage
+
+
+@app.post("/uploads/{key}", status_code=204)
+async def receive_local_upload(
+    key: str,
+    file: UploadFile = File(...),
+    content_type: str = Form(..., alias="Content-Type"),
+    expires: str = Form(...),
+    max_bytes: str = Form(...),
+    signature: str = Form(...),
+    store: LocalStorage = Depends(local_storage)
+):
+    """Local stand-in for a presigned object storage POST (STORAGE_BACKEND=local)"""
+    try:
+        limit = store.verify(key, content_type, expires, max_bytes, signature)
+        # Replays are refused before their body is read
+        if await asyncio.to_thread(store.exists, key):
+            raise StorageError("Object already uploaded", 409)
+    except StorageError as err:
+        upload_stats.rejected += 1
+        raise HTTPException(status_code=err.status_code, detail=str(err))
+
+    data = await read_upload(file, max_bytes=limit)
+    try:
+        await asyncio.to_thread(store.write, key, data)
+    except StorageError as err:
+        upload_stats.rejected += 1
+        raise HTTPException(status_code=err.status_code, detail=str(err))
+    upload_stats.local_uploads += 1
+    upload_stats.local_bytes += len(data)
+    return Response(status_code=204)
+
+
+@app.get("/uploads/{key}")
+async def serve_local_upload(key: str, store: LocalStorage = Depends(local_storage)):
+    """Objects stored by the local backend, until they expire. Keys are random and written once (see LocalStorage.write)."""
+    try:
+        path = store.path(key)
+    except StorageError as err:
+        raise HTTPException(status_code=err.status_code, detail=str(err))
+    if not await asyncio.to_thread(store.fresh, path):
+        raise HTTPException(status_code=404, detail="Not found")
+    media_type = next(t for t, ext in CONTENT_TYPES.items() if key.endswith(f".{ext}"))
+    return FileResponse(path, media_type=media_type, headers={"Cache-Control": f"public, max-age={store.ttl}"})
+
+
+@app.post("/visualize/batch")
+async def visualize_batch(
+    request: BatchVisualizerRequest,
+    http_request: Request,
+    format: Optional[str] = None,
+    client: httpx.AsyncClient = Depends(get_http_client)
+):
+    """
+    Render several door style / color / hardware variants of one image.
+    The image is analyzed once, then the renders fan out and each variant is
+    streamed back as soon as it finishes (NDJSON, or SSE with format=sse or
+    Accept: text/event-stream).
+    """
+    replicate_token = require_replicate_token()
+
+    async def events() -> AsyncIterator[dict]:
+        with deadline():
+            timer = StageTimer()
+            if request.skip_analysis:
+                analysis = skipped_analysis()
+            else:
+                analysis = await timer.track("analysis", analyze_kitchen_image(request.image_url, client=client))
+
+            async for event in run_batch_pipeline(
+                image_url=request.image_url,
+                image_key=None,
+                analysis=analysis,
+                variants=request.variants,
+                replicate_token=replicate_token,
+                client=client,
+                timer=timer,
+                bypass_cache=request.bypass_cache
+            ):
+                yield event
+
+    return event_stream_response(events(), http_request, format)
+
+
+@app.post("/visualize/batch/upload")
+async def visualize_batch_upload(
+    http_request: Request,
+    image: UploadFile = File(...),
+    variants: str = Form(..., description="JSON list of {door_style, color_hex, color_name, hardware_style, hardware_finish}"),
+    name: str = Form(...),
+    phone: str = Form(...),
+    skip_analysis: bool = Form(False),
+    bypass_cache: bool = Form(False),
+    format: Optional[str] = None,
+    client: httpx.AsyncClient = Depends(get_http_client)
+):
+    """
+    Upload variant of /visualize/batch. The image is uploaded and analyzed
+    once for all variants.
+    """
+    replicate_token = require_replicate_token()
+    variant_list = parse_variants(variants)
+    image_bytes, content_type = await ingest_upload(image)
+
+    async def events() -> AsyncIterator[dict]:
+        with deadline():
+            timer = StageTimer()
+            upload, image_key, analysis = await start_upload_and_analysis(
+                image_bytes, content_type, skip_analysis, client, timer, lambda stage: None
+            )
+            try:
+                image_url = await upload
+            finally:
+                upload.cancel()
+
+            async for event in run_batch_pipeline(
+                image_url=image_url,
+                image_key=image_key,
+                analysis=analysis,
+                variants=variant_list,
+                replicate_token=replicate_token,
+                client=client,
+                timer=timer,
+                bypass_cache=bypass_cache
+            ):
+                yield event
+
+    return event_stream_response(events(), http_request, format)
+
+
+def parse_variants(raw: str) -> list[RenderOptions]:
+    """Validate the JSON variants form field of /visualize/batch/upload"""
+    try:
+        variants = TypeAdapter(list[RenderOptions]).validate_json(raw)
+    except ValidationError as err:
+        raise HTTPException(status_code=422, detail=err.errors(include_url=False))
+    if not 1 <= len(variants) <= BATCH_MAX_VARIANTS:
+        raise HTTPException(status_code=422, detail=f"Between 1 and {BATCH_MAX_VARIANTS} variants are required")
+    return variants
+
+
+def event_stream_response(events: AsyncIterator[dict], request: Request, format: Optional[str]) -> StreamingResponse:
+    """Stream events as SSE (format=sse or Accept: text/event-stream) or NDJSON"""
+    use_sse = format == "sse" or (format is None and "text/event-stream" in request.headers.get("accept", ""))
+
+    async def body():
+        async for event in events:
+            if use_sse:
+                yield f"event: {event['event']}\ndata: {json.dumps(event)}\n\n"
+            else:
+                yield json.dumps(event) + "\n"
+
+    return StreamingResponse(
+        body(),
+        media_type="text/event-stream" if use_sse else "application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
     )
 
 
-@app.post("/visualize/upload")
-async def visualize_upload(
+@app.post("/jobs/visualize", status_code=202)
+async def submit_visualize_job(
+    request: VisualizerRequest,
+    client: httpx.AsyncClient = Depends(get_http_client)
+):
+    """
+    Job mode for /visualize: returns a job id immediately.
+    Follow it with GET /jobs/{id} or GET /jobs/{id}/events (SSE).
+    """
+    replicate_token = require_replicate_token()
+
+    async def runner(on_stage: StageCallback) -> dict:
+        result = await run_visualization_pipeline(
+            image_url=request.image_url,
+            options=request,
+            skip_analysis=request.skip_analysis,
+            bypass_cache=request.bypass_cache,
+            replicate_token=replicate_token,
+            client=client,
+            on_stage=on_stage
+        )
+        return {"success": True, **result}
+
+    return await submit_job(runner)
+
+
+@app.post("/jobs/visualize/upload", status_code=202)
+async def submit_visualize_upload_job(
     image: UploadFile = File(...),
     door_style: DoorStyle = Form(...),
     color_hex: str = Form(...),
@@ -191,45 +629,112 @@ async def visualize_upload(
     hardware_finish: HardwareFinish = Form(...),
     name: str = Form(...),
     phone: str = Form(...),
-    skip_analysis: bool = Form(False)
+    skip_analysis: bool = Form(False),
+    bypass_cache: bool = Form(False),
+    client: httpx.AsyncClient = Depends(get_http_client)
 ):
     """
-    Upload image directly and run full visualization pipeline.
-    Image is uploaded to temporary storage first.
+    Job mode for /visualize/upload. The image is read and downscaled before the
+    job is queued; the upload to temporary storage happens inside the job.
     """
+    replicate_token = require_replicate_token()
+    image_bytes, content_type = await ingest_upload(image)
+    options = RenderOptions(
+        door_style=door_style,
+        color_hex=color_hex,
+        color_name=color_name,
+        hardware_style=hardware_style,
+        hardware_finish=hardware_finish
+    )
+
+    async def runner(on_stage: StageCallback) -> dict:
+        result = await run_upload_pipeline(
+            image_bytes=image_bytes,
+            content_type=content_type,
+            options=options,
+            skip_analysis=skip_analysis,
+            bypass_cache=bypass_cache,
+            replicate_token=replicate_token,
+            client=client,
+            on_stage=on_stage
+        )
+        return {"success": True, **result, "lead": {"name": name, "phone": phone}}
+
+    return await submit_job(runner)
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Current stage of a visualization job, plus its result once finished"""
+    job = await job_queue.lookup(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
+
+
+@app.get("/jobs/{job_id}/events")
+async def stream_job_events(job_id: str):
+    """Server-Sent Events stream of a job's stage changes, ending when it finishes"""
+    job = await job_queue.lookup(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    async def event_stream():
+        async for event in job_queue.events(job):
+            yield f"event: {event['stage']}\ndata: {json.dumps(event)}\n\n"
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+async def submit_job(runner) -> dict:
+    """Queue a job runner, mapping a full queue to 429"""
+    try:
+        job = await job_queue.submit(runner)
+    except QueueFullError as err:
+        raise HTTPException(status_code=429, detail=str(err), headers={"Retry-After": "5"})
+
+    return {
+        "success": True,
+        "job_id": job.id,
+        "status": job.status,
+        "status_url": f"/jobs/{job.id}",
+        "events_url": f"/jobs/{job.id}/events"
+    }
+
+
+def require_replicate_token() -> str:
     replicate_token = os.environ.get("REPLICATE_API_TOKEN")
     if not replicate_token:
         raise HTTPException(status_code=500, detail="REPLICATE_API_TOKEN not configured")
+    return replicate_token
 
-    # Read image bytes
-    image_bytes = await image.read()
-    
-    # For production, upload to Supabase/S3/etc.
-    # For now, we'll use a data URI or temporary upload
-    # This is a placeholder - implement your storage solution
-    image_url = await upload_to_temp_storage(image_bytes, image.content_type or "image/jpeg")
-
-    # Run the visualization pipeline
-    if skip_analysis:
-        analysis = {
-            "image_description": "Kitchen with cabinets",
-            "drawers_missing": False,
-            "is_angled_photo": False,
-            "has_arched_doors": False,
-            "lighting": "neutral",
-            "needs_cleanup": False,
-            "warped_perspective": False
-        }
-    else:
-        analysis = await analyze_kitchen_image(image_url)
 
-    prompt = build_kitchen_refacing_prompt(
+def skipped_analysis() -> dict:
+    """Analysis used when the client asks to skip BLIP-2"""
+    return {
+        "image_description": "Kitchen with cabinets",
+        "drawers_missing": False,
+        "is_angled_photo": False,
+        "has_arched_doors": False,
+        "lighting": "neutral",
+        "needs_cleanup": False,
+        "warped_perspective": False
+    }
+
+
+def build_prompt(analysis: dict, options: RenderOptions) -> str:
+    """Generate the AEON prompt for one set of render options"""
+    return build_kitchen_refacing_prompt(
         image_description=analysis["image_description"],
-        door_style=door_style,
-        color_hex=color_hex,
-        color_name=color_name,
-        hardware_style=hardware_style,
-        hardware_finish=hardware_finish,
+        door_style=options.door_style,
+        color_hex=options.color_hex,
+        color_name=options.color_name,
+        hardware_style=options.hardware_style,
+        hardware_finish=options.hardware_finish,
         drawers_missing=analysis["drawers_missing"],
         is_angled_photo=analysis["is_angled_photo"],
         has_arched_doors=analysis["has_arched_doors"],
@@ -238,84 +743,443 @@ async def visualize_upload(
         warped_perspective=analysis["warped_perspective"]
     )
 
-    final_url = await run_nano_banana(
+
+async def run_visualization_pipeline(
+    image_url: str,
+    options: RenderOptions,
+    skip_analysis: bool,
+    replicate_token: str,
+    client: httpx.AsyncClient,
+    bypass_cache: bool = False,
+    image_key: Optional[str] = None,
+    on_stage: Optional[StageCallback] = None
+) -> dict:
+    """
+    Analyze -> prompt -> render, shared by /visualize and the job API.
+    image_key is the content hash of uploaded bytes (URL-keyed when omitted).
+    on_stage is called with "analyzing", "prompting" and "rendering" as each starts.
+    All stages share one REQUEST_DEADLINE budget.
+    With SPECULATIVE_RENDER on, the render may start before the analysis is
+    known (see run_speculative_pipeline).
+    """
+    on_stage = on_stage or (lambda stage: None)
+    with deadline():
+        timer = StageTimer()
+        report("upload", original_url=image_url)
+
+        guess = None
+        if SPECULATIVE_RENDER and not skip_analysis:
+            guess = await guess_analysis(image_url, image_key or url_key(image_url), client)
+            if not guess.settled:
+                return await run_speculative_pipeline(
+                    image_url, options, guess, replicate_token, client, timer,
+                    image_key=image_key, bypass_cache=bypass_cache, on_stage=on_stage
+                )
+
+        # Step 1: Analyze image (optional)
+        if skip_analysis:
+            analysis = skipped_analysis()
+        elif guess is not None and guess.source == "cache":
+            analysis = guess.analysis
+        else:
+            on_stage("analyzing")
+            analysis = await timer.track("analysis", analyze_kitchen_image(
+                image_url, client=client, cache_key=image_key, local_estimate=guess and guess.local
+            ))
+        report("analysis", analysis=analysis)
+
+        # Step 2: Generate AEON prompt
+        on_stage("prompting")
+        with timer.measure("prompt"):
+            prompt = build_prompt(analysis, options)
+        report("prompt", prompt=prompt)
+
+        # Step 3: Run Nano-Banana
+        on_stage("rendering")
+        final_url = await timer.track("render", run_nano_banana(
+            image_url=image_url,
+            prompt=prompt,
+            replicate_token=replicate_token,
+            client=client,
+            image_key=image_key,
+            bypass_cache=bypass_cache
+        ))
+
+        return {
+            "original_url": image_url,
+            "final_url": final_url,
+            "proxy_url": proxy_url(final_url),
+            "prompt_used": prompt,
+            "analysis": analysis,
+            "timings": timer.as_dict()
+        }
+
+
+async def run_speculative_pipeline(
+    image_url: str,
+    options: RenderOptions,
+    guess: Guess,
+    replicate_token: str,
+    client: httpx.AsyncClient,
+    timer: StageTimer,
+    image_key: Optional[str] = None,
+    bypass_cache: bool = False,
+    on_stage: StageCallback = lambda stage: None
+) -> dict:
+    """
+    Render from the guessed analysis while the real one runs. If the real
+    analysis selects the same prompt fragments the render is kept (its prompt
+    carries the guessed image description); otherwise it is cancelled on
+    Replicate and re-rendered with the real analysis.
+    """
+    on_stage("analyzing")
+    analysis_task = asyncio.create_task(timer.track("analysis", analyze_kitchen_image(
+        image_url, client=client, cache_key=image_key, local_estimate=guess.local
+    )))
+    with timer.measure("prompt"):
+        prompt = build_prompt(guess.analysis, options)
+    report("prompt", prompt=prompt, speculative=True)
+    started = time.monotonic()
+    # Not coalesced with identical renders, so cancelling it reaches Replicate
+    render_task = asyncio.create_task(timer.track("render", run_nano_banana(
         image_url=image_url,
         prompt=prompt,
-        replicate_token=replicate_token
-    )
+        replicate_token=replicate_token,
+        client=client,
+        image_key=image_key,
+        bypass_cache=bypass_cache,
+        coalesce=False
+    )))
+
+    try:
+        analysis = await analysis_task
+        report("analysis", analysis=analysis)
+        # How long the speculative render had been running (or ran) by now
+        overlap = timer.stages["render"] / 1000 if render_task.done() else time.monotonic() - started
+        if matches(guess.analysis, analysis):
+            speculation.hit(guess.source, overlap)
+            outcome = "hit"
+            on_stage("rendering")
+            final_url = await render_task
+        else:
+            _discard(render_task, "speculation_miss")
+            speculation.miss(guess.source, overlap)
+            outcome = "miss"
+            on_stage("prompting")
+            with timer.measure("prompt"):
+                prompt = build_prompt(analysis, options)
+            report("prompt", prompt=prompt)
+            on_stage("rendering")
+            final_url = await timer.track("render", run_nano_banana(
+                image_url=image_url,
+                prompt=prompt,
+                replicate_token=replicate_token,
+                client=client,
+                image_key=image_key,
+                bypass_cache=bypass_cache
+            ))
+    finally:
+        _discard(analysis_task, "request_ended")
+        _discard(render_task, "request_ended")
 
     return {
-        "success": True,
         "original_url": image_url,
         "final_url": final_url,
+        "proxy_url": proxy_url(final_url),
         "prompt_used": prompt,
         "analysis": analysis,
-        "lead": {"name": name, "phone": phone}
+        "timings": timer.as_dict(),
+        "speculation": {"outcome": outcome, "source": guess.source, "overlap_ms": round(overlap * 1000, 1)}
     }
 
 
-async def run_nano_banana(image_url: str, prompt: str, replicate_token: str) -> str:
+def _discard(task: asyncio.Task, reason: str) -> None:
+    """Cancel a task that is no longer wanted, or consume the error of one that failed"""
+    if not task.done():
+        task.cancel(reason)
+    elif not task.cancelled():
+        task.exception()
+
+
+async def start_upload_and_analysis(
+    image_bytes: bytes,
+    content_type: str,
+    skip_analysis: bool,
+    client: httpx.AsyncClient,
+    timer: StageTimer,
+    on_stage: StageCallback
+) -> tuple[asyncio.Task, str, dict]:
     """
-    Run Google Nano-Banana image editing model on Replicate
+    Start the upload to temporary storage and, while it is in flight, hash the
+    bytes and resolve the analysis:
+    - the analysis cache is checked by content hash;
+    - on a miss, images up to ANALYZE_INLINE_MAX_BYTES are analyzed from an
+      inline data URI instead of waiting for the upload URL.
+    Returns (upload task, image key, analysis). The caller awaits the upload
+    task once it has built its prompts.
     """
-    async with httpx.AsyncClient() as client:
-        # Create prediction
-        response = await client.post(
-            "https://api.replicate.com/v1/predictions",
-            headers={
-                "Authorization": f"Bearer {replicate_token}",
-                "Content-Type": "application/json",
-            },
-            json={
-                "model": "google/nano-banana",
-                "input": {
-                    "prompt": prompt,
-                    "image_input": [image_url],
-                    "output_format": "jpg"
-                }
-            },
-            timeout=60.0
+    on_stage("uploading")
+    upload = asyncio.create_task(timer.track(
+        "upload", upload_to_temp_storage(image_bytes, content_type, client=client)
+    ))
+    try:
+        image_key = await timer.track("hash", asyncio.to_thread(content_key, image_bytes))
+
+        if skip_analysis:
+            return upload, image_key, skipped_analysis()
+
+        on_stage("analyzing")
+        with timer.measure("analysis"):
+            analysis = await analysis_cache.peek(image_key)
+            if analysis is None:
+                if len(image_bytes) <= ANALYZE_INLINE_MAX_BYTES:
+                    source = data_uri(image_bytes, content_type)
+                else:
+                    source = await upload
+                analysis = await analyze_kitchen_image(
+                    source, client=client, cache_key=image_key, image_bytes=image_bytes
+                )
+        return upload, image_key, analysis
+    except BaseException:
+        upload.cancel()
+        raise
+
+
+async def run_upload_pipeline(
+    image_bytes: bytes,
+    content_type: str,
+    options: RenderOptions,
+    skip_analysis: bool,
+    replicate_token: str,
+    client: httpx.AsyncClient,
+    bypass_cache: bool = False,
+    on_stage: Optional[StageCallback] = None
+) -> dict:
+    """
+    Upload pipeline with independent work overlapped (see
+    start_upload_and_analysis). The prompt is built as soon as the analysis is
+    known, so the render starts the moment the upload URL exists.
+    """
+    on_stage = on_stage or (lambda stage: None)
+    with deadline():
+        timer = StageTimer()
+
+        upload, image_key, analysis = await start_upload_and_analysis(
+            image_bytes, content_type, skip_analysis, client, timer, on_stage
         )
+        report("analysis", analysis=analysis)
+        try:
+            on_stage("prompting")
+            with timer.measure("prompt"):
+                prompt = build_prompt(analysis, options)
+            report("prompt", prompt=prompt)
 
-        if response.status_code not in (200, 201):
-            raise HTTPException(
-                status_code=500,
-                detail=f"Nano-Banana API error: {response.status_code} - {response.text}"
-            )
+            image_url = await upload
+        finally:
+            upload.cancel()
+        report("upload", original_url=image_url)
 
-        prediction = response.json()
-        
-        # Poll for result
-        result = prediction
-        max_attempts = 120  # 2 minutes max
-        attempts = 0
-        
-        while result.get("status") in ("starting", "processing") and attempts < max_attempts:
-            await asyncio.sleep(1)
-            attempts += 1
-            poll_response = await client.get(
-                f"https://api.replicate.com/v1/predictions/{result['id']}",
-                headers={"Authorization": f"Bearer {replicate_token}"},
-                timeout=30.0
-            )
-            result = poll_response.json()
+        on_stage("rendering")
+        final_url = await timer.track("render", run_nano_banana(
+            image_url=image_url,
+            prompt=prompt,
+            replicate_token=replicate_token,
+            client=client,
+            image_key=image_key,
+            bypass_cache=bypass_cache
+        ))
 
-        if result.get("status") != "succeeded":
-            raise HTTPException(
-                status_code=500,
-                detail=f"Nano-Banana prediction failed: {result.get('error', 'Unknown error')}"
-            )
+        return {
+            "original_url": image_url,
+            "final_url": final_url,
+            "proxy_url": proxy_url(final_url),
+            "prompt_used": prompt,
+            "analysis": analysis,
+            "timings": timer.as_dict()
+        }
 
-        output = result.get("output")
-        if isinstance(output, list) and len(output) > 0:
-            return output[0]
-        elif isinstance(output, str):
-            return output
-        else:
-            raise HTTPException(status_code=500, detail="Nano-Banana did not return an image")
 
+async def run_batch_pipeline(
+    image_url: str,
+    image_key: Optional[str],
+    analysis: dict,
+    variants: list[RenderOptions],
+    replicate_token: str,
+    client: httpx.AsyncClient,
+    timer: StageTimer,
+    bypass_cache: bool = False
+) -> AsyncIterator[dict]:
+    """
+    Render every variant of one analyzed image, at most BATCH_RENDER_CONCURRENCY
+    at a time, yielding each result as soon as it finishes. Pending renders are
+    cancelled if the consumer stops early (e.g. the client disconnects).
+    """
+    yield {"event": "analysis", "original_url": image_url, "analysis": analysis}
+
+    with timer.measure("prompt"):
+        prompts = build_kitchen_refacing_prompts(
+            [variant.model_dump() for variant in variants],
+            image_description=analysis["image_description"],
+            drawers_missing=analysis["drawers_missing"],
+            is_angled_photo=analysis["is_angled_photo"],
+            has_arched_doors=analysis["has_arched_doors"],
+            lighting=analysis["lighting"],
+            needs_cleanup=analysis["needs_cleanup"],
+            warped_perspective=analysis["warped_perspective"]
+        )
+
+    limit = asyncio.Semaphore(BATCH_RENDER_CONCURRENCY)
+
+    async def render(index: int) -> dict:
+        async with limit:
+            event = {"event": "variant", "index": index, "variant": variants[index].model_dump()}
+            variant_timer = StageTimer()
+            try:
+                final_url = await variant_timer.track("render", run_nano_banana(
+                    image_url=image_url,
+                    prompt=prompts[index],
+                    replicate_token=replicate_token,
+                    client=client,
+                    image_key=image_key,
+                    bypass_cache=bypass_cache
+                ))
+            except HTTPException as err:
+                return {**event, "success": False, "error": err.detail}
+            return {
+                **event,
+                "success": True,
+                "final_url": final_url,
+                "proxy_url": proxy_url(final_url),
+                "prompt_used": prompts[index],
+                "timings": variant_timer.as_dict()
+            }
+
+    tasks = [asyncio.create_task(render(index)) for index in range(len(variants))]
+    succeeded = 0
+    try:
+        with timer.measure("render"):
+            for next_done in asyncio.as_completed(tasks):
+                result = await next_done
+                succeeded += result["success"]
+                yield result
+    finally:
+        for task in tasks:
+            task.cancel()
+
+    yield {
+        "event": "done",
+        "succeeded": succeeded,
+        "failed": len(variants) - succeeded,
+        "timings": timer.as_dict()
+    }
+
+
+async def run_nano_banana(
+    image_url: str,
+    prompt: str,
+    replicate_token: str,
+    client: Optional[httpx.AsyncClient] = None,
+    image_key: Optional[str] = None,
+    bypass_cache: bool = False,
+    coalesce: bool = True
+) -> str:
+    """
+    Run Google Nano-Banana image editing model on Replicate
+
+    Results are cached by image (content hash or normalized URL) + prompt, and
+    concurrent identical requests share one in-flight prediction.
+    bypass_cache forces a fresh render and stores its result. coalesce=False
+    runs a prediction of its own, which cancelling the caller cancels.
+    """
+    client = client or get_http_client()
+    key = "render:" + content_key(f"{image_key or url_key(image_url)}\n{prompt}".encode())
+
+    async def render() -> str:
+        final_url = await _render_nano_banana(image_url, prompt, replicate_token, client, key, not bypass_cache)
+        await render_cache.set(key, final_url)
+        # Store the render before its delivery URL expires
+        await remember_image(final_url)
+        return final_url
+
+    if bypass_cache:
+        return await render()
+
+    with span("render.cache_lookup"):
+        cached = await render_cache.get(key)
+    if cached is not None:
+        return cached
+    if not coalesce:
+        return await render()
+    return await render_flight.do(key, render)
 
-async def upload_to_temp_storage(image_bytes: bytes, content_type: str) -> str:
+
+async def _render_nano_banana(
+    image_url: str,
+    prompt: str,
+    replicate_token: str,
+    client: httpx.AsyncClient,
+    key: Optional[str] = None,
+    reuse: bool = True
+) -> str:
+    """
+    Create a Nano-Banana prediction and wait for its output URL. With
+    HEDGED_RENDERS on, a slow-starting prediction gets a backup (see hedging.py).
+    The prediction is recorded in the ledger under the render key; with
+    reuse, one already recorded there is used instead (see ledger.py).
+    """
+    body = {
+        "model": "google/nano-banana",
+        "input": {
+            "prompt": prompt,
+            "image_input": [image_url],
+            "output_format": "jpg"
+        }
+    }
+
+    def run(on_start=None, reuse=reuse):
+        return run_prediction(
+            client, body, replicate_token, timeout=NANO_BANANA_TIMEOUT, model="nano_banana", on_start=on_start,
+            ledger_key=key, reuse=reuse
+        )
+
+    try:
+        result = await (hedged(run) if HEDGED_RENDERS else run())
+    except (RateLimitedError, CircuitOpenError) as err:
+        raise HTTPException(
+            status_code=503,
+            detail=f"Nano-Banana is unavailable, try again shortly: {err}",
+            headers={"Retry-After": str(math.ceil(err.retry_after or 1))}
+        )
+    except DeadlineExceeded as err:
+        raise HTTPException(status_code=504, detail=f"Nano-Banana render not started: {err}")
+    except httpx.HTTPError as err:
+        raise HTTPException(status_code=502, detail=f"Could not reach Replicate: {err}")
+    except ReplicateError as err:
+        raise HTTPException(status_code=500, detail=f"Nano-Banana API error: {err}")
+
+    if result.get("status") in ("starting", "processing"):
+        # run_prediction has already cancelled it on Replicate
+        raise HTTPException(status_code=504, detail="Nano-Banana render did not finish in time")
+    if result.get("status") != "succeeded":
+        raise HTTPException(
+            status_code=500,
+            detail=f"Nano-Banana prediction failed: {result.get('error') or 'Unknown error'}"
+        )
+
+    output = result.get("output")
+    if isinstance(output, list) and len(output) > 0:
+        return output[0]
+    elif isinstance(output, str):
+        return output
+    else:
+        raise HTTPException(status_code=500, detail="Nano-Banana did not return an image")
+
+
+async def upload_to_temp_storage(
+    image_bytes: bytes,
+    content_type: str,
+    client: Optional[httpx.AsyncClient] = None
+) -> str:
     """
     Upload image to temporary storage and return URL.
     
@@ -328,29 +1192,137 @@ async def upload_to_temp_storage(image_bytes: bytes, content_type: str) -> str:
     This is a placeholder that uses Replicate's file upload.
     """
     replicate_token = os.environ.get("REPLICATE_API_TOKEN")
+    client = client or get_http_client()
+
+    # Use Replicate's file upload endpoint
+    response = await client.post(
+        f"{REPLICATE_API_BASE}/files",
+        headers={
+            "Authorization": f"Bearer {replicate_token}",
+        },
+        files={"file": ("kitchen.jpg", image_bytes, content_type)},
+        timeout=60.0
+    )
     
-    async with httpx.AsyncClient() as client:
-        # Use Replicate's file upload endpoint
-        response = await client.post(
-            "https://api.replicate.com/v1/files",
-            headers={
-                "Authorization": f"Bearer {replicate_token}",
-            },
-            files={"file": ("kitchen.jpg", image_bytes, content_type)},
-            timeout=60.0
-        )
-        
-        if response.status_code in (200, 201):
-            data = response.json()
-            return data.get("urls", {}).get("get", data.get("url", ""))
-        
-        # Fallback: base64 data URI (not recommended for production)
-        import base64
-        b64 = base64.b64encode(image_bytes).decode()
-        return f"data:{content_type};base64,{b64}"
+    if response.status_code in (200, 201):
+        data = response.json()
+        return data.get("urls", {}).get("get", data.get("url", ""))
+    
+    # Fallback: base64 data URI (not recommended for production)
+    return data_uri(image_bytes, content_type)
+
+
+def data_uri(image_bytes: bytes, content_type: str) -> str:
+    b64 = base64.b64encode(image_bytes).decode()
+    return f"data:{content_type};base64,{b64}"
+
+
+@app.get("/images/{image_id}")
+async def get_image(
+    image_id: str,
+    request: Request,
+    w: Optional[int] = None,
+    format: Optional[str] = None
+):
+    """
+    A stored render, resized to the configured width covering `w` and encoded
+    as `format` (avif, webp or jpeg; by default the best one Accept allows).
+    """
+    try:
+        fmt, negotiated = negotiate_format(format, request.headers.get("accept", ""))
+    except ValueError as err:
+        raise HTTPException(status_code=400, detail=str(err))
+    if w is not None and w <= 0:
+        raise HTTPException(status_code=400, detail="w must be positive")
+
+    try:
+        entry = await original(image_id)
+    except ImageNotFound:
+        raise HTTPException(status_code=404, detail="Image not found")
+
+    width = snap_width(w)
+    headers = {"ETag": etag(entry, width, fmt), "Cache-Control": CACHE_CONTROL}
+    if negotiated:
+        headers["Vary"] = "Accept"
+    if etag_matches(request.headers.get("if-none-match", ""), headers["ETag"]):
+        record_not_modified()
+        return Response(status_code=304, headers=headers)
+
+    try:
+        data, generated = await variant(entry, width, fmt)
+    except ImageNotFound as err:
+        raise HTTPException(status_code=404, detail=f"Image not available: {err}")
+    except (OSError, ValueError) as err:
+        raise HTTPException(status_code=502, detail=f"Render could not be decoded: {err}")
+    record_response(entry, fmt, len(data), generated)
+    return Response(content=data, media_type=media_type(fmt, data), headers=headers)
+
+
+@app.post("/webhooks/replicate")
+async def replicate_webhook(request: Request):
+    """
+    Completion webhook for predictions created in webhook mode.
+    Resolves the coroutine waiting on that prediction id.
+    """
+    body = await request.body()
+    if not verify_webhook_signature(request.headers, body):
+        raise HTTPException(status_code=401, detail="Invalid webhook signature")
+
+    try:
+        prediction = json.loads(body)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid JSON payload")
+
+    matched = await registry.deliver(prediction)
+    return {"received": True, "matched": matched}
 
 
 # Health check
 @app.get("/health")
 async def health():
-    return {"status": "healthy", "version": "1.0.0"}
+    """Liveness plus circuit breaker state; "degraded" while any breaker is not closed"""
+    breakers = breaker_stats()
+    degraded = any(b["state"] != "closed" for b in breakers.values())
+    return {"status": "degraded" if degraded else "healthy", "version": "1.0.0", "breakers": breakers}
+
+
+@app.get("/stats")
+async def stats():
+    """Runtime counters for the connection pool, job queue and caches"""
+    return {
+        "http_pool": pool_stats(),
+        "predictions": prediction_stats(),
+        "jobs": job_queue.stats(),
+        "analysis_cache": analysis_cache.stats(),
+        "render_cache": {**render_cache.stats(), **render_flight.stats()},
+        "ingest": ingest_stats(),
+        "uploads": storage_stats(),
+        "speculation": speculation_stats(),
+        "hedging": hedge_stats(),
+        "images": image_stats()
+    }
+
+
+def _cache_counters(field: str) -> dict:
+    return {
+        (cache.name,): cache.stats()[field]
+        for cache in (analysis_cache, render_cache)
+    }
+
+
+register(CallbackMetric("aeon_jobs_queue_depth", "Jobs waiting for a worker", "gauge",
+                        lambda: job_queue.stats()["queue_depth"]))
+register(CallbackMetric("aeon_jobs_running", "Jobs currently running", "gauge",
+                        lambda: job_queue.running))
+register(CallbackMetric("aeon_http_pool_in_flight", "Outbound requests in flight", "gauge",
+                        lambda: pool_stats()["requests_in_flight"]))
+register(CallbackMetric("aeon_cache_hits_total", "Cache hits", "counter",
+                        lambda: _cache_counters("hits"), ("cache",)))
+register(CallbackMetric("aeon_cache_misses_total", "Cache misses", "counter",
+                        lambda: _cache_counters("misses"), ("cache",)))
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Prometheus text exposition of latency histograms and runtime gauges"""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
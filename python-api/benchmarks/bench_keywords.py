@@ -0,0 +1,112 @@
+"""
+Microbenchmark: compiled caption keyword matcher vs. the original substring scans
+
+Builds a corpus of captions (short BLIP-style captions and long multi-sentence
+ones), times parse_image_description against the original implementation and
+lists every caption where the two disagree. Disagreements are expected where
+the original matched inside another word ("arch" in "search").
+
+Run with: python benchmarks/bench_keywords.py [--long-words 400] [--captions 200]
+"""
+
+import os
+import sys
+import random
+import timeit
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from prompt_generator import caption_matcher, parse_image_description  # noqa: E402
+
+
+# Original implementation, kept verbatim as the baseline
+def reference_parse(description: str) -> dict:
+    """Parse the BLIP-2 description for key features"""
+    lower_desc = description.lower()
+
+    return {
+        "image_description": description,
+        "drawers_missing": any(word in lower_desc for word in ["missing", "no drawer", "empty"]),
+        "is_angled_photo": any(word in lower_desc for word in ["angle", "corner", "perspective"]),
+        "has_arched_doors": any(word in lower_desc for word in ["arch", "raised panel", "cathedral"]),
+        "lighting": "warm" if "warm" in lower_desc else ("cool" if "cool" in lower_desc else "neutral"),
+        "needs_cleanup": any(word in lower_desc for word in ["dirty", "tape", "debris", "mess"]),
+        "warped_perspective": any(word in lower_desc for word in ["distort", "warp", "fisheye"])
+    }
+
+
+FILLER = (
+    "the kitchen has white shaker cabinets granite countertops stainless steel "
+    "appliances tile backsplash hardwood floor window over the sink pendant lights "
+    "island with seating bright natural daylight modern open shelving range hood"
+).split()
+
+# Words that contain a keyword without being one ("arch" in "search")
+TRAPS = ["research", "tapestry", "message", "searchlight", "archive", "dismissing", "overarching"]
+
+FEATURES = [
+    "photo taken from an angle", "corner view", "warm lighting", "cool fluorescent light",
+    "arched cabinet doors", "raised panel doors", "two drawers missing", "an empty drawer slot",
+    "painter's tape on the doors", "dirty countertop", "slightly distorted fisheye view",
+    "warped perspective", "cathedral style doors",
+]
+
+
+def build_corpus(count: int, long_words: int, seed: int = 7) -> list[str]:
+    rng = random.Random(seed)
+    captions = []
+    for i in range(count):
+        words = 12 if i % 2 == 0 else long_words
+        filler = [rng.choice(FILLER) for _ in range(words)]
+        extras = rng.sample(FEATURES, rng.randint(0, 3)) + rng.sample(TRAPS, rng.randint(0, 2))
+        for extra in extras:
+            filler.insert(rng.randrange(len(filler) + 1), extra)
+        captions.append("a kitchen with " + " ".join(filler))
+    return captions
+
+
+def time_per_call(fn, captions: list[str], repeat: int = 5) -> float:
+    number = max(1, 20000 // len(captions))
+    best = min(timeit.repeat(lambda: [fn(c) for c in captions], number=number, repeat=repeat))
+    return best / (number * len(captions)) * 1e6
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--captions", type=int, default=200)
+    parser.add_argument("--long-words", type=int, default=400)
+    args = parser.parse_args()
+
+    corpus = build_corpus(args.captions, args.long_words)
+    short = corpus[0::2]
+    long = corpus[1::2]
+
+    differences = []
+    for caption in corpus:
+        old, new = reference_parse(caption), parse_image_description(caption)
+        changed = {k: (old[k], new[k]) for k in old if old[k] != new[k]}
+        if changed:
+            differences.append((caption, changed))
+
+    print(f"engine: {caption_matcher.engine}")
+    print(f"corpus: {len(short)} short captions (~{sum(map(len, short)) // len(short)} chars), "
+          f"{len(long)} long (~{sum(map(len, long)) // len(long)} chars)")
+    for label, captions in (("short", short), ("long", long)):
+        before = time_per_call(reference_parse, captions)
+        after = time_per_call(parse_image_description, captions)
+        print(f"{label:>5}: original {before:7.2f} us   compiled {after:7.2f} us   ({before / after:.2f}x)")
+
+    print(f"agreement: {len(corpus) - len(differences)}/{len(corpus)} captions")
+    fields: dict[str, int] = {}
+    for _, changed in differences:
+        for field in changed:
+            fields[field] = fields.get(field, 0) + 1
+    for field, n in sorted(fields.items()):
+        print(f"  {field}: {n} differ (original -> compiled)")
+    for caption, changed in differences[:3]:
+        print(f"  e.g. {changed}")
+
+
+if __name__ == "__main__":
+    main()
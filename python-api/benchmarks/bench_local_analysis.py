@@ -0,0 +1,150 @@
+"""
+Benchmark: local pre-analysis vs. a remote BLIP-2 round trip
+
+Renders synthetic cabinet-wall photos with known lighting, camera angle and
+tilt (phone-sized JPEGs), then reports:
+    - local estimate latency (p50 / p95) per image, single-threaded
+    - agreement with the known labels, overall and on the images confident
+      enough to skip BLIP-2
+    - the share of images that skip BLIP-2 and the latency saved per
+      request: skipped share x BLIP-2 latency - the local estimate, which
+      every request pays
+
+The scenes are simple (flat doors, frames, a counter and a window), so
+agreement here checks the statistics behave as intended; it does not predict
+accuracy on real kitchens. Run it on real photos before tightening
+LOCAL_ANALYSIS_MIN_CONFIDENCE.
+
+Run with: python benchmarks/bench_local_analysis.py [--images 96] [--blip2-seconds 10]
+"""
+
+import io
+import os
+import sys
+import time
+import random
+import argparse
+import itertools
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from PIL import Image, ImageDraw, ImageFilter  # noqa: E402
+
+from local_analyzer import LOCAL_ANALYSIS_MIN_CONFIDENCE, estimate  # noqa: E402
+
+WIDTH, HEIGHT = 4032, 3024
+
+# Light source tint applied to the whole scene
+TINTS = {
+    "warm": (1.0, 0.86, 0.66),
+    "neutral": (1.0, 1.0, 1.0),
+    "cool": (0.84, 0.93, 1.0),
+}
+
+
+def _perspective_coefficients(source: list, target: list) -> list:
+    """Coefficients for Image.transform(PERSPECTIVE) mapping target corners onto source corners"""
+    import numpy as np
+    rows = []
+    for (x, y), (u, v) in zip(target, source):
+        rows.append([x, y, 1, 0, 0, 0, -u * x, -u * y])
+        rows.append([0, 0, 0, x, y, 1, -v * x, -v * y])
+    a = np.array(rows, dtype=np.float64)
+    b = np.array(source, dtype=np.float64).reshape(8)
+    return np.linalg.solve(a, b).tolist()
+
+
+def render_scene(rng: random.Random, lighting: str, angled: bool, warped: bool) -> bytes:
+    """A wall of cabinets under a counter, photographed straight-on or at an angle"""
+    w, h = WIDTH // 4, HEIGHT // 4
+    base = rng.choice([(235, 233, 228), (200, 190, 170), (120, 130, 140), (60, 60, 62)])
+    img = Image.new("RGB", (w, h), (222, 220, 215))
+    draw = ImageDraw.Draw(img)
+
+    # Upper cabinets, window, counter, lower cabinets and drawers
+    doors = rng.randint(4, 7)
+    door_w = w // doors
+    for i in range(doors):
+        x0 = i * door_w + 6
+        draw.rectangle([x0, 40, x0 + door_w - 12, h // 3], fill=base, outline=(40, 40, 40), width=3)
+        draw.rectangle([x0 + 18, 58, x0 + door_w - 30, h // 3 - 18], outline=(90, 90, 90), width=2)
+        draw.rectangle([x0, h // 2 + 40, x0 + door_w - 12, h - 40], fill=base, outline=(40, 40, 40), width=3)
+        draw.rectangle([x0, h // 2 + 4, x0 + door_w - 12, h // 2 + 34], fill=base, outline=(40, 40, 40), width=3)
+        draw.line([x0 + door_w // 2 - 20, h // 2 + 19, x0 + door_w // 2 + 20, h // 2 + 19], fill=(30, 30, 30), width=4)
+    draw.rectangle([0, h // 2 - 14, w, h // 2], fill=(70, 65, 60))
+    draw.rectangle([w // 3, h // 3 + 20, 2 * w // 3, h // 2 - 30], fill=(252, 252, 252), outline=(40, 40, 40), width=4)
+
+    if angled:
+        # Camera off to one side: the far edge shrinks and the horizontals converge
+        squeeze = rng.uniform(0.22, 0.32) * h
+        target = [(0, 0), (w, squeeze), (w, h - squeeze), (0, h)]
+        if rng.random() < 0.5:
+            target = [(0, squeeze), (w, 0), (w, h), (0, h - squeeze)]
+        img = img.transform((w, h), Image.PERSPECTIVE,
+                            _perspective_coefficients([(0, 0), (w, 0), (w, h), (0, h)], target),
+                            Image.BICUBIC, fillcolor=(222, 220, 215))
+    if warped:
+        # Camera tilted: every vertical leans
+        img = img.rotate(rng.choice([-1, 1]) * rng.uniform(5, 9), Image.BICUBIC, expand=False, fillcolor=(222, 220, 215))
+
+    tint = TINTS[lighting]
+    img = Image.merge("RGB", [
+        band.point(lambda value, t=t: min(255, int(value * t)))
+        for band, t in zip(img.split(), tint)
+    ])
+    img = img.filter(ImageFilter.GaussianBlur(1)).resize((WIDTH, HEIGHT), Image.BILINEAR)
+    out = io.BytesIO()
+    img.save(out, "JPEG", quality=88)
+    return out.getvalue()
+
+
+def percentile(values: list[float], p: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--images", type=int, default=96)
+    parser.add_argument("--blip2-seconds", type=float, default=10.0, help="BLIP-2 round trip being skipped")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    labels = list(itertools.product(TINTS, (False, True), (False, True)))
+    print(f"rendering {args.images} synthetic {WIDTH}x{HEIGHT} photos...")
+    scenes = []
+    for i in range(args.images):
+        lighting, angled, warped = labels[i % len(labels)]
+        scenes.append(((lighting, angled, warped), render_scene(rng, lighting, angled, warped)))
+
+    latencies, correct, confident, confident_correct = [], {}, 0, 0
+    fields = ("lighting", "is_angled_photo", "warped_perspective")
+    for (lighting, angled, warped), data in scenes:
+        start = time.perf_counter()
+        result = estimate(data)
+        latencies.append((time.perf_counter() - start) * 1000)
+        truth = {"lighting": lighting, "is_angled_photo": angled, "warped_perspective": warped}
+        matches = {f: result.fields[f] == truth[f] for f in fields}
+        for f in fields:
+            correct[f] = correct.get(f, 0) + matches[f]
+        if result.confident():
+            confident += 1
+            confident_correct += all(matches.values())
+
+    n = len(scenes)
+    local_ms = percentile(latencies, 50)
+    skip_share = confident / n
+    saved_ms = skip_share * args.blip2_seconds * 1000 - local_ms
+    print(f"local estimate: p50 {local_ms:.1f} ms  p95 {percentile(latencies, 95):.1f} ms  (avg JPEG {sum(len(d) for _, d in scenes) / n / 1e6:.1f} MB)")
+    for f in fields:
+        print(f"  {f:<20} agreement {correct[f] / n:6.1%}")
+    print(
+        f"confident (min confidence {LOCAL_ANALYSIS_MIN_CONFIDENCE}): {skip_share:.1%} of images skip BLIP-2, "
+        f"{confident_correct / confident if confident else 0:.1%} of those fully correct"
+    )
+    print(f"latency saved per request: {saved_ms:,.0f} ms (vs. a {args.blip2_seconds:.0f} s BLIP-2 round trip)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+"""
+Microbenchmark: precompiled prompt template vs. the original f-string builder
+
+Checks that both produce identical prompts for every door / hardware / finish /
+flag combination, then times single builds and an 8-variant batch.
+
+Run with: python benchmarks/bench_prompt.py
+"""
+
+import os
+import sys
+import timeit
+import itertools
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from prompt_generator import (  # noqa: E402
+    DOOR_GEOMETRY,
+    HARDWARE_GEOMETRY,
+    HARDWARE_FINISH,
+    DoorStyle,
+    HardwareStyle,
+    HardwareFinish,
+    LightingType,
+    build_kitchen_refacing_prompt,
+    build_kitchen_refacing_prompts,
+)
+
+
+# Original implementation, kept verbatim as the baseline
+def reference_build_prompt(
+    image_description: str,
+    door_style: DoorStyle,
+    color_hex: str,
+    color_name: str,
+    hardware_style: HardwareStyle,
+    hardware_finish: HardwareFinish,
+    drawers_missing: bool = False,
+    is_angled_photo: bool = False,
+    has_arched_doors: bool = False,
+    lighting: LightingType = "neutral",
+    needs_cleanup: bool = False,
+    warped_perspective: bool = False
+) -> str:
+    """
+    AEON Universal Prompt Generator
+    Builds a complete chain-of-command prompt for Nano-Banana
+    """
+    
+    door_geometry = DOOR_GEOMETRY.get(door_style, DOOR_GEOMETRY["shaker"])
+    hardware_geometry = HARDWARE_GEOMETRY.get(hardware_style, HARDWARE_GEOMETRY["bar"])
+    hardware_color = HARDWARE_FINISH.get(hardware_finish, HARDWARE_FINISH["nickel"])
+
+    # Section 2: Missing parts
+    missing_parts_section = (
+        "Some drawers are missing. Draw new drawer fronts as flat rectangles that match the size, shape, and alignment of surrounding drawers."
+        if drawers_missing else
+        "All drawers appear present; keep their size and outer boundaries unchanged."
+    )
+
+    # Section 3: Erase old styles
+    erase_section = (
+        "Remove all arched or raised panel shapes. Flatten them completely before drawing the new style."
+        if has_arched_doors else
+        "Remove all existing panel lines, bevels, grooves, and decorative shapes to prepare for the new style."
+    )
+
+    # Section 7: Angle handling
+    angle_section = (
+        "Match the angle and perspective of the original photo when drawing all new rectangles and hardware. Maintain consistent vanishing points."
+        if is_angled_photo else
+        "Keep all geometry perfectly parallel since the photo is taken straight-on."
+    )
+
+    warp_section = (
+        "Straighten any warped or distorted cabinet faces before applying the new geometry. Correct vertical and horizontal alignment."
+        if warped_perspective else ""
+    )
+
+    # Section 8: Lighting
+    lighting_map = {
+        "warm": "Adjust reflections and highlights to match warm indoor lighting.",
+        "cool": "Use cooler, softer highlights consistent with cool lighting.",
+        "neutral": "Use neutral white lighting reflections."
+    }
+    lighting_section = lighting_map.get(lighting, lighting_map["neutral"])
+
+    # Section 9: Cleanup
+    cleanup_section = (
+        "Remove noise, smudges, debris, and painter's tape before generating final output."
+        if needs_cleanup else
+        "Keep image clarity but do not over-smooth the rest of the kitchen."
+    )
+
+    prompt = f"""LOOK AT THE IMAGE AND FOLLOW THESE ACTIONS EXACTLY:
+
+1. ANALYZE STRUCTURE
+- Identify all cabinets, doors, drawers, openings, and hardware in the image.
+- Preserve countertops, walls, appliances, windows, lighting, and flooring.
+- Do NOT modify anything except cabinets, drawers, and hardware.
+
+2. RECONSTRUCT MISSING PARTS
+{missing_parts_section}
+
+3. ERASE OLD STYLES
+{erase_section}
+
+4. DRAW NEW DOOR STYLE
+{door_geometry}
+
+5. APPLY NEW COLOR
+Recolor all cabinet surfaces to {color_name} ({color_hex}) with a smooth satin finish.
+Do not change shadows or reflections on surrounding objects.
+
+6. REMOVE OLD HARDWARE AND ADD NEW
+Erase all existing handles and knobs completely.
+{hardware_geometry}
+{hardware_color}
+Place handles centered and aligned with standard orientation.
+
+7. ANGLE / PERSPECTIVE HANDLING
+{angle_section}
+{warp_section}
+
+8. LIGHTING CONDITIONS
+{lighting_section}
+
+9. CLEANUP
+{cleanup_section}
+
+10. FINAL DIRECTIVE
+Generate the updated kitchen with the new cabinet style, color, and hardware while keeping all other room elements unchanged.
+Maintain photorealism and match the original shadows, angle, and lighting.
+
+IMAGE REFERENCE:
+{image_description}"""
+
+    return prompt.strip()
+
+
+DESCRIPTION = "L-shaped kitchen with oak raised panel cabinets, granite countertops, stainless appliances, warm lighting"
+
+VARIANTS = [
+    {"door_style": door_style, "color_hex": "#FFFFFF", "color_name": "Classic White",
+     "hardware_style": hardware_style, "hardware_finish": "satinnickel"}
+    for door_style, hardware_style in zip(DOOR_GEOMETRY, itertools.cycle(HARDWARE_GEOMETRY))
+][:5] + [
+    {"door_style": "shaker", "color_hex": "#1F2A44", "color_name": "Navy",
+     "hardware_style": "bar", "hardware_finish": finish}
+    for finish in ("gold", "black", "chrome")
+]
+
+FLAGS = {
+    "drawers_missing": False,
+    "is_angled_photo": True,
+    "has_arched_doors": True,
+    "lighting": "warm",
+    "needs_cleanup": False,
+    "warped_perspective": False,
+}
+
+
+def check_equivalence() -> int:
+    checked = 0
+    for door_style, hardware_style, hardware_finish in itertools.product(
+        DOOR_GEOMETRY, HARDWARE_GEOMETRY, HARDWARE_FINISH
+    ):
+        for flags in itertools.product((True, False), repeat=5):
+            for lighting in ("warm", "cool", "neutral"):
+                kwargs = dict(
+                    image_description=DESCRIPTION,
+                    door_style=door_style,
+                    color_hex="#FFFFFF",
+                    color_name="Classic White",
+                    hardware_style=hardware_style,
+                    hardware_finish=hardware_finish,
+                    drawers_missing=flags[0],
+                    is_angled_photo=flags[1],
+                    has_arched_doors=flags[2],
+                    lighting=lighting,
+                    needs_cleanup=flags[3],
+                    warped_perspective=flags[4],
+                )
+                assert build_kitchen_refacing_prompt(**kwargs) == reference_build_prompt(**kwargs), kwargs
+                checked += 1
+    return checked
+
+
+def bench(label: str, fn, number: int) -> float:
+    best = min(timeit.repeat(fn, number=number, repeat=5)) / number
+    print(f"  {label:<34} {best * 1e6:8.2f} us")
+    return best
+
+
+def main():
+    print(f"Equivalence: {check_equivalence()} combinations identical\n")
+
+    single_kwargs = dict(image_description=DESCRIPTION, **VARIANTS[0], **FLAGS)
+    print("Single prompt")
+    old = bench("reference f-string builder", lambda: reference_build_prompt(**single_kwargs), 20000)
+    new = bench("precompiled template", lambda: build_kitchen_refacing_prompt(**single_kwargs), 20000)
+    print(f"  speedup: {old / new:.1f}x\n")
+
+    print(f"Batch of {len(VARIANTS)} variants")
+    old = bench("reference, one call per variant",
+                lambda: [reference_build_prompt(DESCRIPTION, **v, **FLAGS) for v in VARIANTS], 5000)
+    new = bench("build_kitchen_refacing_prompts",
+                lambda: build_kitchen_refacing_prompts(VARIANTS, DESCRIPTION, **FLAGS), 5000)
+    print(f"  speedup: {old / new:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+"""
+Scaling benchmark: throughput from 1 to N worker processes
+
+For each worker count, starts the API under gunicorn (uvicorn --workers when
+gunicorn is not installed) against a zero-latency fake Replicate, so the
+API's own CPU work is the bottleneck, and reports per scenario:
+    - throughput at a fixed concurrency, speedup over one worker and
+      per-worker efficiency
+    - p50 / p99 latency
+
+Then checks that state is shared across workers, using a fresh connection
+per request so requests spread over the workers:
+    - job status lookups that 404 because another worker accepted the job
+    - BLIP-2 analyses run for one photo rendered in several colors (1 when
+      the analysis cache is shared)
+
+fake_replicate runs as a single process, so the visualize scenario levels
+off once it saturates; prompt measures the API alone.
+
+Run with: python benchmarks/bench_scaling.py [--workers 1,2,4]
+          [--scenarios prompt,visualize] [--state-backend sqlite]
+"""
+
+import os
+import sys
+import time
+import shutil
+import asyncio
+import argparse
+import tempfile
+import subprocess
+from contextlib import contextmanager
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from load_test import API_DIR, VARIANT, LEAD, free_port, run_level, wait_until_up  # noqa: E402
+
+
+@contextmanager
+def deployment(workers: int, args):
+    """fake_replicate plus the API with `workers` processes; yields (fake_url, api_url)"""
+    procs = []
+    state_dir = tempfile.mkdtemp(prefix="aeon-scaling-")
+    try:
+        fake_port = free_port()
+        fake_url = f"http://127.0.0.1:{fake_port}"
+        procs.append(subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "fake_replicate:app", "--port", str(fake_port), "--log-level", "warning"],
+            cwd=API_DIR,
+            env={
+                **os.environ,
+                "FAKE_REPLICATE_QUEUE_DELAY": "0",
+                "FAKE_REPLICATE_RUN_TIME": "0",
+                "FAKE_REPLICATE_REQUEST_LATENCY": "0",
+                "FAKE_REPLICATE_BASE_URL": fake_url,
+            }
+        ))
+        wait_until_up(f"{fake_url}/_stats")
+
+        api_port = free_port()
+        api_url = f"http://127.0.0.1:{api_port}"
+        env = {
+            **os.environ,
+            "REPLICATE_API_BASE": f"{fake_url}/v1",
+            "REPLICATE_API_TOKEN": "scaling",
+            "LOG_LEVEL": "WARNING",
+            "STATE_BACKEND": args.state_backend,
+            "STATE_DB": os.path.join(state_dir, "state.db"),
+            # The benchmark measures the API, not the outbound governor
+            "REPLICATE_CREATE_RATE": "0",
+            "REPLICATE_MAX_IN_FLIGHT": "0",
+        }
+        if shutil.which("gunicorn") and not args.uvicorn:
+            command = [
+                "gunicorn", "api:app", "-c", "gunicorn.conf.py",
+                "--workers", str(workers), "--bind", f"127.0.0.1:{api_port}", "--log-level", "warning",
+            ]
+        else:
+            command = [
+                sys.executable, "-m", "uvicorn", "api:app", "--port", str(api_port),
+                "--workers", str(workers), "--log-level", "warning",
+            ]
+        procs.append(subprocess.Popen(command, cwd=API_DIR, env=env))
+        wait_until_up(f"{api_url}/health", timeout=60)
+        yield fake_url, api_url
+    finally:
+        for proc in reversed(procs):
+            proc.terminate()
+        for proc in procs:
+            proc.wait(timeout=30)
+        shutil.rmtree(state_dir, ignore_errors=True)
+
+
+def fresh_client(base_url: str) -> httpx.AsyncClient:
+    """No keep-alive, so successive requests may land on different workers"""
+    return httpx.AsyncClient(base_url=base_url, timeout=60, limits=httpx.Limits(max_keepalive_connections=0))
+
+
+async def check_shared_state(api_url: str, fake_url: str, lookups: int = 40) -> dict:
+    async with fresh_client(api_url) as client, httpx.AsyncClient(base_url=fake_url) as fake:
+        response = await client.post("/jobs/visualize", json={
+            "image_url": f"https://images.example.com/scaling/job-{time.time()}.jpg", **VARIANT, **LEAD
+        })
+        job_id = response.json()["job_id"]
+        missing = 0
+        status = "queued"
+        for _ in range(lookups):
+            response = await client.get(f"/jobs/{job_id}")
+            if response.status_code == 404:
+                missing += 1
+            else:
+                status = response.json()["status"]
+        # Let the job finish before the fake's counters are reset
+        give_up = time.monotonic() + 60
+        while status not in ("succeeded", "failed") and time.monotonic() < give_up:
+            await asyncio.sleep(0.1)
+            response = await client.get(f"/jobs/{job_id}")
+            status = response.json()["status"] if response.status_code == 200 else status
+
+        # One photo in several colors: only the first should need BLIP-2
+        await fake.post("/_reset")
+        image_url = f"https://images.example.com/scaling/colors-{time.time()}.jpg"
+        colors = ["#FFFFFF", "#000000", "#1E3A5F", "#8B4513", "#556B2F", "#C0C0C0"]
+        for color in colors:
+            await client.post("/visualize", json={**VARIANT, **LEAD, "image_url": image_url, "color_hex": color})
+        creates = (await fake.get("/_stats")).json()["requests"].get("predictions_create", 0)
+
+    return {"job_lookups": lookups, "job_404s": missing, "analyses_run": creates - len(colors)}
+
+
+async def main_async(args) -> None:
+    levels = [int(n) for n in args.workers.split(",")]
+    scenarios = args.scenarios.split(",")
+    baseline: dict[str, float] = {}
+
+    print(f"{os.cpu_count()} CPUs, STATE_BACKEND={args.state_backend}, concurrency {args.concurrency}")
+    for workers in levels:
+        with deployment(workers, args) as (fake_url, api_url):
+            for scenario in scenarios:
+                # Warm every worker's imports and connection pool first
+                await run_level(api_url, fake_url, None, scenario, args.concurrency, args.concurrency * 2)
+                r = await run_level(api_url, fake_url, None, scenario, args.concurrency, args.requests)
+                rps = r["throughput_rps"]
+                # Speedup is relative to the first level's per-worker throughput
+                baseline.setdefault(scenario, rps / workers)
+                speedup = rps / baseline[scenario]
+                print(
+                    f"workers={workers:<3} {scenario:>10}  {rps:8.1f} req/s  speedup {speedup:4.2f}x  "
+                    f"efficiency {speedup / workers:4.0%}  p50 {r['p50_ms']:7.1f}  p99 {r['p99_ms']:7.1f} ms  "
+                    f"errors {r['errors']}"
+                )
+            shared = await check_shared_state(api_url, fake_url)
+            print(
+                f"workers={workers:<3} shared state: job 404s {shared['job_404s']}/{shared['job_lookups']}, "
+                f"BLIP-2 analyses for one photo in 6 colors: {shared['analyses_run']}"
+            )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    default_workers = ",".join(str(n) for n in sorted({1, 2, 4, os.cpu_count() or 1}) if n <= (os.cpu_count() or 1))
+    parser.add_argument("--workers", default=default_workers, help="worker counts to compare")
+    parser.add_argument("--scenarios", default="prompt,visualize")
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--requests", type=int, default=1024, help="requests per scenario and worker count")
+    parser.add_argument("--state-backend", default="sqlite", choices=("memory", "sqlite", "redis"))
+    parser.add_argument("--uvicorn", action="store_true", help="use uvicorn --workers even if gunicorn is installed")
+    asyncio.run(main_async(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
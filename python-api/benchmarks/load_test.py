@@ -0,0 +1,359 @@
+"""
+Load test: drive the API against the local fake Replicate
+
+Starts fake_replicate and the API as uvicorn subprocesses on free ports (or
+targets an already running API with --api-url / --fake-url), then runs each
+scenario at each concurrency level with a closed loop of workers and reports:
+    - latency p50 / p95 / p99 and throughput
+    - non-2xx responses
+    - outbound requests the API made to Replicate (from the fake's counters),
+      per operation, e.g. prediction polls per request
+    - API process RSS (current and peak, Linux) and /stats pool figures
+
+Every request uses a distinct image so caches do not hide the pipeline.
+
+Regression check:
+    python benchmarks/load_test.py --save baseline.json
+    ... change connection handling / polling ...
+    python benchmarks/load_test.py --compare baseline.json   # exits 1 on regression
+
+Run with: python benchmarks/load_test.py [--scenarios visualize,upload]
+          [--concurrency 1,8,32] [--requests 64] [--queue-delay uniform:0.2:0.6]
+          [--run-time lognormal:1:0.4] [--failure-rate 0.02] [--webhook]
+"""
+
+import os
+import io
+import sys
+import json
+import time
+import base64
+import socket
+import random
+import asyncio
+import argparse
+import subprocess
+from contextlib import contextmanager
+from typing import Optional
+
+import httpx
+
+API_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+try:
+    from PIL import Image
+except ImportError:  # uploads fall back to random bytes, which the API forwards untouched
+    Image = None
+
+VARIANT = {
+    "door_style": "shaker",
+    "color_hex": "#FFFFFF",
+    "color_name": "Classic White",
+    "hardware_style": "bar",
+    "hardware_finish": "nickel",
+}
+LEAD = {"name": "Load Test", "phone": "555-0100"}
+
+
+# ============ REQUESTS ============
+
+def jpeg(seed: int) -> bytes:
+    """A small photo-sized JPEG whose bytes differ per seed"""
+    if Image is None:
+        return os.urandom(64 * 1024)
+    rng = random.Random(seed)
+    img = Image.new("RGB", (1024, 768), tuple(rng.randrange(256) for _ in range(3)))
+    img.putpixel((rng.randrange(1024), rng.randrange(768)), (255, 0, 0))
+    out = io.BytesIO()
+    img.save(out, "JPEG", quality=90)
+    return out.getvalue()
+
+
+async def call_visualize(client: httpx.AsyncClient, n: int) -> httpx.Response:
+    return await client.post("/visualize", json={
+        "image_url": f"https://images.example.com/load/{n}-{random.random()}.jpg", **VARIANT, **LEAD
+    })
+
+
+async def call_upload(client: httpx.AsyncClient, n: int) -> httpx.Response:
+    return await client.post(
+        "/visualize/upload",
+        data={**VARIANT, **LEAD},
+        files={"image": ("kitchen.jpg", jpeg(n + random.randrange(1 << 30)), "image/jpeg")},
+    )
+
+
+async def call_direct(client: httpx.AsyncClient, n: int) -> httpx.Response:
+    """Presign, upload straight to storage, then /visualize with the stored URL"""
+    target = (await client.post("/uploads/presign", json={"content_type": "image/jpeg"})).json()
+    uploaded = await client.post(
+        target["url"], data=target["fields"],
+        files={"file": ("kitchen.jpg", jpeg(n + random.randrange(1 << 30)), "image/jpeg")}
+    )
+    if uploaded.status_code >= 300:
+        return uploaded
+    return await client.post("/visualize", json={"image_url": target["image_url"], **VARIANT, **LEAD})
+
+
+async def call_analyze(client: httpx.AsyncClient, n: int) -> httpx.Response:
+    return await client.post("/analyze", data={
+        "image_url": f"https://images.example.com/load/{n}-{random.random()}.jpg"
+    })
+
+
+async def call_prompt(client: httpx.AsyncClient, n: int) -> httpx.Response:
+    return await client.post("/prompt/generate", json={
+        "image_description": f"kitchen {n} with oak cabinets, photo from an angle", **VARIANT
+    })
+
+
+SCENARIOS = {
+    "visualize": call_visualize,
+    "upload": call_upload,
+    "direct": call_direct,
+    "analyze": call_analyze,
+    "prompt": call_prompt,
+}
+
+
+# ============ PROCESSES ============
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def rss_bytes(pid: Optional[int]) -> dict:
+    """Current and peak resident memory of a process (Linux /proc only)"""
+    result = {"rss_bytes": None, "peak_rss_bytes": None}
+    if pid is None:
+        return result
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    result["rss_bytes"] = int(line.split()[1]) * 1024
+                elif line.startswith("VmHWM:"):
+                    result["peak_rss_bytes"] = int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return result
+
+
+def wait_until_up(url: str, timeout: float = 20.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(url, timeout=1.0).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.1)
+    raise RuntimeError(f"{url} did not come up within {timeout:.0f}s")
+
+
+@contextmanager
+def servers(args):
+    """Run fake_replicate and the API unless external URLs were given"""
+    procs = []
+    api_pid = None
+    fake_url, api_url = args.fake_url, args.api_url
+    # Shared by both sides: the API only runs in webhook mode with a secret to verify deliveries
+    webhook_secret = "whsec_" + base64.b64encode(os.urandom(24)).decode()
+    try:
+        if fake_url is None:
+            port = free_port()
+            fake_url = f"http://127.0.0.1:{port}"
+            env = {
+                **os.environ,
+                "FAKE_REPLICATE_QUEUE_DELAY": args.queue_delay,
+                "FAKE_REPLICATE_RUN_TIME": args.run_time,
+                "FAKE_REPLICATE_REQUEST_LATENCY": args.request_latency,
+                "FAKE_REPLICATE_FAILURE_RATE": str(args.failure_rate),
+                "FAKE_REPLICATE_BASE_URL": fake_url,
+                "FAKE_REPLICATE_WEBHOOK_SECRET": webhook_secret,
+            }
+            procs.append(subprocess.Popen(
+                [sys.executable, "-m", "uvicorn", "fake_replicate:app", "--port", str(port), "--log-level", "warning"],
+                cwd=API_DIR, env=env
+            ))
+            wait_until_up(f"{fake_url}/_stats")
+
+        if api_url is None:
+            port = free_port()
+            api_url = f"http://127.0.0.1:{port}"
+            env = {
+                **os.environ,
+                "REPLICATE_API_BASE": f"{fake_url}/v1",
+                "REPLICATE_API_TOKEN": "load-test",
+                "LOG_LEVEL": "WARNING",
+                # The direct upload flow needs a storage backend; local unless one is configured
+                "STORAGE_BACKEND": os.environ.get("STORAGE_BACKEND") or "local",
+            }
+            if args.webhook:
+                env["REPLICATE_WEBHOOK_URL"] = f"{api_url}/webhooks/replicate"
+                env["REPLICATE_WEBHOOK_SECRET"] = webhook_secret
+            proc = subprocess.Popen(
+                [sys.executable, "-m", "uvicorn", "api:app", "--port", str(port), "--log-level", "warning"],
+                cwd=API_DIR, env=env
+            )
+            procs.append(proc)
+            api_pid = proc.pid
+            wait_until_up(f"{api_url}/health")
+
+        yield fake_url, api_url, api_pid
+    finally:
+        for proc in procs:
+            proc.terminate()
+        for proc in procs:
+            proc.wait(timeout=10)
+
+
+# ============ RUNNER ============
+
+def percentile(sorted_values: list[float], p: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(p / 100 * len(sorted_values) + 0.5) - 1))
+    return sorted_values[index]
+
+
+async def run_level(api_url: str, fake_url: str, api_pid: Optional[int],
+                    scenario: str, concurrency: int, requests: int) -> dict:
+    call = SCENARIOS[scenario]
+    latencies: list[float] = []
+    statuses: dict[str, int] = {}
+    counter = iter(range(requests))
+
+    async with httpx.AsyncClient(base_url=fake_url, timeout=10) as fake:
+        await fake.post("/_reset")
+
+        limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+        async with httpx.AsyncClient(base_url=api_url, timeout=300, limits=limits) as client:
+            async def worker() -> None:
+                for n in counter:
+                    start = time.perf_counter()
+                    try:
+                        response = await call(client, n)
+                        status = str(response.status_code)
+                    except httpx.HTTPError as err:
+                        status = type(err).__name__
+                    latencies.append(time.perf_counter() - start)
+                    statuses[status] = statuses.get(status, 0) + 1
+
+            started = time.perf_counter()
+            await asyncio.gather(*(worker() for _ in range(concurrency)))
+            elapsed = time.perf_counter() - started
+            api_stats = (await client.get("/stats")).json()
+
+        outbound = (await fake.get("/_stats")).json()["requests"]
+
+    latencies.sort()
+    ok = sum(count for status, count in statuses.items() if status.startswith("2"))
+    pool = api_stats.get("http_pool", {})
+    return {
+        "scenario": scenario,
+        "concurrency": concurrency,
+        "requests": requests,
+        "ok": ok,
+        "errors": requests - ok,
+        "statuses": statuses,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "throughput_rps": requests / elapsed,
+        "outbound": outbound,
+        "outbound_per_request": sum(outbound.values()) / requests,
+        "polls_per_request": outbound.get("predictions_get", 0) / requests,
+        "pool_peak_in_flight": pool.get("peak_requests_in_flight"),
+        "pool_connections_open": pool.get("connections_open"),
+        **rss_bytes(api_pid),
+    }
+
+
+def print_result(r: dict) -> None:
+    rss = f"{r['rss_bytes'] / 2**20:.0f}/{r['peak_rss_bytes'] / 2**20:.0f} MB" if r["rss_bytes"] else "n/a"
+    print(
+        f"{r['scenario']:>10} c={r['concurrency']:<3} "
+        f"p50 {r['p50_ms']:8.1f}  p95 {r['p95_ms']:8.1f}  p99 {r['p99_ms']:8.1f} ms  "
+        f"{r['throughput_rps']:7.1f} req/s  errors {r['errors']:<3} "
+        f"outbound/req {r['outbound_per_request']:5.2f} (polls {r['polls_per_request']:5.2f})  "
+        f"conns {r['pool_connections_open']}  rss {rss}"
+    )
+
+
+def compare(results: list[dict], baseline_path: str, tolerance: float) -> list[str]:
+    """Regressions against a saved run: slower p95/p99 or more outbound calls per request"""
+    with open(baseline_path) as f:
+        baseline = {(r["scenario"], r["concurrency"]): r for r in json.load(f)["results"]}
+
+    regressions = []
+    for r in results:
+        base = baseline.get((r["scenario"], r["concurrency"]))
+        if base is None:
+            continue
+        label = f"{r['scenario']} c={r['concurrency']}"
+        for metric in ("p95_ms", "p99_ms", "outbound_per_request"):
+            # Ignore noise on near-zero values (e.g. sub-millisecond prompt builds)
+            floor = 5.0 if metric.endswith("_ms") else 0.5
+            if r[metric] > max(base[metric], floor) * (1 + tolerance):
+                regressions.append(f"{label}: {metric} {base[metric]:.2f} -> {r[metric]:.2f}")
+        if r["errors"] > base["errors"]:
+            regressions.append(f"{label}: errors {base['errors']} -> {r['errors']}")
+    return regressions
+
+
+async def main_async(args) -> int:
+    scenarios = args.scenarios.split(",")
+    levels = [int(level) for level in args.concurrency.split(",")]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        raise SystemExit(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+
+    results = []
+    with servers(args) as (fake_url, api_url, api_pid):
+        for scenario in scenarios:
+            for concurrency in levels:
+                result = await run_level(api_url, fake_url, api_pid, scenario, concurrency, args.requests)
+                print_result(result)
+                results.append(result)
+
+    config = {key: getattr(args, key) for key in (
+        "queue_delay", "run_time", "request_latency", "failure_rate", "webhook", "requests"
+    )}
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({"config": config, "results": results}, f, indent=2)
+        print(f"saved {args.save}")
+
+    if args.compare:
+        regressions = compare(results, args.compare, args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            return 1
+        print(f"no regressions vs {args.compare} (tolerance {args.tolerance:.0%})")
+    return 0
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--scenarios", default="prompt,analyze,visualize,upload")
+    parser.add_argument("--concurrency", default="1,8,32")
+    parser.add_argument("--requests", type=int, default=64, help="requests per scenario and level")
+    parser.add_argument("--queue-delay", default="uniform:0.1:0.4", help="fake latency spec")
+    parser.add_argument("--run-time", default="lognormal:0.8:0.3", help="fake latency spec")
+    parser.add_argument("--request-latency", default="uniform:0.01:0.05", help="fake latency spec")
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--webhook", action="store_true", help="run the API in webhook mode")
+    parser.add_argument("--api-url", help="use a running API instead of starting one")
+    parser.add_argument("--fake-url", help="use a running fake_replicate instead of starting one")
+    parser.add_argument("--save", help="write results as JSON")
+    parser.add_argument("--compare", help="baseline JSON from --save; exit 1 on regression")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative slowdown")
+    sys.exit(asyncio.run(main_async(parser.parse_args())))
+
+
+if __name__ == "__main__":
+    main()
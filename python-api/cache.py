@@ -0,0 +1,374 @@
+"""
+Result caches for the visualizer pipeline
+
+TieredCache pairs an in-memory LRU tier (with TTL) with an optional shared
+tier that survives restarts and is visible to every worker process: SQLite
+(in WAL mode, for workers on one host) or Redis. Values must be
+JSON-serializable. Keys are built with content_key() for raw image bytes or
+url_key() for image URLs.
+
+Each cache is configured from environment variables sharing a prefix, e.g.
+for build_cache("ANALYSIS_CACHE", ...):
+    ANALYSIS_CACHE_SIZE   Max entries in memory
+    ANALYSIS_CACHE_TTL    Seconds before an entry expires
+    ANALYSIS_CACHE_DB     Path to a SQLite file (overrides STATE_BACKEND for this cache)
+
+The shared tier for every cache (and for job state, see jobs.py) comes from:
+    STATE_BACKEND   memory (default, per process), sqlite or redis
+    STATE_DB        SQLite file for STATE_BACKEND=sqlite (default aeon_state.db)
+    REDIS_URL       Server for STATE_BACKEND=redis (default redis://localhost:6379/0;
+                    needs the redis package)
+"""
+
+import os
+import json
+import math
+import time
+import asyncio
+import hashlib
+import logging
+import sqlite3
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Iterator, Optional
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+try:
+    import redis.asyncio as redis_asyncio
+    from redis.exceptions import RedisError
+except ImportError:  # STATE_BACKEND=redis unavailable; memory and sqlite still work
+    redis_asyncio = None
+    RedisError = None
+
+logger = logging.getLogger(__name__)
+
+STATE_BACKEND = os.environ.get("STATE_BACKEND", "memory").lower()
+STATE_DB = os.environ.get("STATE_DB", "aeon_state.db")
+REDIS_URL = os.environ.get("REDIS_URL", "redis://localhost:6379/0")
+
+# Failures of a shared tier are logged and treated as misses, never raised
+BACKEND_ERRORS: tuple = (sqlite3.Error,) + ((RedisError, OSError) if RedisError else ())
+
+
+def content_key(data: bytes) -> str:
+    """Cache key for raw image bytes"""
+    return "sha256:" + hashlib.sha256(data).hexdigest()
+
+
+def url_key(url: str) -> str:
+    """
+    Cache key for an image URL. Scheme and host are lower-cased, default
+    ports and fragments dropped and query parameters sorted, so trivially
+    different spellings of the same URL share an entry. Data URIs are keyed
+    by their content.
+    """
+    if url.startswith("data:"):
+        return content_key(url.encode())
+
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    if parts.port and (scheme, parts.port) not in (("http", 80), ("https", 443)):
+        host = f"{host}:{parts.port}"
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    normalized = urlunsplit((scheme, host, parts.path or "/", query, ""))
+    return "url:" + normalized
+
+
+class MemoryCache:
+    """LRU cache with per-entry expiry"""
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: str) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.time():
+            del self._entries[key]
+            self.expirations += 1
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        self._entries[key] = (time.time() + (ttl or self.ttl), value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def delete(self, key: str) -> None:
+        self._entries.pop(key, None)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class SQLiteCache:
+    """Persistent cache tier. Blocking sqlite calls run in a worker thread."""
+
+    backend = "sqlite"
+
+    # Expired rows are swept and the table trimmed every this many writes
+    PRUNE_EVERY = 100
+
+    def __init__(self, path: str, table: str, max_entries: int, ttl: float):
+        self.path = path
+        self.table = table
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.evictions = 0
+        self._writes = 0
+        with self._connect() as conn:
+            # WAL lets readers in other processes proceed during a write
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {table} ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_expires ON {table}(expires_at)")
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        conn = sqlite3.connect(self.path, timeout=5.0)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _get(self, key: str) -> Optional[Any]:
+        with self._connect() as conn:
+            row = conn.execute(
+                f"SELECT value FROM {self.table} WHERE key = ? AND expires_at >= ?",
+                (key, time.time())
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _set(self, key: str, value: Any, ttl: Optional[float]) -> None:
+        with self._connect() as conn:
+            conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value), time.time() + (ttl or self.ttl))
+            )
+            self._writes += 1
+            if self._writes % self.PRUNE_EVERY == 0:
+                self._prune(conn)
+
+    def _prune(self, conn: sqlite3.Connection) -> None:
+        conn.execute(f"DELETE FROM {self.table} WHERE expires_at < ?", (time.time(),))
+        removed = conn.execute(
+            f"DELETE FROM {self.table} WHERE key NOT IN "
+            f"(SELECT key FROM {self.table} ORDER BY expires_at DESC LIMIT ?)",
+            (self.max_entries,)
+        ).rowcount
+        self.evictions += max(removed, 0)
+
+    def _delete(self, key: str) -> None:
+        with self._connect() as conn:
+            conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+
+    async def get(self, key: str) -> Optional[Any]:
+        return await asyncio.to_thread(self._get, key)
+
+    async def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        await asyncio.to_thread(self._set, key, value, ttl)
+
+    async def delete(self, key: str) -> None:
+        await asyncio.to_thread(self._delete, key)
+
+
+class RedisCache:
+    """
+    Shared tier in Redis, or any server speaking its protocol. Entries expire
+    server-side; size is bounded by the server's maxmemory policy.
+    """
+
+    backend = "redis"
+
+    def __init__(self, url: str, namespace: str, ttl: float):
+        if redis_asyncio is None:
+            raise RuntimeError("STATE_BACKEND=redis needs the redis package (pip install redis)")
+        self.client = redis_asyncio.from_url(url)
+        self.namespace = namespace
+        self.ttl = ttl
+        self.evictions = 0
+
+    def _key(self, key: str) -> str:
+        return f"aeon:{self.namespace}:{key}"
+
+    async def get(self, key: str) -> Optional[Any]:
+        raw = await self.client.get(self._key(key))
+        return json.loads(raw) if raw is not None else None
+
+    async def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        await self.client.set(self._key(key), json.dumps(value), ex=max(1, math.ceil(ttl or self.ttl)))
+
+    async def delete(self, key: str) -> None:
+        await self.client.delete(self._key(key))
+
+
+def build_store(name: str, max_entries: int, ttl: float, db_path: Optional[str] = None):
+    """
+    The shared tier named `name` for STATE_BACKEND: None for memory, else a
+    SQLiteCache or RedisCache with get / set / delete. db_path forces SQLite.
+    """
+    if db_path:
+        return SQLiteCache(db_path, name, max_entries, ttl)
+    if STATE_BACKEND == "memory":
+        return None
+    if STATE_BACKEND == "sqlite":
+        return SQLiteCache(STATE_DB, name, max_entries, ttl)
+    if STATE_BACKEND == "redis":
+        return RedisCache(REDIS_URL, name, ttl)
+    raise ValueError(f"Unknown STATE_BACKEND {STATE_BACKEND!r} (expected memory, sqlite or redis)")
+
+
+class TieredCache:
+    """
+    Memory LRU in front of an optional shared tier, with hit/miss counters.
+    Every worker has its own memory tier, so a bypass_cache refresh reaches
+    other workers once their copy expires or is evicted.
+    """
+
+    def __init__(self, name: str, max_entries: int, ttl: float, shared=None):
+        self.name = name
+        self.memory = MemoryCache(max_entries, ttl)
+        self.shared = shared
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+
+    async def get(self, key: str, record_miss: bool = True) -> Optional[Any]:
+        value = self.memory.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+
+        if self.shared is not None:
+            try:
+                value = await self.shared.get(key)
+            except BACKEND_ERRORS as err:
+                logger.warning("%s shared read failed: %s", self.name, err)
+                value = None
+            if value is not None:
+                self.hits += 1
+                self.shared_hits += 1
+                self.memory.set(key, value)
+                return value
+
+        if record_miss:
+            self.misses += 1
+        return None
+
+    async def peek(self, key: str) -> Optional[Any]:
+        """Early lookup that leaves miss accounting to a later get()"""
+        return await self.get(key, record_miss=False)
+
+    async def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        self.memory.set(key, value, ttl)
+        if self.shared is not None:
+            try:
+                await self.shared.set(key, value, ttl)
+            except BACKEND_ERRORS as err:
+                logger.warning("%s shared write failed: %s", self.name, err)
+
+    async def delete(self, key: str) -> None:
+        self.memory.delete(key)
+        if self.shared is not None:
+            await self.shared.delete(key)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.memory),
+            "max_entries": self.memory.max_entries,
+            "ttl": self.memory.ttl,
+            "hits": self.hits,
+            "shared_hits": self.shared_hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.memory.evictions + (self.shared.evictions if self.shared else 0),
+            "expirations": self.memory.expirations,
+            "shared_tier": self.shared.backend if self.shared else None,
+        }
+
+
+def build_cache(prefix: str, default_size: int, default_ttl: float) -> TieredCache:
+    """Create a TieredCache configured from PREFIX_SIZE / PREFIX_TTL / PREFIX_DB and STATE_BACKEND"""
+    name = prefix.lower()
+    max_entries = int(os.environ.get(f"{prefix}_SIZE", str(default_size)))
+    ttl = float(os.environ.get(f"{prefix}_TTL", str(default_ttl)))
+    return TieredCache(
+        name=name,
+        max_entries=max_entries,
+        ttl=ttl,
+        shared=build_store(name, max_entries * 10, ttl, db_path=os.environ.get(f"{prefix}_DB") or None),
+    )
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls for the same key into one execution.
+
+    The first caller starts the work as a task; callers arriving while it is
+    in flight await the same task. The task is shielded, so one caller giving
+    up does not cancel the work for the others. With cancel_orphans, the
+    work is cancelled when the last caller gives up (with that caller's
+    cancel message), so nobody pays for a result nobody is waiting for.
+    """
+
+    def __init__(self, cancel_orphans: bool = False):
+        self.cancel_orphans = cancel_orphans
+        self._calls: dict[str, asyncio.Task] = {}
+        self._waiters: dict[asyncio.Task, int] = {}
+        self.leaders = 0
+        self.coalesced = 0
+        self.orphaned = 0
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._calls.get(key)
+        if task is None:
+            self.leaders += 1
+            task = asyncio.create_task(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda done: self._finish(key, done))
+        else:
+            self.coalesced += 1
+        self._waiters[task] = self._waiters.get(task, 0) + 1
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError as err:
+            if self.cancel_orphans and self._waiters[task] == 1 and not task.done():
+                self.orphaned += 1
+                task.cancel(err.args[0] if err.args else None)
+                # Callers arriving from now on start fresh work
+                if self._calls.get(key) is task:
+                    del self._calls[key]
+            raise
+        finally:
+            self._waiters[task] -= 1
+            if not self._waiters[task]:
+                del self._waiters[task]
+
+    def _finish(self, key: str, task: asyncio.Task) -> None:
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # Mark the exception retrieved in case every caller went away
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": len(self._calls),
+            "leaders": self.leaders,
+            "coalesced": self.coalesced,
+            "orphaned": self.orphaned,
+        }
@@ -0,0 +1,326 @@
+"""
+Local stand-in for api.replicate.com
+
+Implements the slice of the Replicate HTTP API the visualizer uses
+(predictions, polling, cancel, file upload, output delivery) with simulated queue and run
+times, so the webhook and polling paths can be exercised without spending
+real money.
+
+Delays are latency specs: a number of seconds, or one of
+    uniform:LOW:HIGH    normal:MEAN:STDDEV    lognormal:MEDIAN:SIGMA    exp:MEAN
+(all in seconds, never negative).
+
+Run standalone:
+    uvicorn fake_replicate:app --port 8001
+    export REPLICATE_API_BASE=http://localhost:8001/v1
+
+Configuration (environment, standalone app only):
+    FAKE_REPLICATE_QUEUE_DELAY       Time spent in `starting` (default 0.5)
+    FAKE_REPLICATE_RUN_TIME          Time spent in `processing` (default 2.0)
+    FAKE_REPLICATE_REQUEST_LATENCY   Added to every API response (default 0)
+    FAKE_REPLICATE_FAILURE_RATE      Fraction of predictions that fail (default 0)
+    FAKE_REPLICATE_CREATE_LIMIT      Creations per second before answering 429 (default 0, off)
+    FAKE_REPLICATE_ERROR_RATE        Fraction of creations answered with a 503 (default 0)
+    FAKE_REPLICATE_BASE_URL          Origin used in returned URLs
+    FAKE_REPLICATE_WEBHOOK_SECRET    Secret (whsec_...) webhook deliveries are signed with
+
+Or in-process, pointing an httpx client at create_fake_replicate() through
+httpx.ASGITransport.
+"""
+
+import io
+import os
+import hmac
+import json
+import math
+import time
+import uuid
+import base64
+import random
+import asyncio
+import hashlib
+from datetime import datetime, timezone
+from typing import Callable, Optional, Union
+
+import httpx
+from fastapi import FastAPI, HTTPException, Request, Response, UploadFile, File
+from fastapi.responses import JSONResponse
+
+FAKE_CAPTION = (
+    "a kitchen with white raised panel cabinets and warm lighting, "
+    "photo taken from an angle, granite countertops and stainless appliances"
+)
+
+
+# Size of the JPEG served at output delivery URLs
+OUTPUT_SIZE = (1536, 1152)
+
+# Log lines written while `processing`, tqdm style like real diffusion models
+LOG_STEPS = 4
+
+LatencySpec = Union[float, str, Callable[[], float]]
+
+
+def latency(spec: LatencySpec) -> Callable[[], float]:
+    """Turn a latency spec (seconds, "kind:a:b" string or callable) into a sampler"""
+    if callable(spec):
+        return spec
+    if isinstance(spec, (int, float)):
+        return lambda: float(spec)
+
+    kind, _, args = str(spec).partition(":")
+    if not args:
+        value = float(kind)
+        return lambda: value
+    params = [float(arg) for arg in args.split(":")]
+    samplers = {
+        "uniform": lambda low, high: random.uniform(low, high),
+        "normal": lambda mean, stddev: random.gauss(mean, stddev),
+        "lognormal": lambda median, sigma: random.lognormvariate(math.log(median), sigma),
+        "exp": lambda mean: random.expovariate(1 / mean),
+    }
+    if kind not in samplers:
+        raise ValueError(f"Unknown latency distribution {kind!r}")
+    sample = samplers[kind]
+    return lambda: max(0.0, sample(*params))
+
+
+_output_jpeg: list[bytes] = []
+
+
+def _output_image() -> bytes:
+    """A render-sized JPEG with some detail, so resized variants have real work to do"""
+    if not _output_jpeg:
+        from PIL import Image, ImageDraw
+        img = Image.linear_gradient("L").resize(OUTPUT_SIZE).convert("RGB")
+        draw = ImageDraw.Draw(img)
+        for x in range(0, OUTPUT_SIZE[0], 96):
+            draw.rectangle([x + 8, 120, x + 88, OUTPUT_SIZE[1] - 120], outline=(40, 40, 40), width=4)
+        out = io.BytesIO()
+        img.save(out, "JPEG", quality=90)
+        _output_jpeg.append(out.getvalue())
+    return _output_jpeg[0]
+
+
+def _timestamp(seconds: Optional[float]) -> Optional[str]:
+    if seconds is None:
+        return None
+    return datetime.fromtimestamp(seconds, tz=timezone.utc).isoformat().replace("+00:00", "Z")
+
+
+def create_fake_replicate(
+    queue_delay: LatencySpec = 0.2,
+    run_time: LatencySpec = 0.5,
+    failure_rate: float = 0.0,
+    base_url: str = "http://fake-replicate",
+    webhook_transport: Optional[httpx.AsyncBaseTransport] = None,
+    request_latency: LatencySpec = 0.0,
+    create_limit: int = 0,
+    error_rate: float = 0.0,
+    webhook_secret: str = "",
+) -> FastAPI:
+    """
+    Build a fake Replicate app.
+
+    queue_delay / run_time: latency specs for time spent in `starting` and `processing`
+    request_latency: latency spec added before every API response
+    create_limit: creations allowed per one-second window before answering
+        429 with Retry-After (0 disables)
+    error_rate: fraction of creations answered with a 503 before any
+        prediction is created
+    failure_rate: fraction of predictions that end in `failed`
+    base_url: origin used for file and output URLs
+    webhook_transport: transport for webhook deliveries (e.g. an ASGITransport
+        wrapping the API app when everything runs in one process)
+    webhook_secret: signing secret (whsec_...) for webhook deliveries, as
+        the API's REPLICATE_WEBHOOK_SECRET; deliveries are unsigned without it
+    """
+    app = FastAPI(title="Fake Replicate")
+    queue_delay, run_time, request_latency = latency(queue_delay), latency(run_time), latency(request_latency)
+    predictions: dict[str, dict] = {}
+    files: dict[str, tuple[bytes, str]] = {}
+    counters: dict[str, int] = {}
+    tasks: set[asyncio.Task] = set()
+    window = {"second": 0, "creates": 0}
+
+    def count(name: str) -> None:
+        counters[name] = counters.get(name, 0) + 1
+
+    async def respond_delay() -> None:
+        delay = request_latency()
+        if delay:
+            await asyncio.sleep(delay)
+
+    def public(prediction: dict) -> dict:
+        return {k: v for k, v in prediction.items() if not k.startswith("_")}
+
+    def sign_webhook(body: bytes) -> dict:
+        """webhook-id / webhook-timestamp / webhook-signature headers, as Replicate sends them"""
+        if not webhook_secret:
+            return {}
+        webhook_id, timestamp = f"msg_{uuid.uuid4().hex}", str(int(time.time()))
+        key = base64.b64decode(webhook_secret.split("_", 1)[-1])
+        digest = hmac.new(key, f"{webhook_id}.{timestamp}.".encode() + body, hashlib.sha256).digest()
+        return {
+            "webhook-id": webhook_id,
+            "webhook-timestamp": timestamp,
+            "webhook-signature": f"v1,{base64.b64encode(digest).decode()}",
+        }
+
+    async def deliver_webhook(prediction: dict) -> None:
+        url = prediction.get("_webhook")
+        if not url:
+            return
+        count("webhooks_sent")
+        body = json.dumps(public(prediction)).encode()
+        headers = {"Content-Type": "application/json", **sign_webhook(body)}
+        async with httpx.AsyncClient(transport=webhook_transport) as client:
+            try:
+                await client.post(url, content=body, headers=headers, timeout=10.0)
+            except httpx.HTTPError:
+                count("webhooks_failed")
+
+    async def lifecycle(prediction: dict) -> None:
+        await asyncio.sleep(queue_delay())
+        if prediction["status"] == "canceled":
+            return
+        prediction["status"] = "processing"
+        prediction["started_at"] = _timestamp(time.time())
+
+        step = run_time() / LOG_STEPS
+        for done in range(1, LOG_STEPS + 1):
+            await asyncio.sleep(step)
+            if prediction["status"] == "canceled":
+                return
+            percent = 100 * done // LOG_STEPS
+            prediction["logs"] += f"{percent:3d}%|{'#' * (percent // 10):<10}| {done}/{LOG_STEPS}\n"
+        if random.random() < failure_rate:
+            prediction["status"] = "failed"
+            prediction["error"] = "Simulated failure"
+        else:
+            prediction["status"] = "succeeded"
+            prediction["output"] = (
+                FAKE_CAPTION if prediction["_model"] != "google/nano-banana"
+                else f"{base_url}/delivery/{prediction['id']}/output.jpg"
+            )
+        prediction["completed_at"] = _timestamp(time.time())
+        await deliver_webhook(prediction)
+
+    @app.post("/v1/predictions", status_code=201)
+    async def create_prediction(request: Request):
+        count("predictions_create")
+        await respond_delay()
+        if create_limit:
+            now = time.time()
+            if int(now) != window["second"]:
+                window.update(second=int(now), creates=0)
+            window["creates"] += 1
+            if window["creates"] > create_limit:
+                count("predictions_throttled")
+                return JSONResponse(
+                    status_code=429,
+                    content={"detail": "Request was throttled."},
+                    headers={"Retry-After": str(max(1, math.ceil(int(now) + 1 - now)))}
+                )
+        if random.random() < error_rate:
+            count("predictions_create_errors")
+            return JSONResponse(status_code=503, content={"detail": "Simulated upstream error"})
+        body = await request.json()
+        prediction_id = uuid.uuid4().hex[:26]
+        prediction = {
+            "id": prediction_id,
+            "model": body.get("model", ""),
+            "version": body.get("version", ""),
+            "input": body.get("input", {}),
+            "status": "starting",
+            "output": None,
+            "error": None,
+            "logs": "",
+            "created_at": _timestamp(time.time()),
+            "started_at": None,
+            "completed_at": None,
+            "urls": {
+                "get": f"{base_url}/v1/predictions/{prediction_id}",
+                "cancel": f"{base_url}/v1/predictions/{prediction_id}/cancel",
+            },
+            "_model": body.get("model") or body.get("version", ""),
+            "_webhook": body.get("webhook"),
+        }
+        predictions[prediction_id] = prediction
+        task = asyncio.create_task(lifecycle(prediction))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+        return public(prediction)
+
+    @app.get("/v1/predictions/{prediction_id}")
+    async def get_prediction(prediction_id: str):
+        count("predictions_get")
+        await respond_delay()
+        if prediction_id not in predictions:
+            raise HTTPException(status_code=404, detail="Not found")
+        return public(predictions[prediction_id])
+
+    @app.post("/v1/predictions/{prediction_id}/cancel")
+    async def cancel_prediction(prediction_id: str):
+        count("predictions_cancel")
+        await respond_delay()
+        prediction = predictions.get(prediction_id)
+        if prediction is None:
+            raise HTTPException(status_code=404, detail="Not found")
+        if prediction["status"] in ("starting", "processing"):
+            prediction["status"] = "canceled"
+            prediction["completed_at"] = _timestamp(time.time())
+        return public(prediction)
+
+    @app.post("/v1/files", status_code=201)
+    async def upload_file(file: UploadFile = File(...)):
+        count("files_create")
+        await respond_delay()
+        file_id = uuid.uuid4().hex
+        files[file_id] = (await file.read(), file.content_type or "application/octet-stream")
+        return {"id": file_id, "urls": {"get": f"{base_url}/v1/files/{file_id}"}}
+
+    @app.get("/v1/files/{file_id}")
+    async def get_file(file_id: str):
+        count("files_get")
+        if file_id not in files:
+            raise HTTPException(status_code=404, detail="Not found")
+        data, content_type = files[file_id]
+        return Response(content=data, media_type=content_type)
+
+    @app.get("/delivery/{prediction_id}/output.jpg")
+    async def get_output(prediction_id: str):
+        count("delivery_get")
+        prediction = predictions.get(prediction_id)
+        if prediction is None or prediction["status"] != "succeeded":
+            raise HTTPException(status_code=404, detail="Not found")
+        return Response(content=_output_image(), media_type="image/jpeg")
+
+    @app.get("/_stats")
+    async def stats():
+        statuses: dict[str, int] = {}
+        for prediction in predictions.values():
+            statuses[prediction["status"]] = statuses.get(prediction["status"], 0) + 1
+        return {"requests": counters, "predictions": statuses, "files": len(files)}
+
+    @app.post("/_reset")
+    async def reset():
+        """Forget predictions, files and counters between benchmark runs"""
+        predictions.clear()
+        files.clear()
+        counters.clear()
+        return {"reset": True}
+
+    return app
+
+
+app = create_fake_replicate(
+    queue_delay=os.environ.get("FAKE_REPLICATE_QUEUE_DELAY", "0.5"),
+    run_time=os.environ.get("FAKE_REPLICATE_RUN_TIME", "2.0"),
+    request_latency=os.environ.get("FAKE_REPLICATE_REQUEST_LATENCY", "0"),
+    create_limit=int(os.environ.get("FAKE_REPLICATE_CREATE_LIMIT", "0")),
+    error_rate=float(os.environ.get("FAKE_REPLICATE_ERROR_RATE", "0")),
+    failure_rate=float(os.environ.get("FAKE_REPLICATE_FAILURE_RATE", "0")),
+    base_url=os.environ.get("FAKE_REPLICATE_BASE_URL", "http://localhost:8001"),
+    webhook_secret=os.environ.get("FAKE_REPLICATE_WEBHOOK_SECRET", ""),
+)
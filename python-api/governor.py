@@ -0,0 +1,222 @@
+"""
+Outbound governor for Replicate predictions
+
+Two limits are shared by every request in the process:
+    - a token bucket on prediction creation (Replicate rate-limits
+      POST /predictions per account), paused whenever Replicate answers 429
+      so the whole process backs off together for Retry-After;
+    - a cap on predictions in flight per model, held from creation until
+      the prediction finishes.
+Both queue their waiters first-come first-served, so a burst is admitted
+in arrival order instead of by whichever coroutine wakes first. Waiting
+longer than GOVERNOR_QUEUE_TIMEOUT raises GovernorTimeout.
+
+Configuration (environment):
+    REPLICATE_CREATE_RATE           Prediction creations per second (default 10, 0 disables)
+    REPLICATE_CREATE_BURST          Creations allowed back to back (default 10)
+    REPLICATE_MAX_IN_FLIGHT         Predictions in flight per model (default 8, 0 disables)
+    REPLICATE_MAX_IN_FLIGHT_<MODEL> Per-model override, e.g. REPLICATE_MAX_IN_FLIGHT_NANO_BANANA
+    GOVERNOR_QUEUE_TIMEOUT          Longest a request waits for a token or slot (default 30)
+"""
+
+import os
+import time
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
+from telemetry import CallbackMetric, Counter, Histogram, register
+
+REPLICATE_CREATE_RATE = float(os.environ.get("REPLICATE_CREATE_RATE", "10"))
+REPLICATE_CREATE_BURST = int(os.environ.get("REPLICATE_CREATE_BURST", "10"))
+REPLICATE_MAX_IN_FLIGHT = int(os.environ.get("REPLICATE_MAX_IN_FLIGHT", "8"))
+GOVERNOR_QUEUE_TIMEOUT = float(os.environ.get("GOVERNOR_QUEUE_TIMEOUT", "30"))
+
+
+wait_seconds = register(Histogram(
+    "aeon_governor_wait_seconds", "Time spent waiting for a creation token or in-flight slot", ("model", "kind")
+))
+timeouts = register(Counter(
+    "aeon_governor_timeouts_total", "Requests that gave up waiting on the governor", ("model", "kind")
+))
+throttles = register(Counter(
+    "aeon_replicate_throttled_total", "429 responses from Replicate", ("model",)
+))
+
+
+class GovernorTimeout(Exception):
+    """Waited longer than GOVERNOR_QUEUE_TIMEOUT for a token or an in-flight slot"""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Token bucket whose waiters are served in FIFO order"""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        # asyncio.Lock wakes waiters in FIFO order, which gives the fairness
+        self._lock = asyncio.Lock()
+        self.waiting = 0
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self) -> None:
+        if self.rate <= 0:
+            return
+        self.waiting += 1
+        try:
+            async with self._lock:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+                    if now >= self.paused_until and self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    delay = max(self.paused_until - now, (1 - self.tokens) / self.rate)
+                    await asyncio.sleep(delay)
+        finally:
+            self.waiting -= 1
+
+    def pause(self, seconds: float) -> None:
+        """Hold every creation for `seconds` (after a 429) and drop the burst"""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0.0
+
+
+class FairLimiter:
+    """
+    Concurrency cap whose waiters are admitted strictly in arrival order.
+    A released slot is handed straight to the oldest waiter, so late
+    arrivals cannot barge ahead.
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.in_flight = 0
+        self._waiters: deque[asyncio.Future] = deque()
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    async def acquire(self) -> None:
+        if self.limit <= 0:
+            self.in_flight += 1
+            return
+        if self.in_flight < self.limit and not self._waiters:
+            self.in_flight += 1
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append(future)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # The slot was handed over just as we gave up; pass it on
+                self.release()
+            else:
+                self._waiters.remove(future)
+            raise
+
+    def release(self) -> None:
+        while self._waiters:
+            future = self._waiters.popleft()
+            if not future.done():
+                # The slot moves to the waiter; in_flight is unchanged
+                future.set_result(None)
+                return
+        self.in_flight -= 1
+
+
+class Governor:
+    """Shared creation rate limit plus per-model in-flight caps"""
+
+    def __init__(
+        self,
+        create_rate: float = REPLICATE_CREATE_RATE,
+        create_burst: int = REPLICATE_CREATE_BURST,
+        max_in_flight: int = REPLICATE_MAX_IN_FLIGHT,
+        queue_timeout: float = GOVERNOR_QUEUE_TIMEOUT
+    ):
+        self.bucket = TokenBucket(create_rate, create_burst)
+        self.max_in_flight = max_in_flight
+        self.queue_timeout = queue_timeout
+        self._limiters: dict[str, FairLimiter] = {}
+
+    def limiter(self, model: str) -> FairLimiter:
+        limiter = self._limiters.get(model)
+        if limiter is None:
+            override = os.environ.get(f"REPLICATE_MAX_IN_FLIGHT_{model.upper().replace('-', '_')}")
+            limiter = self._limiters[model] = FairLimiter(int(override) if override else self.max_in_flight)
+        return limiter
+
+    async def _wait(self, model: str, kind: str, acquire) -> None:
+        start = time.monotonic()
+        try:
+            await asyncio.wait_for(acquire(), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            timeouts.inc(model=model, kind=kind)
+            raise GovernorTimeout(
+                f"No {model} {kind} free after {self.queue_timeout:.0f}s", retry_after=self.queue_timeout
+            )
+        finally:
+            wait_seconds.observe(time.monotonic() - start, model=model, kind=kind)
+
+    @asynccontextmanager
+    async def slot(self, model: str) -> AsyncIterator[None]:
+        """Hold one of the model's in-flight slots for the duration of the block"""
+        limiter = self.limiter(model)
+        await self._wait(model, "slot", limiter.acquire)
+        try:
+            yield
+        finally:
+            limiter.release()
+
+    async def acquire_create(self, model: str) -> None:
+        """Take a creation token, waiting behind earlier callers"""
+        await self._wait(model, "token", self.bucket.acquire)
+
+    def throttled(self, model: str, retry_after: float) -> None:
+        """Replicate answered 429: stop all creations for retry_after seconds"""
+        throttles.inc(model=model)
+        self.bucket.pause(retry_after)
+
+    def stats(self) -> dict:
+        return {
+            "create_rate": self.bucket.rate,
+            "create_burst": self.bucket.burst,
+            "create_tokens": round(self.bucket.tokens, 2),
+            "create_waiting": self.bucket.waiting,
+            "paused_for": max(0.0, round(self.bucket.paused_until - time.monotonic(), 2)),
+            "models": {
+                model: {"limit": limiter.limit, "in_flight": limiter.in_flight, "waiting": limiter.waiting}
+                for model, limiter in self._limiters.items()
+            },
+        }
+
+
+governor = Governor()
+
+register(CallbackMetric(
+    "aeon_governor_in_flight", "Predictions in flight per model", "gauge",
+    lambda: {(model,): limiter.in_flight for model, limiter in governor._limiters.items()}, ("model",)
+))
+register(CallbackMetric(
+    "aeon_governor_waiting", "Requests queued for an in-flight slot per model", "gauge",
+    lambda: {(model,): limiter.waiting for model, limiter in governor._limiters.items()}, ("model",)
+))
+register(CallbackMetric(
+    "aeon_governor_create_waiting", "Requests queued for a creation token", "gauge",
+    lambda: governor.bucket.waiting
+))
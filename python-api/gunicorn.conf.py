@@ -0,0 +1,40 @@
+"""
+Gunicorn settings for running the API on several cores
+
+Run with: gunicorn api:app -c gunicorn.conf.py
+
+Each worker is a separate process with its own event loop, connection pool,
+job workers, circuit breakers and outbound governor. Set STATE_BACKEND to
+sqlite (one host) or redis so caches, job status and webhook deliveries are
+shared between workers, and divide REPLICATE_CREATE_RATE and
+REPLICATE_MAX_IN_FLIGHT by the worker count to keep the account-wide limits.
+
+Configuration (environment):
+    WEB_CONCURRENCY   Worker processes (default: one per CPU)
+    BIND              Listen address (default 0.0.0.0:8000)
+"""
+
+import os
+import logging
+import multiprocessing
+
+bind = os.environ.get("BIND", "0.0.0.0:8000")
+workers = int(os.environ.get("WEB_CONCURRENCY", str(multiprocessing.cpu_count())))
+worker_class = "uvicorn.workers.UvicornWorker"
+
+# Loop-bound state (httpx client, job queue, Redis connections) is created
+# per worker, so the app is imported after forking
+preload_app = False
+
+# A visualization may run for REQUEST_DEADLINE seconds; give it room to finish
+timeout = int(float(os.environ.get("REQUEST_DEADLINE", "150"))) + 30
+graceful_timeout = 30
+keepalive = 5
+
+
+def on_starting(server):
+    if workers > 1 and os.environ.get("STATE_BACKEND", "memory").lower() == "memory":
+        logging.getLogger("gunicorn.error").warning(
+            "Running %d workers with STATE_BACKEND=memory: caches and job status are not shared; "
+            "set STATE_BACKEND=sqlite or redis", workers
+        )
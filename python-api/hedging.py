@@ -0,0 +1,258 @@
+"""
+Hedged renders - a backup Nano-Banana prediction for slow-starting ones
+
+Most Nano-Banana predictions leave `starting` within a few seconds, but some
+sit in Replicate's queue for much longer. With HEDGED_RENDERS on, a render
+whose prediction is still `starting` after the hedge threshold gets a
+duplicate prediction; the first to succeed is used and the other is
+cancelled on Replicate (reason hedge_lost).
+    - threshold: the HEDGE_QUANTILE of recent renders' time to `processing`
+      once HEDGE_MIN_SAMPLES are known (HEDGE_DEFAULT_DELAY until then),
+      never below HEDGE_MIN_DELAY;
+    - budget: every render earns HEDGE_BUDGET of a hedge, banked up to
+      HEDGE_BUDGET_BURST, so at most about that share of renders is
+      duplicated, even while the queue is slow for everyone.
+
+/stats (hedging) compares the p99 render latency with an estimate of the
+p99 without hedging: a render won by its backup is credited with the time
+its primary had spent plus the typical run time, a lower bound since the
+primary may have queued much longer. The cost is the number of duplicates
+and the billed (`processing`) time of the cancelled losers.
+
+Configuration (environment):
+    HEDGED_RENDERS       "1" to hedge slow-starting renders (default 0)
+    HEDGE_QUANTILE       Time-to-processing quantile used as the threshold (default 0.9)
+    HEDGE_MIN_SAMPLES    Renders observed before the quantile is used (default 20)
+    HEDGE_DEFAULT_DELAY  Threshold until then, in seconds (default 10)
+    HEDGE_MIN_DELAY      Lowest threshold, in seconds (default 2)
+    HEDGE_BUDGET         Hedges earned per render (default 0.1)
+    HEDGE_BUDGET_BURST   Most hedges that can be banked (default 3)
+"""
+
+import os
+import time
+import asyncio
+import functools
+import logging
+from collections import deque
+from typing import Awaitable, Callable, Optional
+
+from telemetry import Counter, Histogram, register
+
+logger = logging.getLogger(__name__)
+
+HEDGED_RENDERS = os.environ.get("HEDGED_RENDERS", "0") == "1"
+HEDGE_QUANTILE = float(os.environ.get("HEDGE_QUANTILE", "0.9"))
+HEDGE_MIN_SAMPLES = int(os.environ.get("HEDGE_MIN_SAMPLES", "20"))
+HEDGE_DEFAULT_DELAY = float(os.environ.get("HEDGE_DEFAULT_DELAY", "10"))
+HEDGE_MIN_DELAY = float(os.environ.get("HEDGE_MIN_DELAY", "2"))
+HEDGE_BUDGET = float(os.environ.get("HEDGE_BUDGET", "0.1"))
+HEDGE_BUDGET_BURST = float(os.environ.get("HEDGE_BUDGET_BURST", "3"))
+
+# Recent renders kept for the threshold and the latency comparison
+WINDOW = 500
+
+hedges = register(Counter(
+    "aeon_render_hedges_total",
+    "Slow-starting renders by outcome (primary / backup = which prediction won, denied = over budget)",
+    ("outcome",)
+))
+render_latency = register(Histogram(
+    "aeon_hedged_render_seconds",
+    "Render latency with hedging (actual) and the estimate without it (unhedged)",
+    ("latency",)
+))
+loser_seconds = register(Counter(
+    "aeon_hedge_loser_processing_seconds_total",
+    "Billed (processing) time of hedge predictions cancelled after the other one won",
+))
+
+# run(on_start, reuse) runs one prediction and returns its final state;
+# reuse=False always creates one (see the prediction ledger)
+Run = Callable[..., Awaitable[dict]]
+
+
+def quantile(values, q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class Attempt:
+    """One prediction of a render, with when it started processing"""
+
+    def __init__(self, run: Run):
+        self.created = time.monotonic()
+        self.started_at: Optional[float] = None
+        self.started = asyncio.Event()
+        self.task = asyncio.create_task(run(self.start))
+
+    def start(self) -> None:
+        self.started_at = time.monotonic()
+        self.started.set()
+
+    def succeeded(self) -> bool:
+        return (
+            self.task.done() and not self.task.cancelled() and self.task.exception() is None
+            and self.task.result().get("status") == "succeeded"
+        )
+
+    def processing_seconds(self) -> float:
+        return time.monotonic() - self.started_at if self.started_at is not None else 0.0
+
+
+class HedgePolicy:
+    """Hedge threshold, budget and the outcomes of hedged renders"""
+
+    def __init__(self):
+        self.queue_times: deque = deque(maxlen=WINDOW)
+        self.run_times: deque = deque(maxlen=WINDOW)
+        self.latencies: deque = deque(maxlen=WINDOW)
+        self.unhedged: deque = deque(maxlen=WINDOW)
+        self.tokens = 1.0
+        self.renders = 0
+        self.hedged = 0
+        self.backup_wins = 0
+        self.denied = 0
+        self.loser_seconds = 0.0
+
+    def threshold(self) -> float:
+        if len(self.queue_times) < HEDGE_MIN_SAMPLES:
+            return max(HEDGE_DEFAULT_DELAY, HEDGE_MIN_DELAY)
+        return max(quantile(self.queue_times, HEDGE_QUANTILE), HEDGE_MIN_DELAY)
+
+    def earn(self) -> None:
+        self.renders += 1
+        self.tokens = min(self.tokens + HEDGE_BUDGET, HEDGE_BUDGET_BURST)
+
+    def spend(self) -> bool:
+        if self.tokens < 1.0:
+            self.denied += 1
+            hedges.inc(outcome="denied")
+            return False
+        self.tokens -= 1.0
+        self.hedged += 1
+        return True
+
+    def observe(self, attempt: Attempt, finished: bool) -> None:
+        """Queue and run time of an attempt; an unstarted loser counts its wait so far"""
+        if attempt.started_at is None:
+            self.queue_times.append(time.monotonic() - attempt.created)
+            return
+        self.queue_times.append(attempt.started_at - attempt.created)
+        if finished:
+            self.run_times.append(time.monotonic() - attempt.started_at)
+
+    def typical_run(self) -> float:
+        return quantile(self.run_times, 0.5) or 0.0
+
+    def record(self, seconds: float, unhedged: float) -> None:
+        self.latencies.append(seconds)
+        self.unhedged.append(unhedged)
+        render_latency.observe(seconds, latency="actual")
+        render_latency.observe(unhedged, latency="unhedged")
+
+    def as_dict(self) -> dict:
+        p99 = quantile(self.latencies, 0.99)
+        p99_unhedged = quantile(self.unhedged, 0.99)
+        return {
+            "enabled": HEDGED_RENDERS,
+            "threshold_seconds": round(self.threshold(), 2),
+            "renders": self.renders,
+            "hedged": self.hedged,
+            "backup_wins": self.backup_wins,
+            "denied": self.denied,
+            "hedge_rate": round(self.hedged / self.renders, 3) if self.renders else None,
+            "p99_seconds": round(p99, 2) if p99 is not None else None,
+            "p99_unhedged_seconds": round(p99_unhedged, 2) if p99_unhedged is not None else None,
+            "loser_processing_seconds": round(self.loser_seconds, 1),
+        }
+
+
+policy = HedgePolicy()
+
+
+def hedge_stats() -> dict:
+    return policy.as_dict()
+
+
+async def hedged(run: Run) -> dict:
+    """
+    Run a prediction, adding a backup if it has not started processing by the
+    threshold. Returns the state of the first prediction to succeed, or the
+    primary's outcome when none does.
+    """
+    policy.earn()
+    began = time.monotonic()
+    primary = Attempt(run)
+    attempts = [primary]
+    winner = primary
+    try:
+        started = asyncio.create_task(primary.started.wait())
+        try:
+            await asyncio.wait({primary.task, started}, timeout=policy.threshold(),
+                               return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            started.cancel()
+
+        if not primary.task.done() and not primary.started.is_set() and policy.spend():
+            logger.info("Render still queued after %.1fs, starting a backup prediction", time.monotonic() - began)
+            # The backup must not reattach to the primary's prediction
+            attempts.append(Attempt(functools.partial(run, reuse=False)))
+            winner = await _first_success(attempts)
+            hedges.inc(outcome="primary" if winner is primary else "backup")
+            if winner is not primary:
+                policy.backup_wins += 1
+
+        result = await winner.task
+    except asyncio.CancelledError as err:
+        # Nobody is waiting any more: stop every prediction, the primary included
+        reason = str(err.args[0]) if err.args and err.args[0] else "cancelled"
+        _cancel_all(attempts, reason)
+        raise
+    except BaseException:
+        _cancel_all(attempts, "cancelled")
+        raise
+
+    for attempt in attempts:
+        if attempt is winner:
+            continue
+        if not attempt.task.done():
+            loser = attempt.processing_seconds()
+            policy.loser_seconds += loser
+            loser_seconds.inc(loser)
+            attempt.task.cancel("hedge_lost")
+        elif not attempt.task.cancelled():
+            attempt.task.exception()
+        policy.observe(attempt, finished=False)
+
+    policy.observe(winner, finished=winner.succeeded())
+    seconds = time.monotonic() - began
+    unhedged = seconds
+    if winner is not primary:
+        # The primary had at least this far to go
+        waited = (primary.started_at or time.monotonic()) - began
+        unhedged = max(seconds, waited + policy.typical_run())
+    policy.record(seconds, unhedged)
+    return result
+
+
+def _cancel_all(attempts: list[Attempt], reason: str) -> None:
+    """Cancel the attempts still running, when the render itself is abandoned"""
+    for attempt in attempts:
+        if not attempt.task.done():
+            attempt.task.cancel(reason)
+        elif not attempt.task.cancelled():
+            attempt.task.exception()
+
+
+async def _first_success(attempts: list[Attempt]) -> Attempt:
+    """The first attempt to succeed, or the primary when none does"""
+    pending = {attempt.task for attempt in attempts}
+    while pending:
+        _, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for attempt in attempts:
+            if attempt.succeeded():
+                return attempt
+    return attempts[0]
@@ -0,0 +1,140 @@
+"""
+Shared HTTP client for outbound Replicate calls
+
+One app-scoped httpx.AsyncClient is created on startup and closed on shutdown
+(see the lifespan hook in api.py). Reusing it keeps TLS sessions and
+keep-alive connections warm across the create / poll / upload calls of a
+visualization instead of paying a new handshake for each one.
+
+Configuration (environment):
+    HTTP_POOL_MAX_CONNECTIONS   Max open connections (default 20)
+    HTTP_POOL_MAX_KEEPALIVE     Max idle keep-alive connections (default 10)
+    HTTP_POOL_KEEPALIVE_EXPIRY  Seconds an idle connection is kept (default 30)
+    HTTP2_ENABLED               "1" to negotiate HTTP/2 when h2 is installed (default 1)
+"""
+
+import os
+import logging
+import importlib.util
+from typing import Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+HTTP_POOL_MAX_CONNECTIONS = int(os.environ.get("HTTP_POOL_MAX_CONNECTIONS", "20"))
+HTTP_POOL_MAX_KEEPALIVE = int(os.environ.get("HTTP_POOL_MAX_KEEPALIVE", "10"))
+HTTP_POOL_KEEPALIVE_EXPIRY = float(os.environ.get("HTTP_POOL_KEEPALIVE_EXPIRY", "30"))
+HTTP2_ENABLED = os.environ.get("HTTP2_ENABLED", "1") == "1"
+
+
+class InstrumentedTransport(httpx.AsyncHTTPTransport):
+    """AsyncHTTPTransport that counts in-flight requests for pool sizing"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.http2 = kwargs.get("http2", False)
+        self.requests_total = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        self.requests_total += 1
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            return await super().handle_async_request(request)
+        finally:
+            self.in_flight -= 1
+
+    def connection_counts(self) -> dict:
+        connections = list(getattr(self._pool, "connections", []))
+        idle = sum(1 for conn in connections if conn.is_idle())
+        return {"open": len(connections), "idle": idle, "active": len(connections) - idle}
+
+
+_client: Optional[httpx.AsyncClient] = None
+_transport: Optional[InstrumentedTransport] = None
+
+
+def _http2_available() -> bool:
+    if not HTTP2_ENABLED:
+        return False
+    if importlib.util.find_spec("h2") is None:
+        logger.warning("HTTP2_ENABLED but the h2 package is missing, falling back to HTTP/1.1")
+        return False
+    return True
+
+
+def create_http_client() -> httpx.AsyncClient:
+    """Build the pooled client (does not register it as the shared instance)"""
+    global _transport
+    limits = httpx.Limits(
+        max_connections=HTTP_POOL_MAX_CONNECTIONS,
+        max_keepalive_connections=HTTP_POOL_MAX_KEEPALIVE,
+        keepalive_expiry=HTTP_POOL_KEEPALIVE_EXPIRY,
+    )
+    http2 = _http2_available()
+    _transport = InstrumentedTransport(limits=limits, http2=http2)
+    return httpx.AsyncClient(
+        transport=_transport,
+        http2=http2,
+        timeout=httpx.Timeout(60.0, connect=10.0),
+    )
+
+
+async def start_http_client() -> httpx.AsyncClient:
+    """Create the shared client. Called from the FastAPI lifespan hook."""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = create_http_client()
+    return _client
+
+
+async def close_http_client() -> None:
+    """Close the shared client and release its connections"""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """
+    Return the shared client. Used as a FastAPI dependency and as the default
+    for helpers called outside a request (scripts, the prompt_generator CLI).
+    """
+    global _client
+    if _client is None or _client.is_closed:
+        _client = create_http_client()
+    return _client
+
+
+def pool_stats() -> dict:
+    """Pool usage snapshot for the /stats endpoint"""
+    stats = {
+        "max_connections": HTTP_POOL_MAX_CONNECTIONS,
+        "max_keepalive_connections": HTTP_POOL_MAX_KEEPALIVE,
+        "keepalive_expiry": HTTP_POOL_KEEPALIVE_EXPIRY,
+        "http2": False,
+        "requests_total": 0,
+        "requests_in_flight": 0,
+        "peak_requests_in_flight": 0,
+        "connections_open": 0,
+        "connections_idle": 0,
+        "connections_active": 0,
+    }
+    if _client is None or _transport is None:
+        return stats
+
+    counts = _transport.connection_counts()
+    stats.update({
+        "http2": _transport.http2,
+        "requests_total": _transport.requests_total,
+        "requests_in_flight": _transport.in_flight,
+        "peak_requests_in_flight": _transport.peak_in_flight,
+        "connections_open": counts["open"],
+        "connections_idle": counts["idle"],
+        "connections_active": counts["active"],
+    })
+    return stats
@@ -0,0 +1,458 @@
+"""
+Result image proxy - GET /images/{id}
+
+Replicate delivery URLs point at full-size JPEGs and expire after an hour,
+so a before/after slider that keeps final_url breaks later and every view
+downloads the full render. Instead:
+    - when a render finishes, its delivery URL is registered under a stable
+      id and the image is fetched once, in the background, into a
+      content-addressed store (blobs are named by their SHA-256);
+    - GET /images/{id} serves resized WebP / AVIF / JPEG variants, encoded
+      on first request and stored next to the original, with a strong ETag
+      and a year-long immutable Cache-Control so browsers and CDNs keep them.
+
+Requested widths snap to IMAGE_WIDTHS, so a CDN sees a handful of variants
+per image rather than one per viewport. Without an explicit format the
+best one the Accept header allows is chosen (Vary: Accept).
+
+Blobs go to the STORAGE_BACKEND of storage.py: files under IMAGE_STORE_DIR,
+at most IMAGE_STORE_MAX_BYTES of them with the least recently used deleted
+first, or the s3 bucket under images/ (bound it with a lifecycle rule). The id -> blob index is a TieredCache, shared
+across workers with STATE_BACKEND.
+
+Configuration (environment):
+    IMAGE_WIDTHS                Widths served, in px (default 320,640,828,1080,1600)
+    IMAGE_STORE_DIR             Directory of the local backend (default STORAGE_DIR/images)
+    IMAGE_STORE_MAX_BYTES       Bytes the local backend keeps at most (default 5 GiB)
+    IMAGE_FETCH_MAX_BYTES       Largest render fetched from Replicate (default 25 MB)
+    IMAGE_VARIANT_WEBP_QUALITY  default 80
+    IMAGE_VARIANT_AVIF_QUALITY  default 55
+    IMAGE_VARIANT_JPEG_QUALITY  default 82
+    IMAGE_WORKERS               Threads used for resizing / encoding (default 2)
+    IMAGE_INDEX_SIZE            Ids kept in the memory tier of the index (default 4096)
+    IMAGE_INDEX_TTL             Seconds an id stays resolvable (default 30 days)
+    IMAGE_PUBLIC_BASE_URL       Prefix of proxy_url in responses, e.g. a CDN (default: relative)
+"""
+
+import io
+import os
+import re
+import asyncio
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+import httpx
+
+try:
+    from PIL import Image, features
+except ImportError:  # Pillow is optional; the proxy then serves the original bytes only
+    Image = None
+
+from cache import SingleFlight, build_cache
+from http_client import get_http_client
+from storage import STORAGE_BACKEND, STORAGE_DIR, storage
+from telemetry import Counter, register
+
+logger = logging.getLogger(__name__)
+
+IMAGE_WIDTHS = sorted(int(w) for w in os.environ.get("IMAGE_WIDTHS", "320,640,828,1080,1600").split(","))
+IMAGE_STORE_DIR = os.environ.get("IMAGE_STORE_DIR", os.path.join(STORAGE_DIR, "images"))
+IMAGE_STORE_MAX_BYTES = int(os.environ.get("IMAGE_STORE_MAX_BYTES", str(5 * 1024 ** 3)))
+IMAGE_FETCH_MAX_BYTES = int(os.environ.get("IMAGE_FETCH_MAX_BYTES", str(25 * 1024 * 1024)))
+IMAGE_VARIANT_WEBP_QUALITY = int(os.environ.get("IMAGE_VARIANT_WEBP_QUALITY", "80"))
+IMAGE_VARIANT_AVIF_QUALITY = int(os.environ.get("IMAGE_VARIANT_AVIF_QUALITY", "55"))
+IMAGE_VARIANT_JPEG_QUALITY = int(os.environ.get("IMAGE_VARIANT_JPEG_QUALITY", "82"))
+IMAGE_WORKERS = int(os.environ.get("IMAGE_WORKERS", "2"))
+IMAGE_PUBLIC_BASE_URL = os.environ.get("IMAGE_PUBLIC_BASE_URL", "").rstrip("/")
+
+# Variants never change for an id, so caches may keep them for good
+CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+MEDIA_TYPES = {"avif": "image/avif", "webp": "image/webp", "jpeg": "image/jpeg"}
+
+# A full local store is evicted down to this share of IMAGE_STORE_MAX_BYTES,
+# so it is not rescanned on every write
+EVICT_TO = 0.9
+
+# Format of a response that is the stored original, unconverted
+ORIGINAL = "original"
+_ID = re.compile(r"^[0-9a-f]{32}$")
+
+_executor = ThreadPoolExecutor(max_workers=IMAGE_WORKERS, thread_name_prefix="images")
+
+image_index = build_cache("IMAGE_INDEX", default_size=4096, default_ttl=30 * 24 * 3600)
+_fetch_flight = SingleFlight()
+_variant_flight = SingleFlight()
+# Background prefetches, referenced until they finish
+_prefetches: set[asyncio.Task] = set()
+
+responses_total = register(Counter(
+    "aeon_image_responses_total",
+    "GET /images responses (stored = variant read from the store, generated = encoded now)",
+    ("result",)
+))
+bytes_served = register(Counter(
+    "aeon_image_bytes_served_total",
+    "Image bytes served by the proxy",
+    ("format",)
+))
+upstream_fetches = register(Counter(
+    "aeon_image_upstream_fetches_total",
+    "Renders fetched from their delivery URL",
+    ("outcome",)
+))
+
+
+class ImageNotFound(Exception):
+    """Unknown id, or the render could no longer be fetched"""
+
+
+class LocalImageStore:
+    """Blobs under a directory, at most max_bytes of them; the least recently used go first"""
+
+    name = "local"
+
+    def __init__(self, directory: str, max_bytes: int = IMAGE_STORE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        # Bytes stored, unknown until the first write scans the directory
+        self.used: Optional[int] = None
+        self.evicted = 0
+        self._lock = threading.Lock()
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, *name.split("/"))
+
+    def _get(self, name: str) -> Optional[bytes]:
+        path = self._path(name)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            # Reads count as use, so eviction takes the least recently used first
+            os.utime(path)
+            return data
+        except FileNotFoundError:
+            return None
+
+    def _blobs(self) -> list[tuple[float, int, str]]:
+        """(mtime, size, path) of every stored blob"""
+        blobs = []
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                if name.endswith(".part"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    info = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                blobs.append((info.st_mtime, info.st_size, path))
+        return blobs
+
+    def _evict(self, incoming: int) -> None:
+        """Delete the least recently used blobs until `incoming` more bytes fit under the low-water mark"""
+        blobs = sorted(self._blobs())
+        used = sum(size for _, size, _ in blobs)
+        target = self.max_bytes * EVICT_TO
+        for _, size, path in blobs:
+            if used + incoming <= target:
+                break
+            try:
+                os.remove(path)
+                self.evicted += 1
+            except FileNotFoundError:
+                pass
+            used -= size
+            try:
+                os.rmdir(os.path.dirname(path))
+            except OSError:
+                pass  # other variants of the image are still there
+        self.used = used
+
+    def _put(self, name: str, data: bytes) -> None:
+        path = self._path(name)
+        with self._lock:
+            if self.used is None:
+                self.used = sum(size for _, size, _ in self._blobs())
+            if self.used + len(data) > self.max_bytes:
+                self._evict(len(data))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            partial = f"{path}.{os.getpid()}.part"
+            with open(partial, "wb") as f:
+                f.write(data)
+            os.replace(partial, path)
+            self.used += len(data)
+
+    async def get(self, name: str) -> Optional[bytes]:
+        return await asyncio.to_thread(self._get, name)
+
+    async def put(self, name: str, data: bytes) -> None:
+        await asyncio.to_thread(self._put, name, data)
+
+    def stats(self) -> dict:
+        return {"store_bytes": self.used, "store_max_bytes": self.max_bytes, "evicted": self.evicted}
+
+
+class S3ImageStore:
+    name = "s3"
+    PREFIX = "images/"
+
+    def __init__(self, s3):
+        self.client = s3.client
+        self.bucket = s3.bucket
+
+    def _get(self, name: str) -> Optional[bytes]:
+        try:
+            return self.client.get_object(Bucket=self.bucket, Key=self.PREFIX + name)["Body"].read()
+        except self.client.exceptions.NoSuchKey:
+            return None
+
+    def _put(self, name: str, data: bytes) -> None:
+        self.client.put_object(Bucket=self.bucket, Key=self.PREFIX + name, Body=data)
+
+    async def get(self, name: str) -> Optional[bytes]:
+        return await asyncio.to_thread(self._get, name)
+
+    async def put(self, name: str, data: bytes) -> None:
+        await asyncio.to_thread(self._put, name, data)
+
+    def stats(self) -> dict:
+        return {}
+
+
+store = S3ImageStore(storage) if STORAGE_BACKEND == "s3" else LocalImageStore(IMAGE_STORE_DIR)
+
+
+class ImageStats:
+    def __init__(self):
+        self.registered = 0
+        self.fetched = 0
+        self.fetched_bytes = 0
+        self.fetch_failures = 0
+        self.variants_generated = 0
+        self.served = 0
+        self.served_bytes = 0
+        self.original_bytes = 0
+        self.not_modified = 0
+
+    def as_dict(self) -> dict:
+        return {
+            "store": store.name,
+            **store.stats(),
+            "registered": self.registered,
+            "fetched": self.fetched,
+            "fetched_bytes": self.fetched_bytes,
+            "fetch_failures": self.fetch_failures,
+            "variants_generated": self.variants_generated,
+            "served": self.served,
+            "served_bytes": self.served_bytes,
+            # What the same views would have cost as full-size originals
+            "original_bytes": self.original_bytes,
+            "not_modified": self.not_modified,
+            "avif_available": avif_available(),
+        }
+
+
+stats = ImageStats()
+
+
+def image_stats() -> dict:
+    return stats.as_dict()
+
+
+def avif_available() -> bool:
+    return Image is not None and features.check("avif")
+
+
+def image_id(source_url: str) -> str:
+    """Stable id of a render, derived from its delivery URL"""
+    return hashlib.sha256(source_url.encode()).hexdigest()[:32]
+
+
+def proxy_url(source_url: str) -> str:
+    return f"{IMAGE_PUBLIC_BASE_URL}/images/{image_id(source_url)}"
+
+
+async def remember(source_url: str) -> str:
+    """Register a finished render and fetch it into the store in the background"""
+    key = image_id(source_url)
+    if await image_index.peek(key) is None:
+        await image_index.set(key, {"source": source_url})
+        stats.registered += 1
+    task = asyncio.create_task(_prefetch(key))
+    _prefetches.add(task)
+    task.add_done_callback(_prefetches.discard)
+    return key
+
+
+async def _prefetch(key: str) -> None:
+    try:
+        await original(key)
+    except ImageNotFound as err:
+        logger.warning("Could not store render %s: %s", key, err)
+
+
+async def original(key: str) -> dict:
+    """Index entry of an image whose original is in the store: {source, digest, size}"""
+    if not _ID.match(key):
+        raise ImageNotFound(key)
+    entry = await image_index.get(key)
+    if entry is None:
+        raise ImageNotFound(key)
+    if entry.get("digest"):
+        return entry
+    return await _fetch_flight.do(key, lambda: _fetch(key, entry))
+
+
+async def _fetch(key: str, entry: dict) -> dict:
+    """Download the render once and store it under its content hash"""
+    try:
+        async with get_http_client().stream("GET", entry["source"], timeout=30.0) as response:
+            response.raise_for_status()
+            buffer = bytearray()
+            async for chunk in response.aiter_bytes():
+                buffer += chunk
+                if len(buffer) > IMAGE_FETCH_MAX_BYTES:
+                    raise ImageNotFound(f"render exceeds {IMAGE_FETCH_MAX_BYTES} bytes")
+    except httpx.HTTPError as err:
+        stats.fetch_failures += 1
+        upstream_fetches.inc(outcome="failed")
+        raise ImageNotFound(f"fetching {entry['source']} failed: {err}")
+
+    data = bytes(buffer)
+    digest = hashlib.sha256(data).hexdigest()
+    # Content-addressed: identical renders share one blob
+    if await store.get(f"{digest}/original") is None:
+        await store.put(f"{digest}/original", data)
+    entry = {**entry, "digest": digest, "size": len(data)}
+    await image_index.set(key, entry)
+    stats.fetched += 1
+    stats.fetched_bytes += len(data)
+    upstream_fetches.inc(outcome="stored")
+    return entry
+
+
+def snap_width(requested: Optional[int]) -> Optional[int]:
+    """Smallest configured width covering the request; None keeps the original size"""
+    if requested is None:
+        return None
+    for width in IMAGE_WIDTHS:
+        if width >= requested:
+            return width
+    return IMAGE_WIDTHS[-1]
+
+
+def negotiate_format(requested: Optional[str], accept: str) -> tuple[str, bool]:
+    """
+    (format, negotiated): an explicit ?format= wins, else the best type Accept
+    allows. Without Pillow nothing can be re-encoded, so it is always
+    ORIGINAL, served as whatever type the original is (see media_type).
+    """
+    if requested:
+        requested = "jpeg" if requested == "jpg" else requested.lower()
+        if requested not in MEDIA_TYPES or (requested == "avif" and not avif_available()):
+            raise ValueError(f"Unsupported format {requested!r}")
+    if Image is None:
+        return ORIGINAL, False
+    if requested:
+        return requested, False
+    if "image/avif" in accept and avif_available():
+        return "avif", True
+    if "image/webp" in accept:
+        return "webp", True
+    return "jpeg", True
+
+
+def media_type(fmt: str, data: bytes) -> str:
+    """Content type of a response; the original's comes from its signature"""
+    if fmt != ORIGINAL:
+        return MEDIA_TYPES[fmt]
+    if data.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    if data[4:12] in (b"ftypavif", b"ftypavis"):
+        return "image/avif"
+    if data.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    return "application/octet-stream"
+
+
+def etag(entry: dict, width: Optional[int], fmt: str) -> str:
+    return f'"{entry["digest"][:32]}-{width or "full"}-{fmt}"'
+
+
+def etag_matches(if_none_match: str, tag: str) -> bool:
+    """
+    Whether an If-None-Match header lists `tag`: "*", or any entry of the
+    comma-separated list equal to it. If-None-Match compares weakly, so a
+    W/ prefix is ignored.
+    """
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*":
+            return True
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == tag:
+            return True
+    return False
+
+
+def _encode(data: bytes, width: Optional[int], fmt: str) -> bytes:
+    with Image.open(io.BytesIO(data)) as img:
+        if img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        if width and img.width > width:
+            img = img.resize((width, round(img.height * width / img.width)), Image.LANCZOS)
+        out = io.BytesIO()
+        if fmt == "webp":
+            img.save(out, "WEBP", quality=IMAGE_VARIANT_WEBP_QUALITY, method=4)
+        elif fmt == "avif":
+            img.save(out, "AVIF", quality=IMAGE_VARIANT_AVIF_QUALITY)
+        else:
+            img.save(out, "JPEG", quality=IMAGE_VARIANT_JPEG_QUALITY, optimize=True, progressive=True)
+        return out.getvalue()
+
+
+async def variant(entry: dict, width: Optional[int], fmt: str) -> tuple[bytes, bool]:
+    """Bytes of one variant and whether it was encoded just now"""
+    digest = entry["digest"]
+    if Image is None:
+        data = await store.get(f"{digest}/original")
+        if data is None:
+            raise ImageNotFound(f"original of {digest} missing from the store")
+        return data, False
+
+    name = f"{digest}/{width or 'full'}.{fmt}"
+    data = await store.get(name)
+    if data is not None:
+        return data, False
+
+    async def generate() -> bytes:
+        source = await store.get(f"{digest}/original")
+        if source is None:
+            raise ImageNotFound(f"original of {digest} missing from the store")
+        loop = asyncio.get_running_loop()
+        encoded = await loop.run_in_executor(_executor, _encode, source, width, fmt)
+        await store.put(name, encoded)
+        stats.variants_generated += 1
+        return encoded
+
+    return await _variant_flight.do(name, generate), True
+
+
+def record_response(entry: dict, fmt: str, size: int, generated: bool) -> None:
+    stats.served += 1
+    stats.served_bytes += size
+    stats.original_bytes += entry.get("size", size)
+    responses_total.inc(result="generated" if generated else "stored")
+    bytes_served.inc(size, format=fmt)
+
+
+def record_not_modified() -> None:
+    stats.not_modified += 1
+    responses_total.inc(result="not_modified")
@@ -0,0 +1,223 @@
+"""
+Image ingestion for uploads - bounded streaming read plus server-side downscale
+
+Phone photos arrive at 5-12 MB. Starlette parses a multipart body before the
+route runs, spooling each file to a temporary file past 1 MB, so the size
+limits work at two levels:
+    - BodyLimitMiddleware answers 413 to any request whose Content-Length,
+      or streamed body, exceeds REQUEST_MAX_BYTES, so an oversized upload
+      is never spooled in full;
+    - read_upload() then reads the spooled file in chunks and rejects it
+      with 413 above UPLOAD_MAX_BYTES (or a signed upload's own limit),
+      without holding more than that in memory.
+normalize_image() then decodes, applies the EXIF orientation, downscales to
+IMAGE_MAX_EDGE and re-encodes as JPEG without EXIF in a small thread pool,
+so Replicate receives a compact image and GPS tags never leave the API.
+
+Configuration (environment):
+    UPLOAD_MAX_BYTES     Largest accepted upload (default 20 MB)
+    REQUEST_MAX_BYTES    Largest request body (default UPLOAD_MAX_BYTES + 1 MB for the form)
+    IMAGE_MAX_EDGE       Long edge after downscaling in px (default 1536)
+    IMAGE_JPEG_QUALITY   JPEG quality of the re-encoded image (default 85)
+    INGEST_WORKERS       Threads used for decode / re-encode (default 2)
+"""
+
+import os
+import io
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from fastapi import HTTPException, UploadFile
+from fastapi.responses import JSONResponse
+
+try:
+    import resource
+except ImportError:  # Unix only; the peak RSS is not reported elsewhere
+    resource = None
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow is optional; uploads are forwarded untouched without it
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_MAX_BYTES = int(os.environ.get("UPLOAD_MAX_BYTES", str(20 * 1024 * 1024)))
+REQUEST_MAX_BYTES = int(os.environ.get("REQUEST_MAX_BYTES", str(UPLOAD_MAX_BYTES + 1024 * 1024)))
+UPLOAD_CHUNK_SIZE = 256 * 1024
+IMAGE_MAX_EDGE = int(os.environ.get("IMAGE_MAX_EDGE", "1536"))
+IMAGE_JPEG_QUALITY = int(os.environ.get("IMAGE_JPEG_QUALITY", "85"))
+INGEST_WORKERS = int(os.environ.get("INGEST_WORKERS", "2"))
+
+_executor = ThreadPoolExecutor(max_workers=INGEST_WORKERS, thread_name_prefix="ingest")
+
+
+class IngestStats:
+    def __init__(self):
+        self.uploads = 0
+        self.rejected = 0
+        self.rejected_requests = 0
+        self.reencoded = 0
+        self.passthrough = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.buffered_bytes = 0
+        self.peak_buffered_bytes = 0
+
+    def as_dict(self) -> dict:
+        return {
+            "uploads": self.uploads,
+            "rejected_too_large": self.rejected,
+            "rejected_request_bodies": self.rejected_requests,
+            "reencoded": self.reencoded,
+            "passthrough": self.passthrough,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "bytes_saved": self.bytes_in - self.bytes_out,
+            "buffered_bytes": self.buffered_bytes,
+            "peak_buffered_bytes": self.peak_buffered_bytes,
+            # ru_maxrss is reported in KB on Linux
+            "process_peak_rss_bytes": (
+                resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024 if resource is not None else None
+            ),
+            "pillow_available": Image is not None,
+        }
+
+
+stats = IngestStats()
+
+
+class BodyTooLarge(HTTPException):
+    # An HTTPException, so the route's exception handling answers it with 413
+    def __init__(self, max_bytes: int):
+        super().__init__(status_code=413, detail=f"Request body exceeds {max_bytes // (1024 * 1024)} MB")
+
+
+class BodyLimitMiddleware:
+    """
+    ASGI middleware that refuses request bodies over max_bytes with 413:
+    up front from Content-Length, or as soon as a streamed body passes the
+    limit, before the form parser has spooled it all.
+    """
+
+    def __init__(self, app, max_bytes: int = REQUEST_MAX_BYTES):
+        self.app = app
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        length = dict(scope["headers"]).get(b"content-length", b"")
+        if length.isdigit() and int(length) > self.max_bytes:
+            stats.rejected_requests += 1
+            await self._reject(BodyTooLarge(self.max_bytes), scope, receive, send)
+            return
+
+        received = 0
+        started = False
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    stats.rejected_requests += 1
+                    raise BodyTooLarge(self.max_bytes)
+            return message
+
+        async def tracking_send(message):
+            nonlocal started
+            if message["type"] == "http.response.start":
+                started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, tracking_send)
+        except BodyTooLarge as err:
+            # Read outside a route, where nothing turned it into a response
+            if started:
+                raise
+            await self._reject(err, scope, receive, send)
+
+    @staticmethod
+    async def _reject(err: BodyTooLarge, scope, receive, send) -> None:
+        response = JSONResponse({"detail": err.detail}, status_code=err.status_code, headers={"Connection": "close"})
+        await response(scope, receive, send)
+
+
+async def read_upload(upload: UploadFile, max_bytes: int = UPLOAD_MAX_BYTES) -> bytes:
+    """
+    Read a parsed (already spooled) upload in chunks, failing with 413 as
+    soon as it exceeds max_bytes. BodyLimitMiddleware bounds the spool.
+    """
+    buffer = bytearray()
+    try:
+        while True:
+            chunk = await upload.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            if len(buffer) + len(chunk) > max_bytes:
+                stats.rejected += 1
+                raise HTTPException(
+                    status_code=413,
+                    detail=f"Image exceeds the {max_bytes // (1024 * 1024)} MB upload limit"
+                )
+            buffer += chunk
+            stats.buffered_bytes += len(chunk)
+            stats.peak_buffered_bytes = max(stats.peak_buffered_bytes, stats.buffered_bytes)
+        return bytes(buffer)
+    finally:
+        stats.buffered_bytes -= len(buffer)
+
+
+def _reencode(data: bytes) -> bytes:
+    with Image.open(io.BytesIO(data)) as img:
+        # Let the JPEG decoder downscale by a power of two while decoding
+        img.draft("RGB", (IMAGE_MAX_EDGE, IMAGE_MAX_EDGE))
+        icc_profile = img.info.get("icc_profile")
+        img = ImageOps.exif_transpose(img)
+        if img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        img.thumbnail((IMAGE_MAX_EDGE, IMAGE_MAX_EDGE), Image.LANCZOS)
+
+        out = io.BytesIO()
+        # No exif= argument, so EXIF (including GPS) is dropped
+        img.save(out, "JPEG", quality=IMAGE_JPEG_QUALITY, optimize=True, icc_profile=icc_profile)
+        return out.getvalue()
+
+
+async def normalize_image(data: bytes, content_type: str) -> tuple[bytes, str]:
+    """
+    Downscale and re-encode an uploaded image off the event loop.
+    Returns the original bytes when Pillow is missing or cannot decode them.
+    """
+    stats.uploads += 1
+    stats.bytes_in += len(data)
+
+    if Image is not None:
+        try:
+            loop = asyncio.get_running_loop()
+            compact = await loop.run_in_executor(_executor, _reencode, data)
+            stats.reencoded += 1
+            stats.bytes_out += len(compact)
+            return compact, "image/jpeg"
+        except (OSError, ValueError, Image.DecompressionBombError) as err:
+            logger.warning("Could not re-encode upload, forwarding original: %s", err)
+
+    stats.passthrough += 1
+    stats.bytes_out += len(data)
+    return data, content_type
+
+
+async def ingest_upload(upload: UploadFile) -> tuple[bytes, str]:
+    """Bounded read + normalize. Returns (image bytes, content type)."""
+    data = await read_upload(upload)
+    return await normalize_image(data, upload.content_type or "image/jpeg")
+
+
+def ingest_stats() -> dict:
+    return stats.as_dict()
@@ -0,0 +1,297 @@
+"""
+Bounded background job queue for long-running visualizations
+
+Jobs are accepted onto a fixed-size asyncio queue and executed by a fixed
+pool of worker tasks. When the queue is full, submit() raises QueueFullError
+and the API answers 429 instead of piling up work. Each job tracks its
+current stage so clients can poll GET /jobs/{id} or follow the SSE stream.
+
+Jobs run in the process that accepted them. With a shared STATE_BACKEND
+(see cache.py) every job's status and events are also written to the shared
+store, so GET /jobs/{id} and the event stream work from any worker; a job
+owned by another worker is followed by re-reading its record.
+
+Configuration (environment):
+    JOB_WORKERS      Concurrent jobs per process (default 4)
+    JOB_QUEUE_SIZE   Jobs allowed to wait for a worker (default 32)
+    JOB_TTL          Seconds finished jobs stay queryable (default 3600)
+"""
+
+import os
+import time
+import uuid
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Awaitable, Callable, Optional
+
+from cache import BACKEND_ERRORS, build_store
+from telemetry import current_request_id, request_id_var
+
+logger = logging.getLogger(__name__)
+
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "4"))
+JOB_QUEUE_SIZE = int(os.environ.get("JOB_QUEUE_SIZE", "32"))
+JOB_TTL = float(os.environ.get("JOB_TTL", "3600"))
+
+# Jobs kept in a shared store, and how often a job owned by another worker
+# is re-read while following its events
+JOB_STORE_SIZE = 10000
+REMOTE_POLL_INTERVAL = 0.5
+
+# Pipeline stages reported while a job runs
+JOB_STAGES = ("queued", "uploading", "analyzing", "prompting", "rendering")
+FINISHED_STATUSES = ("succeeded", "failed")
+
+StageCallback = Callable[[str], None]
+JobRunner = Callable[[StageCallback], Awaitable[dict]]
+
+
+class QueueFullError(Exception):
+    """The job queue is at capacity"""
+
+
+@dataclass
+class Job:
+    id: str
+    request_id: str = "-"
+    status: str = "queued"
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    result: Optional[dict] = None
+    error: Optional[str] = None
+    events: list = field(default_factory=list)
+    _changed: asyncio.Event = field(default_factory=asyncio.Event, repr=False)
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED_STATUSES
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.id,
+            "request_id": self.request_id,
+            "status": self.status,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "result": self.result,
+            "error": self.error,
+        }
+
+    def to_record(self) -> dict:
+        """Everything another worker needs to report and follow this job"""
+        return {**self.to_dict(), "events": self.events}
+
+    @classmethod
+    def from_record(cls, record: dict) -> "Job":
+        return cls(
+            id=record["job_id"],
+            request_id=record["request_id"],
+            status=record["status"],
+            created_at=record["created_at"],
+            started_at=record["started_at"],
+            finished_at=record["finished_at"],
+            result=record["result"],
+            error=record["error"],
+            events=record["events"],
+        )
+
+
+class JobQueue:
+    """Fixed pool of workers draining a bounded queue of visualization jobs"""
+
+    def __init__(self, workers: int = JOB_WORKERS, maxsize: int = JOB_QUEUE_SIZE, ttl: float = JOB_TTL, store=None):
+        self.workers = workers
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.store = store
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: list[asyncio.Task] = []
+        self._jobs: dict[str, Job] = {}
+        # Jobs changed since they were last written to the shared store
+        self._dirty: dict[str, Job] = {}
+        self._dirty_event = asyncio.Event()
+        self._writer: Optional[asyncio.Task] = None
+        self.running = 0
+        self.submitted = 0
+        self.rejected = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.wait_count = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    async def start(self) -> None:
+        self._queue = asyncio.Queue(maxsize=self.maxsize)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        if self.store is not None:
+            self._writer = asyncio.create_task(self._persist())
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            # With the ledger on, running predictions are left for the next start to reattach (see ledger.py)
+            task.cancel("shutdown")
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._writer is not None:
+            # Record the jobs cancelled above before the writer goes away
+            await self._flush()
+            self._writer.cancel()
+            await asyncio.gather(self._writer, return_exceptions=True)
+            self._writer = None
+
+    async def submit(self, runner: JobRunner) -> Job:
+        """
+        Queue a job. Raises QueueFullError when no slot is free.
+        Returns once the job is in the shared store, so any worker can report it.
+        """
+        if self._queue is None:
+            raise RuntimeError("JobQueue.start() has not been called")
+        self._prune()
+
+        job = Job(id=uuid.uuid4().hex, request_id=current_request_id())
+        try:
+            self._queue.put_nowait((job, runner))
+        except asyncio.QueueFull:
+            self.rejected += 1
+            raise QueueFullError(f"Job queue is full ({self.maxsize} waiting)")
+
+        self.submitted += 1
+        self._jobs[job.id] = job
+        self._publish(job, {"stage": "queued"})
+        if self.store is not None:
+            await self._flush()
+        return job
+
+    async def lookup(self, job_id: str) -> Optional[Job]:
+        """A job accepted by this worker, or a snapshot from the shared store"""
+        job = self._jobs.get(job_id)
+        if job is None and self.store is not None:
+            job = await self._load(job_id)
+        return job
+
+    async def events(self, job: Job) -> AsyncIterator[dict]:
+        """Replay a job's events so far, then follow it until it finishes"""
+        if self._jobs.get(job.id) is not job:
+            async for event in self._follow_remote(job):
+                yield event
+            return
+
+        index = 0
+        while True:
+            changed = job._changed
+            while index < len(job.events):
+                yield job.events[index]
+                index += 1
+            if job.finished:
+                return
+            await changed.wait()
+
+    async def _follow_remote(self, job: Job) -> AsyncIterator[dict]:
+        """Follow a job running in another worker by re-reading its record"""
+        index = 0
+        while True:
+            for event in job.events[index:]:
+                yield event
+            index = len(job.events)
+            if job.finished:
+                return
+            await asyncio.sleep(REMOTE_POLL_INTERVAL)
+            job = await self._load(job.id)
+            if job is None:
+                return
+
+    def set_stage(self, job: Job, stage: str) -> None:
+        job.status = stage
+        self._publish(job, {"stage": stage})
+
+    def _publish(self, job: Job, event: dict) -> None:
+        job.events.append({**event, "at": time.time()})
+        changed, job._changed = job._changed, asyncio.Event()
+        changed.set()
+        if self.store is not None:
+            self._dirty[job.id] = job
+            self._dirty_event.set()
+
+    async def _persist(self) -> None:
+        """Write changed jobs to the shared store; bursts of events coalesce into one write"""
+        while True:
+            await self._dirty_event.wait()
+            self._dirty_event.clear()
+            await self._flush()
+
+    async def _flush(self) -> None:
+        while self._dirty:
+            dirty, self._dirty = self._dirty, {}
+            for job in dirty.values():
+                try:
+                    await self.store.set(job.id, job.to_record())
+                except BACKEND_ERRORS as err:
+                    logger.warning("Saving job %s to the shared store failed: %s", job.id, err)
+
+    async def _load(self, job_id: str) -> Optional[Job]:
+        try:
+            record = await self.store.get(job_id)
+        except BACKEND_ERRORS as err:
+            logger.warning("Reading job %s from the shared store failed: %s", job_id, err)
+            return None
+        return Job.from_record(record) if record else None
+
+    def _prune(self) -> None:
+        cutoff = time.time() - self.ttl
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job.finished and job.finished_at < cutoff
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    async def _worker(self) -> None:
+        while True:
+            job, runner = await self._queue.get()
+            # Log lines written by the job carry the id of the request that queued it
+            request_id_var.set(job.request_id)
+            job.started_at = time.time()
+            waited = job.started_at - job.created_at
+            self.wait_count += 1
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+            self.running += 1
+            try:
+                job.result = await runner(lambda stage: self.set_stage(job, stage))
+                job.status = "succeeded"
+                self.succeeded += 1
+            except asyncio.CancelledError:
+                job.status = "failed"
+                job.error = "Job cancelled during shutdown"
+                raise
+            except Exception as err:
+                job.status = "failed"
+                job.error = getattr(err, "detail", None) or str(err)
+                self.failed += 1
+            finally:
+                self.running -= 1
+                job.finished_at = time.time()
+                self._publish(job, {"stage": job.status, "result": job.result, "error": job.error})
+                self._queue.task_done()
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "queue_size": self.maxsize,
+            "queue_depth": self._queue.qsize() if self._queue else 0,
+            "running": self.running,
+            "submitted": self.submitted,
+            "rejected": self.rejected,
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+            "wait_seconds_avg": self.wait_total / self.wait_count if self.wait_count else 0.0,
+            "wait_seconds_max": self.wait_max,
+            "tracked_jobs": len(self._jobs),
+            "shared_store": self.store.backend if self.store else None,
+        }
+
+
+job_queue = JobQueue(store=build_store("jobs", JOB_STORE_SIZE, JOB_TTL))
@@ -0,0 +1,153 @@
+"""
+Single-pass keyword matcher for BLIP captions
+
+The keyword table maps KitchenAnalysis fields to the words that set them.
+All keywords are compiled into one Aho-Corasick automaton (pyahocorasick),
+or, when that is not installed, one regex whose alternation is factored as a
+prefix trie, so the caption is scanned once instead of once per keyword.
+Every keyword must start at a word boundary ("arch" does not match
+"search"). A keyword is a whole word unless it ends in "*", which makes it a
+stem ("warp*" matches "warped").
+
+Table format (analysis_keywords.json):
+    {
+      "flags":   {"<field>": ["keyword", "stem*", ...], ...},
+      "choices": {"<field>": {"default": "<value>",
+                              "options": {"<value>": [...], ...}}}
+    }
+Options of a choice are listed in precedence order: when several match, the
+first listed wins.
+
+Configuration (environment):
+    ANALYSIS_KEYWORDS_PATH   Keyword table (default analysis_keywords.json
+                             next to this module)
+"""
+
+import os
+import re
+import json
+from typing import Any
+
+try:
+    import ahocorasick
+except ImportError:  # optional; the compiled regex gives the same results, somewhat slower
+    ahocorasick = None
+
+DEFAULT_KEYWORDS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "analysis_keywords.json")
+ANALYSIS_KEYWORDS_PATH = os.environ.get("ANALYSIS_KEYWORDS_PATH", DEFAULT_KEYWORDS_PATH)
+
+_STEM = "*"
+_END = ""
+
+
+def _trie_pattern(keywords: list[str]) -> str:
+    """Regex alternation for keywords, factored on shared prefixes"""
+    trie: dict = {}
+    for keyword in keywords:
+        stem = keyword.endswith(_STEM)
+        node = trie
+        for char in keyword.rstrip(_STEM):
+            node = node.setdefault(char, {})
+        # A stem may be followed by anything; a whole word needs a boundary
+        node[_END] = "" if stem or node.get(_END) == "" else r"\b"
+
+    def build(node: dict) -> str:
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char != _END]
+        if _END in node:
+            # Longer keywords first, then the keyword ending here
+            branches.append(node[_END])
+        if len(branches) == 1:
+            return branches[0]
+        return "(?:" + "|".join(branches) + ")"
+
+    return build(trie)
+
+
+class KeywordMatcher:
+    """Maps a caption to analysis fields in one pass over the text"""
+
+    def __init__(self, table: dict):
+        # A flag is a choice between False and a single True option
+        self.choices: dict[str, tuple[Any, list]] = {
+            field: (False, [True]) for field in table.get("flags", {})
+        }
+        # keyword (without "*") -> (field, value, precedence, length, whole word)
+        self._targets: dict[str, tuple[str, Any, int, int, bool]] = {}
+
+        for field, keywords in table.get("flags", {}).items():
+            self._add(field, True, 0, keywords)
+        for field, choice in table.get("choices", {}).items():
+            options = list(choice.get("options", {}))
+            self.choices[field] = (choice["default"], options)
+            for rank, value in enumerate(options):
+                self._add(field, value, rank, choice["options"][value])
+
+        if not self._targets:
+            raise ValueError("Keyword table is empty")
+        self._defaults = {field: default for field, (default, _) in self.choices.items()}
+        self._unmatched = {field: len(options) for field, (_, options) in self.choices.items()}
+
+        if ahocorasick is not None:
+            self.engine = "aho-corasick"
+            self._automaton = ahocorasick.Automaton()
+            for text, target in self._targets.items():
+                self._automaton.add_word(text, target)
+            self._automaton.make_automaton()
+        else:
+            self.engine = "regex"
+            self._regex = re.compile(r"\b" + _trie_pattern([k.lower() for k in table_keywords(table)]))
+
+    def _add(self, field: str, value: Any, rank: int, keywords: list[str]) -> None:
+        for keyword in keywords:
+            stem = keyword.endswith(_STEM)
+            text = keyword.lower().rstrip(_STEM)
+            if not text or not text[0].isalnum():
+                raise ValueError(f"Keyword {keyword!r} for {field} must start with a letter or digit")
+            existing = self._targets.get(text)
+            if existing is not None and existing[0] != field:
+                raise ValueError(f"Keyword {keyword!r} is mapped to both {existing[0]} and {field}")
+            whole = not stem and (existing is None or existing[4])
+            self._targets[text] = (field, value, rank, len(text), whole)
+
+    @classmethod
+    def from_file(cls, path: str = ANALYSIS_KEYWORDS_PATH) -> "KeywordMatcher":
+        with open(path, encoding="utf-8") as f:
+            return cls(json.load(f))
+
+    def match(self, text: str) -> dict[str, Any]:
+        """Field values found in text. Fields without a match keep their default."""
+        result = self._defaults.copy()
+        best = self._unmatched.copy()
+        # Fields that can still change; stop scanning once all are at their top option
+        pending = len(best)
+
+        text = text.lower()
+        size = len(text)
+        if self.engine == "aho-corasick":
+            hits = self._automaton.iter(text)
+        else:
+            hits = ((found.end() - 1, self._targets[found.group()]) for found in self._regex.finditer(text))
+
+        for end, (field, value, rank, length, whole) in hits:
+            # The automaton also reports matches inside words; apply the boundaries here
+            start = end - length
+            if start >= 0 and (text[start].isalnum() or text[start] == "_"):
+                continue
+            if whole and end + 1 < size and (text[end + 1].isalnum() or text[end + 1] == "_"):
+                continue
+            if rank < best[field]:
+                result[field] = value
+                best[field] = rank
+                if not rank:
+                    pending -= 1
+                    if not pending:
+                        break
+        return result
+
+
+def table_keywords(table: dict) -> list[str]:
+    """Every keyword in a table, stems keeping their trailing "*" """
+    keywords = [k for words in table.get("flags", {}).values() for k in words]
+    for choice in table.get("choices", {}).values():
+        keywords += [k for words in choice.get("options", {}).values() for k in words]
+    return keywords
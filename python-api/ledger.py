@@ -0,0 +1,211 @@
+"""
+Prediction ledger - a durable record of Replicate predictions
+
+Each prediction is appended to a SQLite log under its request key (the
+render or analysis cache key, or the hash of its inputs) with its id, model,
+every status it reaches and, once it has one, its output. Inputs are never
+stored: they can hold whole images as data URIs. Rows are never updated; a
+prediction's latest row is its state. Since the log outlives the process:
+    - on startup, predictions that were still running are reattached and
+      polled to completion in the background (see predictions.py);
+    - a request whose key has a succeeded prediction gets that result with
+      no new prediction, and one whose prediction is still running waits for
+      it instead of starting another.
+Entries older than PREDICTION_LEDGER_TTL are ignored and pruned: Replicate
+keeps API predictions and their output files for about an hour.
+
+The ledger is off unless PREDICTION_LEDGER_DB names its file, preferably an
+absolute path on a volume that survives restarts and is shared by the
+workers of one deployment.
+
+Configuration (environment):
+    PREDICTION_LEDGER_DB    SQLite file, e.g. /var/lib/aeon/ledger.db (default empty: disabled)
+    PREDICTION_LEDGER_TTL   Seconds a prediction can be reused or reattached (default 3000)
+"""
+
+import os
+import json
+import time
+import asyncio
+import hashlib
+import logging
+import sqlite3
+from dataclasses import dataclass, replace
+from typing import Optional
+
+from telemetry import Counter, register
+
+logger = logging.getLogger(__name__)
+
+PREDICTION_LEDGER_DB = os.environ.get("PREDICTION_LEDGER_DB", "")
+PREDICTION_LEDGER_TTL = float(os.environ.get("PREDICTION_LEDGER_TTL", "3000"))
+
+# Rows older than the TTL are deleted every this many appends
+PRUNE_EVERY = 200
+
+RUNNING_STATUSES = ("starting", "processing")
+
+ledger_lookups = register(Counter(
+    "aeon_ledger_lookups_total",
+    "Prediction ledger lookups by outcome (completed = result reused, reattached = waited on a running prediction)",
+    ("model", "outcome")
+))
+
+
+def inputs_hash(body: dict) -> str:
+    """Hash of a prediction request body (model / version and input)"""
+    return hashlib.sha256(json.dumps(body, sort_keys=True, separators=(",", ":")).encode()).hexdigest()
+
+
+@dataclass(frozen=True)
+class Entry:
+    key: str
+    model: str
+    prediction: dict
+    created_at: float
+
+    @property
+    def status(self) -> Optional[str]:
+        return self.prediction.get("status")
+
+    def at(self, prediction: dict) -> "Entry":
+        """The same prediction in a later state"""
+        return replace(self, prediction=prediction)
+
+
+class PredictionLedger:
+    """Append-only SQLite log of predictions. Blocking calls run in a worker thread."""
+
+    def __init__(self, path: str, ttl: float):
+        self.path = path or None
+        self.ttl = ttl
+        self._appends = 0
+        self._pending: set[asyncio.Task] = set()
+        self.recorded = 0
+        self.reused = 0
+        self.reattached = 0
+        self.errors = 0
+        if self.path:
+            conn = self._connect()
+            try:
+                # WAL lets other workers read during a write
+                conn.execute("PRAGMA journal_mode=WAL")
+                columns = {row[1] for row in conn.execute("PRAGMA table_info(predictions)")}
+                if "prediction" in columns:
+                    # Written by an earlier version, with whole predictions (inputs included)
+                    logger.warning("Dropping the old prediction ledger table in %s", self.path)
+                    conn.execute("DROP TABLE predictions")
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS predictions ("
+                    "seq INTEGER PRIMARY KEY AUTOINCREMENT, key TEXT NOT NULL, prediction_id TEXT NOT NULL, "
+                    "model TEXT NOT NULL, status TEXT NOT NULL, output TEXT, "
+                    "created_at REAL NOT NULL, recorded_at REAL NOT NULL)"
+                )
+                conn.execute("CREATE INDEX IF NOT EXISTS predictions_key ON predictions(key, created_at)")
+                conn.execute("CREATE INDEX IF NOT EXISTS predictions_id ON predictions(prediction_id, seq)")
+                conn.commit()
+            finally:
+                conn.close()
+            logger.info("Prediction ledger at %s", os.path.abspath(self.path))
+
+    @property
+    def enabled(self) -> bool:
+        return self.path is not None
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=5.0)
+
+    def _latest(self, where: str, params: tuple) -> list[Entry]:
+        """Latest row of each fresh prediction matching `where`, newest first"""
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                "SELECT key, model, prediction_id, status, output, created_at FROM predictions p "
+                f"WHERE {where} AND created_at >= ? AND seq = "
+                "(SELECT MAX(seq) FROM predictions WHERE prediction_id = p.prediction_id) "
+                "ORDER BY seq DESC",
+                (*params, time.time() - self.ttl)
+            ).fetchall()
+        finally:
+            conn.close()
+        return [
+            Entry(key, model, {"id": prediction_id, "status": status, "output": json.loads(output)}, created_at)
+            for key, model, prediction_id, status, output, created_at in rows
+        ]
+
+    def _append(self, entry: Entry) -> None:
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute(
+                    "INSERT INTO predictions (key, prediction_id, model, status, output, created_at, recorded_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (entry.key, entry.prediction["id"], entry.model, entry.status or "unknown",
+                     json.dumps(entry.prediction.get("output")), entry.created_at, time.time())
+                )
+                self._appends += 1
+                if self._appends % PRUNE_EVERY == 0:
+                    conn.execute("DELETE FROM predictions WHERE created_at < ?", (time.time() - self.ttl,))
+        finally:
+            conn.close()
+
+    async def find(self, key: str) -> Optional[Entry]:
+        """The newest succeeded prediction for key, else the newest still running"""
+        if not self.enabled:
+            return None
+        try:
+            entries = await asyncio.to_thread(self._latest, "key = ?", (key,))
+        except sqlite3.Error as err:
+            self.errors += 1
+            logger.warning("Prediction ledger read failed: %s", err)
+            return None
+        for status in ("succeeded", *RUNNING_STATUSES):
+            for entry in entries:
+                if entry.status == status:
+                    return entry
+        return None
+
+    async def unfinished(self) -> list[Entry]:
+        """Fresh predictions whose last recorded status is still running"""
+        if not self.enabled:
+            return []
+        try:
+            return await asyncio.to_thread(self._latest, "status IN (?, ?)", RUNNING_STATUSES)
+        except sqlite3.Error as err:
+            self.errors += 1
+            logger.warning("Prediction ledger read failed: %s", err)
+            return []
+
+    async def record(self, entry: Entry) -> None:
+        if not self.enabled:
+            return
+        try:
+            await asyncio.to_thread(self._append, entry)
+            self.recorded += 1
+        except sqlite3.Error as err:
+            self.errors += 1
+            logger.warning("Prediction ledger write for %s failed: %s", entry.prediction.get("id"), err)
+
+    def record_soon(self, entry: Entry) -> None:
+        """record() without waiting, for callers that are being cancelled"""
+        if not self.enabled:
+            return
+        task = asyncio.create_task(self.record(entry))
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "recorded": self.recorded,
+            "reused": self.reused,
+            "reattached": self.reattached,
+            "errors": self.errors,
+        }
+
+
+ledger = PredictionLedger(PREDICTION_LEDGER_DB, PREDICTION_LEDGER_TTL)
+
+
+def ledger_stats() -> dict:
+    return ledger.stats()
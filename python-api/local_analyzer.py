@@ -0,0 +1,320 @@
+"""
+Local pre-analysis - estimate easy KitchenAnalysis fields without BLIP-2
+
+Three fields can be read off the pixels in milliseconds:
+    - lighting: colour balance of the highlights (the brightest unclipped
+      pixels mostly reflect the light source, not the cabinet colour)
+    - is_angled_photo: share of near-horizontal edges that are skewed; the
+      horizontals of a straight-on photo of cabinets are parallel, those of
+      an angled one converge (measured against the image's own rotation,
+      so a tilted camera is not mistaken for an angle)
+    - warped_perspective: share of near-vertical edges that lean a few
+      degrees off vertical (keystoning or a tilted camera)
+Both geometry fields are only trusted when a good share of the edges line
+up with the image's verticals; photos without clear lines go to BLIP-2.
+
+Each field gets a confidence in [0.5, 1] that grows with the distance of its
+statistic from the decision threshold. analyze_kitchen_image() only skips
+BLIP-2 when every field clears LOCAL_ANALYSIS_MIN_CONFIDENCE; the remaining
+fields (drawers, arches, cleanup, description) then take their defaults.
+Decoding and the statistics run in a small thread pool, off the event loop.
+
+Configuration (environment):
+    LOCAL_ANALYSIS                 "1" to try the local estimate before BLIP-2 (default 0)
+    LOCAL_ANALYSIS_MIN_CONFIDENCE  Confidence every field needs to skip BLIP-2 (default 0.8)
+    LOCAL_ANALYSIS_WORKERS         Threads used for the estimate (default 2)
+"""
+
+import io
+import os
+import time
+import base64
+import asyncio
+import binascii
+import logging
+import ipaddress
+from dataclasses import dataclass, field
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+from urllib.parse import urlsplit
+
+import httpx
+
+try:
+    import numpy as np
+    from PIL import Image, ImageOps
+except ImportError:  # NumPy and Pillow are optional; every image then goes to BLIP-2
+    np = None
+
+from ingest import UPLOAD_MAX_BYTES
+from telemetry import Counter, register
+
+logger = logging.getLogger(__name__)
+
+LOCAL_ANALYSIS = os.environ.get("LOCAL_ANALYSIS", "0") == "1"
+LOCAL_ANALYSIS_MIN_CONFIDENCE = float(os.environ.get("LOCAL_ANALYSIS_MIN_CONFIDENCE", "0.8"))
+LOCAL_ANALYSIS_WORKERS = int(os.environ.get("LOCAL_ANALYSIS_WORKERS", "2"))
+
+# Long edge the image is reduced to before measuring; the JPEG decoder does
+# most of the reduction for free
+ANALYSIS_EDGE = 384
+
+# Highlights: the brightest 25% of pixels, ignoring clipped ones
+HIGHLIGHT_QUANTILE = 0.75
+CLIPPED = 0.98
+
+# Lighting from the highlights' (R - B) / (R + B): warm above, cool below
+WARM_THRESHOLD = 0.10
+COOL_THRESHOLD = -0.03
+
+# Edges: pixels in the top 10% of gradient magnitude
+EDGE_QUANTILE = 0.90
+MIN_EDGE_MAGNITUDE = 0.15
+
+# Angled photo: share of near-horizontal edges skewed SKEW_DEGREES or more
+SKEW_DEGREES = 3.0
+ANGLED_THRESHOLD = 0.15
+# Warped perspective: share of near-vertical edges leaning TILT_DEGREES or more
+TILT_DEGREES = 2.0
+WARPED_THRESHOLD = 0.40
+# Below this share of edge weight along the (rotated) vertical the photo has
+# no clear lines - clutter, noise, a close-up - and angle / warp are left to BLIP-2
+MIN_STRUCTURE = 0.20
+
+# Distance from a threshold at which a field reaches full confidence
+CONFIDENCE_SCALE = {"lighting": 0.06, "is_angled_photo": 0.10, "warped_perspective": 0.20}
+
+# Longest we spend fetching a URL-only image for the local estimate
+FETCH_TIMEOUT = 5.0
+
+_executor = ThreadPoolExecutor(max_workers=LOCAL_ANALYSIS_WORKERS, thread_name_prefix="local-analysis")
+
+local_analyses = register(Counter(
+    "aeon_local_analysis_total",
+    "Local pre-analyses by outcome (confident = BLIP-2 skipped, escalated = sent to BLIP-2)",
+    ("outcome",)
+))
+
+
+@dataclass
+class LocalEstimate:
+    fields: dict
+    confidence: dict
+    statistics: dict = field(default_factory=dict)
+    elapsed_ms: float = 0.0
+
+    def confident(self, threshold: float = LOCAL_ANALYSIS_MIN_CONFIDENCE) -> bool:
+        return all(value >= threshold for value in self.confidence.values())
+
+
+def available() -> bool:
+    return np is not None
+
+
+def _confidence(value: float, threshold: float, scale: float) -> float:
+    return round(min(1.0, 0.5 + 0.5 * abs(value - threshold) / scale), 3)
+
+
+def _load(data: bytes) -> "np.ndarray":
+    with Image.open(io.BytesIO(data)) as img:
+        img.draft("RGB", (ANALYSIS_EDGE, ANALYSIS_EDGE))
+        img = ImageOps.exif_transpose(img)
+        if img.mode != "RGB":
+            img = img.convert("RGB")
+        img.thumbnail((ANALYSIS_EDGE, ANALYSIS_EDGE))
+        return np.asarray(img, dtype=np.float32) / 255.0
+
+
+def _lighting(rgb: "np.ndarray") -> tuple[str, float, float]:
+    luminance = rgb @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+    cutoff = np.quantile(luminance, HIGHLIGHT_QUANTILE)
+    mask = (luminance >= cutoff) & (rgb.max(axis=2) < CLIPPED)
+    if not mask.any():
+        mask = luminance >= cutoff
+    red, blue = rgb[..., 0][mask].mean(), rgb[..., 2][mask].mean()
+    balance = float((red - blue) / (red + blue + 1e-6))
+
+    scale = CONFIDENCE_SCALE["lighting"]
+    if balance > WARM_THRESHOLD:
+        return "warm", _confidence(balance, WARM_THRESHOLD, scale), balance
+    if balance < COOL_THRESHOLD:
+        return "cool", _confidence(balance, COOL_THRESHOLD, scale), balance
+    # Neutral is confident in the middle of its band
+    margin = min(balance - COOL_THRESHOLD, WARM_THRESHOLD - balance)
+    return "neutral", round(min(1.0, 0.5 + margin / scale), 3), balance
+
+
+def _edge_angles(rgb: "np.ndarray") -> tuple["np.ndarray", "np.ndarray"]:
+    """Signed line direction in degrees (-90, 90], 0 = horizontal, and weight, of the strongest edges"""
+    gray = rgb @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+    if min(gray.shape) < 3:
+        # Too small for a 3x3 kernel: no edges
+        empty = np.empty(0, dtype=np.float32)
+        return empty, empty
+    # Sobel operators via slicing
+    gx = (gray[:-2, 2:] + 2 * gray[1:-1, 2:] + gray[2:, 2:]) - (gray[:-2, :-2] + 2 * gray[1:-1, :-2] + gray[2:, :-2])
+    gy = (gray[2:, :-2] + 2 * gray[2:, 1:-1] + gray[2:, 2:]) - (gray[:-2, :-2] + 2 * gray[:-2, 1:-1] + gray[:-2, 2:])
+    magnitude = np.hypot(gx, gy)
+    cutoff = max(float(np.quantile(magnitude, EDGE_QUANTILE)), MIN_EDGE_MAGNITUDE)
+    strong = magnitude >= cutoff
+    # The edge runs perpendicular to its gradient
+    direction = np.degrees(np.arctan2(gy[strong], gx[strong])) + 90.0
+    return (direction + 90.0) % 180.0 - 90.0, magnitude[strong]
+
+
+def _weighted_median(values: "np.ndarray", weights: "np.ndarray") -> float:
+    order = np.argsort(values)
+    cumulative = np.cumsum(weights[order])
+    return float(values[order][np.searchsorted(cumulative, cumulative[-1] / 2)])
+
+
+def _geometry(rgb: "np.ndarray") -> dict:
+    """
+    skew_share: share of near-horizontal edge weight more than SKEW_DEGREES
+        off the image's own rotation (converging lines of an angled shot)
+    tilted_share: share of near-vertical edge weight leaning TILT_DEGREES or more
+    structure: share of all edge weight within 5 degrees of the rotated vertical
+    """
+    angle, weight = _edge_angles(rgb)
+    # Signed lean from vertical, folded into (-90, 90]
+    lean = np.where(angle > 0, angle - 90.0, angle + 90.0)
+    near_vertical = np.abs(lean) < 15
+    near_horizontal = np.abs(angle) < 30
+    vertical_weight = float(weight[near_vertical].sum())
+    horizontal_weight = float(weight[near_horizontal].sum())
+    if vertical_weight == 0 or horizontal_weight == 0:
+        # Nothing to judge by: report the thresholds, i.e. no confidence
+        return {"skew_share": ANGLED_THRESHOLD, "tilted_share": WARPED_THRESHOLD, "rotation": 0.0, "structure": 0.0}
+
+    # A tilted camera rotates horizontals and verticals alike; measure the
+    # horizontals against that rotation so tilt is not mistaken for angle
+    rotation = _weighted_median(lean[near_vertical], weight[near_vertical])
+    skewed = near_horizontal & (np.abs(angle - rotation) > SKEW_DEGREES)
+    tilted = near_vertical & (np.abs(lean) >= TILT_DEGREES)
+    aligned = np.abs(lean - rotation) < 5
+    return {
+        "skew_share": float(weight[skewed].sum()) / horizontal_weight,
+        "tilted_share": float(weight[tilted].sum()) / vertical_weight,
+        "rotation": rotation,
+        "structure": float(weight[aligned].sum() / weight.sum()),
+    }
+
+
+def estimate(data: bytes) -> LocalEstimate:
+    """Estimate lighting / angle / warp from encoded image bytes (blocking)"""
+    start = time.perf_counter()
+    rgb = _load(data)
+    lighting, lighting_confidence, balance = _lighting(rgb)
+    geometry = _geometry(rgb)
+    skew, tilted = geometry["skew_share"], geometry["tilted_share"]
+    confidence = {
+        "lighting": lighting_confidence,
+        "is_angled_photo": _confidence(skew, ANGLED_THRESHOLD, CONFIDENCE_SCALE["is_angled_photo"]),
+        "warped_perspective": _confidence(tilted, WARPED_THRESHOLD, CONFIDENCE_SCALE["warped_perspective"]),
+    }
+    if geometry["structure"] < MIN_STRUCTURE:
+        confidence["is_angled_photo"] = confidence["warped_perspective"] = 0.5
+    return LocalEstimate(
+        fields={
+            "lighting": lighting,
+            "is_angled_photo": skew > ANGLED_THRESHOLD,
+            "warped_perspective": tilted > WARPED_THRESHOLD,
+        },
+        confidence=confidence,
+        statistics={
+            "highlight_balance": round(balance, 4),
+            "skew_share": round(skew, 4),
+            "tilted_share": round(tilted, 4),
+            "rotation_degrees": round(geometry["rotation"], 2),
+            "structure": round(geometry["structure"], 4),
+        },
+        elapsed_ms=(time.perf_counter() - start) * 1000,
+    )
+
+
+async def _public_https(image_url: str) -> bool:
+    """
+    Whether a client-supplied URL is https on a host that only resolves to
+    public addresses, so the estimate cannot be aimed at internal services
+    or the cloud metadata endpoint
+    """
+    parts = urlsplit(image_url)
+    if parts.scheme != "https" or not parts.hostname:
+        return False
+    try:
+        infos = await asyncio.get_running_loop().getaddrinfo(parts.hostname, parts.port or 443)
+    except (OSError, UnicodeError):
+        return False
+    for *_, sockaddr in infos:
+        try:
+            address = ipaddress.ip_address(sockaddr[0].split("%", 1)[0])
+        except ValueError:
+            return False
+        if not address.is_global:
+            return False
+    return bool(infos)
+
+
+async def fetch_image(image_url: str, client: httpx.AsyncClient) -> Optional[bytes]:
+    """Bytes of a data URI or a small enough https image on a public host, or None"""
+    if image_url.startswith("data:"):
+        header, _, payload = image_url.partition(",")
+        if not header.endswith(";base64"):
+            return None
+        try:
+            return base64.b64decode(payload, validate=True)
+        except (binascii.Error, ValueError):
+            return None
+
+    if not await _public_https(image_url):
+        logger.debug("Not fetching %s for local analysis: not https on a public host", image_url)
+        return None
+    try:
+        # No redirects: the target was only checked for this URL
+        async with client.stream("GET", image_url, timeout=FETCH_TIMEOUT, follow_redirects=False) as response:
+            if response.status_code != 200:
+                return None
+            buffer = bytearray()
+            async for chunk in response.aiter_bytes():
+                buffer += chunk
+                if len(buffer) > UPLOAD_MAX_BYTES:
+                    return None
+            return bytes(buffer)
+    except httpx.HTTPError as err:
+        logger.debug("Could not fetch %s for local analysis: %s", image_url, err)
+        return None
+
+
+async def estimate_kitchen_image(
+    image_url: str,
+    client: httpx.AsyncClient,
+    image_bytes: Optional[bytes] = None
+) -> Optional[LocalEstimate]:
+    """
+    Local estimate for an image, fetching it when only the URL is known.
+    Returns None when NumPy / Pillow are missing, the image cannot be read
+    or the estimate fails, so the caller escalates to BLIP-2.
+    """
+    if not available():
+        local_analyses.inc(outcome="unavailable")
+        return None
+    data = image_bytes if image_bytes is not None else await fetch_image(image_url, client)
+    if data is None:
+        local_analyses.inc(outcome="unavailable")
+        return None
+
+    try:
+        loop = asyncio.get_running_loop()
+        result = await loop.run_in_executor(_executor, estimate, data)
+    except (OSError, ValueError, Image.DecompressionBombError) as err:
+        logger.warning("Local analysis could not decode the image: %s", err)
+        local_analyses.inc(outcome="unavailable")
+        return None
+    except Exception:
+        # The estimate only ever saves a BLIP-2 call; a bug in it must not fail the request
+        logger.exception("Local analysis failed, escalating to BLIP-2")
+        local_analyses.inc(outcome="unavailable")
+        return None
+
+    local_analyses.inc(outcome="confident" if result.confident() else "escalated")
+    return result
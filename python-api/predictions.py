@@ -0,0 +1,727 @@
+"""
+Replicate prediction lifecycle - create, then wait for completion
+
+Completion is delivered two ways:
+    - Webhook: when REPLICATE_WEBHOOK_URL and REPLICATE_WEBHOOK_SECRET are
+      set, predictions are created with that webhook and POST
+      /webhooks/replicate resolves the waiting future through the in-process
+      registry below. Deliveries must carry a valid signature; without a
+      secret webhook mode stays off and every delivery is rejected.
+    - Polling: GET /predictions/{id} with exponential backoff and jitter.
+      Always active as the fallback; in webhook mode it starts at a much
+      longer interval so it only matters when a delivery is lost.
+
+With several worker processes a delivery can land on a worker that is not
+waiting for it. When STATE_BACKEND is shared (see cache.py) such deliveries
+are relayed through the shared store, where the waiting worker picks them up.
+
+Configuration (environment):
+    REPLICATE_API_BASE          API root (default https://api.replicate.com/v1)
+    REPLICATE_WEBHOOK_URL       Public URL of /webhooks/replicate (enables webhook mode)
+    REPLICATE_WEBHOOK_SECRET    Signing secret (whsec_...) used to verify deliveries (required for webhook mode)
+    REPLICATE_MAX_429_RETRIES   Creations retried after a 429 (default 3)
+    REPLICATE_MAX_RETRY_AFTER   Longest Retry-After honored before giving up (default 30)
+
+Creation goes through the shared outbound governor (see governor.py) and
+the retry policy / circuit breakers in resilience.py.
+
+A run_prediction() cancelled after its prediction was created (e.g. a
+speculative render that turned out wrong, or a client that disconnected)
+cancels the prediction on Replicate in the background, so it stops running
+and billing. The message passed to Task.cancel() becomes the reason label of
+aeon_predictions_canceled_total. A prediction still running when its wait
+runs out (its timeout, or the request deadline) is cancelled the same way.
+Each cancel is credited with the prediction time it saved: the model's
+typical creation-to-completion time less the time already spent.
+
+While a streaming request listens (see progress.py), status changes and new
+log lines of its predictions are reported as they are seen, and webhook mode
+polls at the normal schedule so progress arrives between deliveries.
+
+Every prediction is recorded in the prediction ledger (see ledger.py) under
+the caller's key, or the hash of its inputs. run_prediction() first looks
+the key up: a succeeded prediction is returned as is, and one still running
+is waited on instead of creating another. Predictions that were running
+when the process stopped are reattached by resume_unfinished() at startup;
+a run_prediction() cancelled with the reason "shutdown" leaves its
+prediction running on Replicate for that.
+"""
+
+import os
+import hmac
+import time
+import base64
+import random
+import asyncio
+import contextvars
+import hashlib
+import logging
+from collections import OrderedDict
+from email.utils import parsedate_to_datetime
+from typing import Callable, Optional
+
+import httpx
+
+from cache import BACKEND_ERRORS, build_store
+from governor import governor, GovernorTimeout
+from ledger import Entry, inputs_hash, ledger, ledger_lookups, ledger_stats
+from progress import listening, log_progress, report
+from resilience import breaker, create_retry_policy, remaining, retries_total
+from telemetry import Counter, Histogram, register, span, observe_prediction
+from timings import record_stage
+
+logger = logging.getLogger(__name__)
+
+REPLICATE_API_BASE = os.environ.get("REPLICATE_API_BASE", "https://api.replicate.com/v1").rstrip("/")
+REPLICATE_WEBHOOK_URL = os.environ.get("REPLICATE_WEBHOOK_URL", "")
+REPLICATE_WEBHOOK_SECRET = os.environ.get("REPLICATE_WEBHOOK_SECRET", "")
+
+# Polling schedule: first check after POLL_INITIAL_DELAY, growing by
+# POLL_BACKOFF_FACTOR up to POLL_MAX_DELAY. Webhook mode starts at
+# WEBHOOK_FALLBACK_DELAY instead.
+POLL_INITIAL_DELAY = 0.5
+POLL_BACKOFF_FACTOR = 1.5
+POLL_MAX_DELAY = 5.0
+WEBHOOK_FALLBACK_DELAY = 15.0
+
+# 429 handling: retries honor Retry-After (or back off when it is missing)
+REPLICATE_MAX_429_RETRIES = int(os.environ.get("REPLICATE_MAX_429_RETRIES", "3"))
+REPLICATE_MAX_RETRY_AFTER = float(os.environ.get("REPLICATE_MAX_RETRY_AFTER", "30"))
+
+# Deliveries older than this are rejected as replays
+WEBHOOK_TOLERANCE_SECONDS = 300
+
+# How often a worker checks the shared relay for a delivery another worker received
+RELAY_POLL_INTERVAL = 1.0
+
+predictions_canceled = register(Counter(
+    "aeon_predictions_canceled_total",
+    "Predictions cancelled on Replicate after the caller gave up on them",
+    ("model", "reason")
+))
+
+cancel_saved_seconds = register(Histogram(
+    "aeon_prediction_cancel_saved_seconds",
+    "Estimated prediction time saved by a cancel: the model's typical duration less the time already spent",
+    ("model",)
+))
+
+# Background cancel requests, referenced until they finish
+_cancellations: set[asyncio.Task] = set()
+
+# Ledger predictions being followed to completion, by prediction id
+_reattached: dict[str, asyncio.Task] = {}
+
+# Cancel reason that leaves the prediction running for the next process
+SHUTDOWN = "shutdown"
+
+TERMINAL_STATUSES = ("succeeded", "failed", "canceled")
+
+
+class ReplicateError(Exception):
+    """Replicate rejected or failed a prediction"""
+
+    def __init__(self, message: str, status_code: Optional[int] = None, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class RateLimitedError(ReplicateError):
+    """Replicate kept answering 429, or the governor queue was full for too long"""
+
+
+class PredictionRegistry:
+    """
+    Futures for predictions awaiting a webhook, keyed by prediction id.
+
+    A delivery can beat the create response back to us, so completions for
+    ids nobody is waiting on yet are parked in a small bounded buffer and
+    handed over on register(). With a shared relay store, they are also
+    written there for whichever worker is waiting.
+    """
+
+    def __init__(self, max_early: int = 256, relay=None):
+        self._waiters: dict[str, asyncio.Future] = {}
+        self._early: OrderedDict[str, dict] = OrderedDict()
+        self._max_early = max_early
+        self.relay = relay
+        self.deliveries = 0
+        self.unmatched = 0
+        self.relayed = 0
+
+    def register(self, prediction_id: str) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        early = self._early.pop(prediction_id, None)
+        if early is not None:
+            future.set_result(early)
+        else:
+            self._waiters[prediction_id] = future
+        return future
+
+    def discard(self, prediction_id: str) -> None:
+        self._waiters.pop(prediction_id, None)
+
+    def resolve(self, prediction: dict) -> bool:
+        """Hand a webhook payload to its waiter. Returns False if nobody was waiting."""
+        self.deliveries += 1
+        prediction_id = prediction.get("id")
+        if not prediction_id or prediction.get("status") not in TERMINAL_STATUSES:
+            return False
+
+        future = self._waiters.pop(prediction_id, None)
+        if future is None:
+            self.unmatched += 1
+            self._early[prediction_id] = prediction
+            while len(self._early) > self._max_early:
+                self._early.popitem(last=False)
+            return False
+        if not future.done():
+            future.set_result(prediction)
+        return True
+
+    async def deliver(self, prediction: dict) -> bool:
+        """resolve(), relaying a completion nobody here is waiting on to the other workers"""
+        matched = self.resolve(prediction)
+        if not matched and self.relay is not None and prediction.get("id") in self._early:
+            try:
+                await self.relay.set(prediction["id"], prediction)
+                self.relayed += 1
+            except BACKEND_ERRORS as err:
+                logger.warning("Relaying webhook for %s failed: %s", prediction["id"], err)
+        return matched
+
+    async def watch_relay(self, prediction_id: str, future: asyncio.Future) -> None:
+        """Resolve `future` with a delivery another worker relayed for this prediction"""
+        while not future.done():
+            await asyncio.sleep(RELAY_POLL_INTERVAL)
+            try:
+                prediction = await self.relay.get(prediction_id)
+            except BACKEND_ERRORS:
+                continue
+            if prediction is not None and not future.done():
+                future.set_result(prediction)
+
+    def stats(self) -> dict:
+        return {
+            "waiting": len(self._waiters),
+            "deliveries": self.deliveries,
+            "unmatched": self.unmatched,
+            "relayed": self.relayed,
+        }
+
+
+registry = PredictionRegistry(relay=build_store("webhook_deliveries", 1024, WEBHOOK_TOLERANCE_SECONDS))
+
+
+if REPLICATE_WEBHOOK_URL and not REPLICATE_WEBHOOK_SECRET:
+    logger.warning("REPLICATE_WEBHOOK_URL is set without REPLICATE_WEBHOOK_SECRET; polling instead of webhooks")
+
+
+def webhook_enabled() -> bool:
+    # Unverifiable deliveries are never accepted, so a secret is required
+    return bool(REPLICATE_WEBHOOK_URL and REPLICATE_WEBHOOK_SECRET)
+
+
+def verify_webhook_signature(headers, body: bytes) -> bool:
+    """
+    Check Replicate's webhook-id / webhook-timestamp / webhook-signature headers.
+    Always fails when no REPLICATE_WEBHOOK_SECRET is configured.
+    """
+    if not REPLICATE_WEBHOOK_SECRET:
+        return False
+
+    webhook_id = headers.get("webhook-id")
+    timestamp = headers.get("webhook-timestamp")
+    signatures = headers.get("webhook-signature")
+    if not (webhook_id and timestamp and signatures):
+        return False
+
+    try:
+        if abs(time.time() - int(timestamp)) > WEBHOOK_TOLERANCE_SECONDS:
+            return False
+        key = base64.b64decode(REPLICATE_WEBHOOK_SECRET.split("_", 1)[-1])
+    except ValueError:
+        return False
+
+    signed = f"{webhook_id}.{timestamp}.".encode() + body
+    expected = base64.b64encode(hmac.new(key, signed, hashlib.sha256).digest()).decode()
+    for candidate in signatures.split():
+        _, _, signature = candidate.partition(",")
+        if hmac.compare_digest(signature, expected):
+            return True
+    return False
+
+
+def _auth_headers(replicate_token: str) -> dict:
+    return {"Authorization": f"Bearer {replicate_token}"}
+
+
+def _backoff_delay(attempt: int, initial: float) -> float:
+    """Exponential backoff with equal jitter (the webhook-mode safety poll stays flat)"""
+    cap = max(initial, POLL_MAX_DELAY)
+    delay = min(cap, initial * POLL_BACKOFF_FACTOR ** attempt)
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+async def create_prediction(client: httpx.AsyncClient, body: dict, replicate_token: str) -> dict:
+    """POST /predictions, adding the webhook when webhook mode is on"""
+    if webhook_enabled():
+        body = {**body, "webhook": REPLICATE_WEBHOOK_URL, "webhook_events_filter": ["completed"]}
+
+    response = await client.post(
+        f"{REPLICATE_API_BASE}/predictions",
+        headers={**_auth_headers(replicate_token), "Content-Type": "application/json"},
+        json=body,
+        timeout=60.0
+    )
+    if response.status_code not in (200, 201):
+        raise ReplicateError(
+            f"{response.status_code} - {response.text}",
+            response.status_code,
+            retry_after=parse_retry_after(response.headers.get("retry-after"))
+        )
+    return response.json()
+
+
+class CancelStats:
+    """Cancelled predictions and the prediction time they saved"""
+
+    # Weight of the latest prediction in a model's typical duration
+    SMOOTHING = 0.2
+
+    def __init__(self):
+        self.typical: dict[str, float] = {}
+        self.reasons: dict[str, int] = {}
+        self.saved_seconds = 0.0
+
+    def finished(self, model: str, seconds: float) -> None:
+        """A prediction of model succeeded `seconds` after it was created"""
+        typical = self.typical.get(model)
+        self.typical[model] = seconds if typical is None else typical + self.SMOOTHING * (seconds - typical)
+
+    def canceled(self, model: str, reason: str, elapsed: Optional[float]) -> Optional[float]:
+        """Record a cancel; returns the estimated seconds saved, when known"""
+        predictions_canceled.inc(model=model, reason=reason)
+        self.reasons[reason] = self.reasons.get(reason, 0) + 1
+        typical = self.typical.get(model)
+        if typical is None or elapsed is None:
+            return None
+        saved = max(typical - elapsed, 0.0)
+        self.saved_seconds += saved
+        cancel_saved_seconds.observe(saved, model=model)
+        return saved
+
+    def as_dict(self) -> dict:
+        return {
+            "canceled": sum(self.reasons.values()),
+            "by_reason": dict(self.reasons),
+            "saved_seconds": round(self.saved_seconds, 1),
+            "typical_seconds": {model: round(seconds, 1) for model, seconds in self.typical.items()},
+        }
+
+
+cancellations = CancelStats()
+
+
+async def cancel_prediction(client: httpx.AsyncClient, prediction: dict, replicate_token: str) -> None:
+    """POST /predictions/{id}/cancel; best effort, a failure is only logged"""
+    url = (prediction.get("urls") or {}).get("cancel") or f"{REPLICATE_API_BASE}/predictions/{prediction['id']}/cancel"
+    try:
+        response = await client.post(url, headers=_auth_headers(replicate_token), timeout=10.0)
+        response.raise_for_status()
+    except httpx.HTTPError as err:
+        logger.warning("Could not cancel prediction %s: %s", prediction["id"], err)
+
+
+def cancel_in_background(
+    client: httpx.AsyncClient,
+    prediction: dict,
+    replicate_token: str,
+    model: str,
+    reason: str,
+    elapsed: Optional[float] = None
+) -> None:
+    """
+    Cancel a prediction without blocking the (already cancelled) caller.
+    elapsed is the seconds since the prediction was created.
+    """
+    saved = cancellations.canceled(model, reason, elapsed)
+    logger.info("Cancelling %s prediction %s (%s, ~%ss saved)", model, prediction["id"], reason,
+                f"{saved:.0f}" if saved is not None else "?")
+    task = asyncio.create_task(cancel_prediction(client, prediction, replicate_token))
+    _cancellations.add(task)
+    task.add_done_callback(_cancellations.discard)
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Seconds from a Retry-After header (delta-seconds or HTTP date)"""
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+async def create_prediction_governed(
+    client: httpx.AsyncClient,
+    body: dict,
+    replicate_token: str,
+    model: str
+) -> dict:
+    """
+    create_prediction behind the governor's token bucket.
+    - A 429 pauses creation for the whole process for Retry-After, then
+      retries; gives up with RateLimitedError after REPLICATE_MAX_429_RETRIES
+      or when Replicate asks for a longer wait than REPLICATE_MAX_RETRY_AFTER
+      or than the request deadline leaves.
+    - Connection failures and 5xx answers are retried with backoff per
+      create_retry_policy, within the request deadline.
+    """
+    throttled = 0
+    transient = 0
+    while True:
+        try:
+            await governor.acquire_create(model)
+            return await create_prediction(client, body, replicate_token)
+        except GovernorTimeout as err:
+            raise RateLimitedError(str(err), 429, retry_after=err.retry_after)
+        except (ReplicateError, httpx.HTTPError) as err:
+            if getattr(err, "status_code", None) == 429:
+                delay = err.retry_after if err.retry_after is not None else _backoff_delay(throttled, 1.0)
+                governor.throttled(model, delay)
+                # Give up when the pause would outlast the request deadline too
+                if (throttled >= REPLICATE_MAX_429_RETRIES or delay > REPLICATE_MAX_RETRY_AFTER
+                        or remaining(delay + 1.0) <= delay):
+                    raise RateLimitedError(
+                        f"Replicate rate limit: {err}", 429, retry_after=max(delay, 1.0)
+                    )
+                logger.warning("Replicate returned 429 for %s, retrying in %.1fs", model, delay)
+                throttled += 1
+                continue
+
+            reason = create_retry_policy.reason(err)
+            if reason is None or transient >= create_retry_policy.retries:
+                raise
+            delay = create_retry_policy.delay(transient)
+            # Only retry when the backoff still fits in the request budget
+            if remaining(delay + 1.0) <= delay:
+                raise
+            retries_total.inc(model=model, reason=reason)
+            logger.warning("Creating %s prediction failed (%s), retrying in %.1fs: %s", model, reason, delay, err)
+            transient += 1
+            await asyncio.sleep(delay)
+
+
+async def get_prediction(client: httpx.AsyncClient, prediction_id: str, replicate_token: str) -> dict:
+    response = await client.get(
+        f"{REPLICATE_API_BASE}/predictions/{prediction_id}",
+        headers=_auth_headers(replicate_token),
+        timeout=30.0
+    )
+    response.raise_for_status()
+    return response.json()
+
+
+class ProgressReporter:
+    """Reports status changes and new log lines of one prediction to the progress listener"""
+
+    def __init__(self, model: str, prediction: dict):
+        self.model = model
+        self.id = prediction["id"]
+        self.status = None
+        self.logs_seen = 0
+        self.update(prediction)
+
+    def update(self, prediction: dict) -> None:
+        status = prediction.get("status")
+        logs = prediction.get("logs") or ""
+        if len(logs) > self.logs_seen:
+            lines = logs[self.logs_seen:].splitlines()
+            self.logs_seen = len(logs)
+            fraction = log_progress(lines)
+            report("logs", model=self.model, id=self.id, lines=lines,
+                   **({"progress": fraction} if fraction is not None else {}))
+        if status != self.status:
+            self.status = status
+            report("prediction", model=self.model, id=self.id, status=status)
+
+
+async def wait_for_prediction(
+    client: httpx.AsyncClient,
+    prediction: dict,
+    replicate_token: str,
+    timeout: float,
+    model: str = "",
+    on_start: Optional[Callable[[], None]] = None
+) -> dict:
+    """
+    Wait until the prediction reaches a terminal status or `timeout` seconds pass.
+    Returns the latest prediction state either way.
+    on_start is called once when the prediction is first seen past `starting`;
+    until then polls stay at the initial interval, and since webhooks only
+    report completion, passing it also polls in webhook mode.
+    """
+    progress = ProgressReporter(model, prediction) if listening() else None
+
+    def seen(state: dict) -> None:
+        nonlocal on_start
+        if on_start is not None and state.get("status") != "starting":
+            on_start()
+            on_start = None
+
+    seen(prediction)
+    if prediction.get("status") in TERMINAL_STATUSES:
+        return prediction
+
+    prediction_id = prediction["id"]
+    deadline = time.monotonic() + timeout
+    watching = progress is not None or on_start is not None
+    initial = WEBHOOK_FALLBACK_DELAY if webhook_enabled() and not watching else POLL_INITIAL_DELAY
+    future = registry.register(prediction_id)
+    watcher = None
+    if webhook_enabled() and registry.relay is not None and not future.done():
+        watcher = asyncio.create_task(registry.watch_relay(prediction_id, future))
+    result = prediction
+    attempt = 0
+
+    try:
+        while result.get("status") not in TERMINAL_STATUSES:
+            left = deadline - time.monotonic()
+            if left <= 0:
+                break
+
+            # Sleep until the next poll, waking early if the webhook lands
+            done, _ = await asyncio.wait({future}, timeout=min(_backoff_delay(attempt, initial), left))
+            if done:
+                result = future.result()
+                break
+
+            # Until the start is seen, keep the first interval so it is noticed promptly
+            if on_start is None:
+                attempt += 1
+            try:
+                result = await get_prediction(client, prediction_id, replicate_token)
+            except httpx.HTTPError as err:
+                logger.warning("Poll for prediction %s failed: %s", prediction_id, err)
+                continue
+            seen(result)
+            if progress is not None:
+                progress.update(result)
+    finally:
+        registry.discard(prediction_id)
+        if watcher is not None:
+            watcher.cancel()
+
+    seen(result)
+    if progress is not None:
+        progress.update(result)
+    return result
+
+
+async def _follow(client: httpx.AsyncClient, entry: Entry, replicate_token: str) -> dict:
+    """Wait for a ledger prediction until it finishes or ages out, recording where it ends"""
+    prediction_id = entry.prediction["id"]
+    try:
+        wait = max(entry.created_at + ledger.ttl - time.time(), 0.0)
+        result = await wait_for_prediction(client, entry.prediction, replicate_token, wait, entry.model)
+    finally:
+        _reattached.pop(prediction_id, None)
+    if result.get("status") != entry.status:
+        await ledger.record(entry.at(result))
+    if result.get("status") == "succeeded":
+        for phase, seconds in observe_prediction(entry.model, result).items():
+            record_stage(f"{entry.model}_{phase}", seconds * 1000)
+    return result
+
+
+def reattach(client: httpx.AsyncClient, entry: Entry, replicate_token: str) -> asyncio.Task:
+    """The task following a ledger prediction, shared by everyone waiting for it"""
+    prediction_id = entry.prediction["id"]
+    task = _reattached.get(prediction_id)
+    if task is None:
+        ledger.reattached += 1
+        logger.info("Reattaching to %s prediction %s (%s)", entry.model, prediction_id, entry.status)
+        # A fresh context, so the follower reports to no request's progress stream
+        task = asyncio.create_task(_follow(client, entry, replicate_token), context=contextvars.Context())
+        _reattached[prediction_id] = task
+    return task
+
+
+async def resume_unfinished(client: httpx.AsyncClient, replicate_token: Optional[str]) -> int:
+    """Follow the predictions an earlier process left running; returns how many"""
+    if not replicate_token:
+        return 0
+    entries = await ledger.unfinished()
+    if entries:
+        logger.info("Reattaching to %d predictions left running by an earlier process", len(entries))
+    for entry in entries:
+        reattach(client, entry, replicate_token)
+    return len(entries)
+
+
+async def stop_following() -> None:
+    """Stop following ledger predictions; they stay running and recorded for the next start"""
+    tasks = list(_reattached.values())
+    for task in tasks:
+        task.cancel(SHUTDOWN)
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def _from_ledger(
+    client: httpx.AsyncClient,
+    entry: Entry,
+    replicate_token: str,
+    timeout: float,
+    on_start: Optional[Callable[[], None]]
+) -> Optional[dict]:
+    """
+    The result of a ledger prediction for the same request: its output when it
+    succeeded, or its state once this caller's wait ends when it is running.
+    None when it ended without an output, so a new prediction is due.
+    """
+    if entry.status == "succeeded":
+        ledger.reused += 1
+        ledger_lookups.inc(model=entry.model, outcome="completed")
+        logger.info("Reusing %s prediction %s from the ledger", entry.model, entry.prediction["id"])
+        return entry.prediction
+
+    ledger_lookups.inc(model=entry.model, outcome="reattached")
+    if on_start is not None and entry.status != "starting":
+        on_start()
+    task = reattach(client, entry, replicate_token)
+    try:
+        # Shielded: other callers may be waiting for the same prediction
+        result = await asyncio.wait_for(asyncio.shield(task), remaining(timeout))
+    except asyncio.TimeoutError:
+        return entry.prediction
+    if result.get("status") in ("succeeded", "starting", "processing"):
+        if on_start is not None and result.get("status") != "starting":
+            on_start()
+        return result
+    return None
+
+
+async def run_prediction(
+    client: httpx.AsyncClient,
+    body: dict,
+    replicate_token: str,
+    timeout: float = 120.0,
+    model: Optional[str] = None,
+    on_start: Optional[Callable[[], None]] = None,
+    ledger_key: Optional[str] = None,
+    reuse: bool = True
+) -> dict:
+    """
+    Create a prediction and wait for it to finish.
+    model labels its metrics and the <model>_queue / <model>_run stage
+    timings taken from Replicate's timestamps (defaults to the model field).
+    on_start is called when the prediction leaves `starting` (see
+    wait_for_prediction).
+
+    The prediction is recorded in the ledger under ledger_key (default: the
+    hash of body). With reuse, a succeeded or still running prediction
+    recorded under that key is used instead of creating one.
+
+    The wait is capped by the request deadline; a prediction still running
+    when the wait ends is cancelled on Replicate. Raises CircuitOpenError
+    without calling Replicate while the model's breaker is open. Only
+    upstream failures count against the breaker: 5xx answers, transport
+    errors and predictions still running at the model's own timeout. A
+    prediction that failed (usually on its input), was canceled or was cut
+    short by the request deadline says nothing about the model's health.
+    """
+    model = model or body.get("model") or "version"
+    key = ledger_key or inputs_hash(body)
+    if reuse and ledger.enabled:
+        entry = await ledger.find(key)
+        if entry is not None:
+            found = await _from_ledger(client, entry, replicate_token, timeout, on_start)
+            if found is not None:
+                return found
+
+    entry = None
+    gate = breaker(model)
+    gate.before_call()
+    prediction = None
+    created = 0.0
+    try:
+        # The in-flight slot is held until the prediction finishes
+        async with governor.slot(model):
+            with span(f"{model}.create"):
+                prediction = await create_prediction_governed(client, body, replicate_token, model)
+            created = time.monotonic()
+            entry = Entry(key, model, prediction, time.time())
+            await ledger.record(entry)
+            with span(f"{model}.wait"):
+                wait = remaining(timeout)
+                result = await wait_for_prediction(client, prediction, replicate_token, wait, model, on_start)
+    except GovernorTimeout as err:
+        gate.release()
+        raise RateLimitedError(str(err), 429, retry_after=err.retry_after)
+    except RateLimitedError:
+        # Throttling says nothing about the model's health
+        gate.release()
+        raise
+    except ReplicateError as err:
+        # A 4xx is a problem with our request, not with the model
+        if err.status_code is not None and 400 <= err.status_code < 500:
+            gate.release()
+        else:
+            gate.record_failure()
+        raise
+    except httpx.HTTPError:
+        gate.record_failure()
+        raise
+    except asyncio.CancelledError as err:
+        gate.release()
+        if prediction is not None and prediction.get("status") not in TERMINAL_STATUSES:
+            reason = str(err.args[0]) if err.args and err.args[0] else "cancelled"
+            if reason == SHUTDOWN and ledger.enabled:
+                # Left running; the ledger still lists it for the next process
+                logger.info("Leaving %s prediction %s running for the next start", model, prediction["id"])
+            else:
+                cancel_in_background(client, prediction, replicate_token, model, reason, time.monotonic() - created)
+                if entry is not None:
+                    ledger.record_soon(entry.at({**prediction, "status": "canceled"}))
+                report("prediction", model=model, id=prediction["id"], status="canceled", reason=reason)
+        raise
+    except BaseException:
+        gate.release()
+        raise
+
+    if result.get("status") == "succeeded":
+        gate.record_success()
+        cancellations.finished(model, time.monotonic() - created)
+    elif result.get("status") in TERMINAL_STATUSES:
+        gate.release()
+    else:
+        # Out of time; nobody will collect the output, so stop paying for it
+        reason = "deadline" if wait < timeout else "timeout"
+        if reason == "timeout":
+            gate.record_failure()
+        else:
+            gate.release()
+        cancel_in_background(client, result, replicate_token, model, reason, time.monotonic() - created)
+        report("prediction", model=model, id=result["id"], status="canceled", reason=reason)
+    await ledger.record(entry.at(result if result.get("status") in TERMINAL_STATUSES
+                                else {**result, "status": "canceled"}))
+
+    for phase, seconds in observe_prediction(model, result).items():
+        record_stage(f"{model}_{phase}", seconds * 1000)
+    return result
+
+
+def prediction_stats() -> dict:
+    return {
+        "mode": "webhook" if webhook_enabled() else "polling",
+        **registry.stats(),
+        "governor": governor.stats(),
+        "cancellations": cancellations.as_dict(),
+        "ledger": ledger_stats(),
+    }
@@ -0,0 +1,127 @@
+"""
+Progress events for streaming endpoints
+
+Pipeline code and the Replicate wait loop call report(); each event goes to
+the listener installed for the current context by listen(), or nowhere.
+Tasks copy the context they are created in, so predictions started by a
+listening request report to the same listener.
+
+stream() runs a pipeline and yields its events as they happen, then a
+final "result" (or "error") event. When the client disconnects (checked
+every DISCONNECT_CHECK_INTERVAL seconds) or the iterator is abandoned, the
+pipeline is cancelled, and with it any running prediction.
+until_disconnected() does the same for a request answered in one piece.
+"""
+
+import re
+import asyncio
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Awaitable, Callable, Iterator, Optional
+
+_listener: ContextVar[Optional[Callable[[dict], None]]] = ContextVar("progress_listener", default=None)
+
+DISCONNECT_CHECK_INTERVAL = 0.5
+
+# tqdm-style progress in Replicate logs: " 45%|████▌     | 9/20 [..."
+_PERCENT = re.compile(r"(\d{1,3})%\|")
+
+
+def listening() -> bool:
+    return _listener.get() is not None
+
+
+def report(event: str, **data: Any) -> None:
+    listener = _listener.get()
+    if listener is not None:
+        listener({"event": event, **data})
+
+
+@contextmanager
+def listen(callback: Callable[[dict], None]) -> Iterator[None]:
+    token = _listener.set(callback)
+    try:
+        yield
+    finally:
+        _listener.reset(token)
+
+
+def log_progress(lines: list[str]) -> Optional[float]:
+    """Fraction done according to the last tqdm-style line, if any"""
+    for line in reversed(lines):
+        match = _PERCENT.findall(line)
+        if match:
+            return min(int(match[-1]), 100) / 100
+    return None
+
+
+class ClientDisconnected(Exception):
+    """The client went away, so the pipeline serving it was cancelled"""
+
+
+def _watch(task: asyncio.Task, disconnected: Callable[[], Awaitable[bool]]) -> asyncio.Task:
+    """Cancel task (reason client_disconnected) once disconnected() says so"""
+    async def watch() -> None:
+        while not await disconnected():
+            await asyncio.sleep(DISCONNECT_CHECK_INTERVAL)
+        task.cancel("client_disconnected")
+
+    return asyncio.create_task(watch())
+
+
+async def until_disconnected(run: Callable[[], Awaitable[Any]], disconnected: Callable[[], Awaitable[bool]]) -> Any:
+    """
+    Run a pipeline and return its result, cancelling it if the client
+    disconnects first; that raises ClientDisconnected.
+    """
+    task = asyncio.create_task(run())
+    watcher = _watch(task, disconnected)
+    try:
+        return await task
+    except asyncio.CancelledError:
+        # The watcher cancelled the pipeline, not someone cancelling us
+        if task.cancelled() and not asyncio.current_task().cancelling():
+            raise ClientDisconnected("Client disconnected")
+        raise
+    finally:
+        watcher.cancel()
+        if not task.done():
+            task.cancel("request_cancelled")
+
+
+async def stream(
+    run: Callable[[], Awaitable[dict]],
+    disconnected: Optional[Callable[[], Awaitable[bool]]] = None
+) -> AsyncIterator[dict]:
+    """
+    Run a pipeline, yielding its progress events and then {"event": "result",
+    **result}. A failure becomes an "error" event carrying the exception's
+    status_code and detail when it has them (HTTPException does).
+    disconnected is polled to stop the pipeline once nobody is listening
+    (pass Request.is_disconnected).
+    """
+    queue: asyncio.Queue = asyncio.Queue()
+    with listen(queue.put_nowait):
+        task = asyncio.create_task(run())
+    task.add_done_callback(lambda _: queue.put_nowait(None))
+    watcher = _watch(task, disconnected) if disconnected is not None else None
+    try:
+        while (event := await queue.get()) is not None:
+            yield event
+        if task.cancelled():
+            return
+        try:
+            result = task.result()
+        except Exception as err:
+            yield {
+                "event": "error",
+                "status_code": getattr(err, "status_code", 500),
+                "detail": getattr(err, "detail", None) or str(err) or type(err).__name__,
+            }
+            return
+        yield {"event": "result", **result}
+    finally:
+        if watcher is not None:
+            watcher.cancel()
+        if not task.done():
+            task.cancel("client_disconnected")
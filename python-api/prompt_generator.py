@@ -26,9 +26,36 @@ Usage:
 """
 
 import os
+import sys
 import httpx
-import asyncio
-from typing import Literal, TypedDict, Optional
+import logging
+from typing import Iterable, Literal, Mapping, NotRequired, TypedDict, Optional
+
+from http_client import get_http_client
+from predictions import run_prediction, RateLimitedError, ReplicateError
+from resilience import CircuitOpenError, DeadlineExceeded
+from cache import build_cache, url_key, SingleFlight
+from keyword_matcher import KeywordMatcher
+from local_analyzer import LOCAL_ANALYSIS, LocalEstimate, estimate_kitchen_image
+from telemetry import Counter, register, span
+
+logger = logging.getLogger(__name__)
+
+# Longest we wait on BLIP-2 before falling back to the default analysis
+ANALYSIS_TIMEOUT = float(os.environ.get("ANALYSIS_TIMEOUT", "60"))
+
+# BLIP-2 results keyed by image content hash or normalized URL.
+# Captions for a given photo never change, so entries live for a week.
+analysis_cache = build_cache("ANALYSIS_CACHE", default_size=1024, default_ttl=7 * 24 * 3600)
+analysis_flight = SingleFlight(cancel_orphans=True)
+
+# Analyses that fell back to get_default_analysis(), by reason
+analysis_fallbacks = register(Counter(
+    "aeon_analysis_fallbacks_total", "BLIP-2 analyses replaced by the default analysis", ("reason",)
+))
+
+# Caption keywords -> KitchenAnalysis flags, loaded from ANALYSIS_KEYWORDS_PATH
+caption_matcher = KeywordMatcher.from_file()
 
 # Type definitions
 DoorStyle = Literal["slab", "shaker", "shaker-slide", "fusion-shaker", "fusion-slide"]
@@ -45,6 +72,12 @@ class KitchenAnalysis(TypedDict):
     lighting: LightingType
     needs_cleanup: bool
     warped_perspective: bool
+    # Set when BLIP-2 was skipped or failed and the defaults above were used
+    fallback_reason: NotRequired[str]
+    # Set to "local" when lighting / angle / warp came from the local estimate
+    # (with its per-field confidence) and BLIP-2 was skipped
+    source: NotRequired[str]
+    confidence: NotRequired[dict[str, float]]
 
 
 # Door geometry instructions - what Nano-Banana understands
@@ -78,71 +111,54 @@ HARDWARE_FINISH = {
 }
 
 
-def build_kitchen_refacing_prompt(
-    image_description: str,
-    door_style: DoorStyle,
-    color_hex: str,
-    color_name: str,
-    hardware_style: HardwareStyle,
-    hardware_finish: HardwareFinish,
-    drawers_missing: bool = False,
-    is_angled_photo: bool = False,
-    has_arched_doors: bool = False,
-    lighting: LightingType = "neutral",
-    needs_cleanup: bool = False,
-    warped_perspective: bool = False
-) -> str:
-    """
-    AEON Universal Prompt Generator
-    Builds a complete chain-of-command prompt for Nano-Banana
-    """
-    
-    door_geometry = DOOR_GEOMETRY.get(door_style, DOOR_GEOMETRY["shaker"])
-    hardware_geometry = HARDWARE_GEOMETRY.get(hardware_style, HARDWARE_GEOMETRY["bar"])
-    hardware_color = HARDWARE_FINISH.get(hardware_finish, HARDWARE_FINISH["nickel"])
-
-    # Section 2: Missing parts
-    missing_parts_section = (
-        "Some drawers are missing. Draw new drawer fronts as flat rectangles that match the size, shape, and alignment of surrounding drawers."
-        if drawers_missing else
-        "All drawers appear present; keep their size and outer boundaries unchanged."
-    )
+# Section texts that depend on the analysis flags
+MISSING_PARTS = {
+    True: "Some drawers are missing. Draw new drawer fronts as flat rectangles that match the size, shape, and alignment of surrounding drawers.",
+    False: "All drawers appear present; keep their size and outer boundaries unchanged."
+}
 
-    # Section 3: Erase old styles
-    erase_section = (
-        "Remove all arched or raised panel shapes. Flatten them completely before drawing the new style."
-        if has_arched_doors else
-        "Remove all existing panel lines, bevels, grooves, and decorative shapes to prepare for the new style."
-    )
+ERASE_STYLES = {
+    True: "Remove all arched or raised panel shapes. Flatten them completely before drawing the new style.",
+    False: "Remove all existing panel lines, bevels, grooves, and decorative shapes to prepare for the new style."
+}
 
-    # Section 7: Angle handling
-    angle_section = (
-        "Match the angle and perspective of the original photo when drawing all new rectangles and hardware. Maintain consistent vanishing points."
-        if is_angled_photo else
-        "Keep all geometry perfectly parallel since the photo is taken straight-on."
-    )
+ANGLE_HANDLING = {
+    True: "Match the angle and perspective of the original photo when drawing all new rectangles and hardware. Maintain consistent vanishing points.",
+    False: "Keep all geometry perfectly parallel since the photo is taken straight-on."
+}
 
-    warp_section = (
-        "Straighten any warped or distorted cabinet faces before applying the new geometry. Correct vertical and horizontal alignment."
-        if warped_perspective else ""
-    )
+WARP_CORRECTION = {
+    True: "Straighten any warped or distorted cabinet faces before applying the new geometry. Correct vertical and horizontal alignment.",
+    False: ""
+}
 
-    # Section 8: Lighting
-    lighting_map = {
-        "warm": "Adjust reflections and highlights to match warm indoor lighting.",
-        "cool": "Use cooler, softer highlights consistent with cool lighting.",
-        "neutral": "Use neutral white lighting reflections."
-    }
-    lighting_section = lighting_map.get(lighting, lighting_map["neutral"])
+LIGHTING = {
+    "warm": "Adjust reflections and highlights to match warm indoor lighting.",
+    "cool": "Use cooler, softer highlights consistent with cool lighting.",
+    "neutral": "Use neutral white lighting reflections."
+}
 
-    # Section 9: Cleanup
-    cleanup_section = (
-        "Remove noise, smudges, debris, and painter's tape before generating final output."
-        if needs_cleanup else
-        "Keep image clarity but do not over-smooth the rest of the kitchen."
-    )
+CLEANUP = {
+    True: "Remove noise, smudges, debris, and painter's tape before generating final output.",
+    False: "Keep image clarity but do not over-smooth the rest of the kitchen."
+}
+
+
+# ============ PRECOMPILED PROMPT TEMPLATE ============
+# The prompt is three static fragments around the free-text inputs:
+#   HEAD[drawers_missing, has_arched_doors, door_style] + color_name + " ("
+#   + color_hex + HARDWARE[hardware_style, hardware_finish]
+#   + TAIL[is_angled_photo, warped_perspective, lighting, needs_cleanup]
+#   + image_description
+# Every combination is small and fixed, so all fragments are built and
+# interned once at import and a prompt is a single join.
 
-    prompt = f"""LOOK AT THE IMAGE AND FOLLOW THESE ACTIONS EXACTLY:
+def _compile_fragments() -> tuple[dict, dict, dict]:
+    heads = {}
+    for drawers_missing in (True, False):
+        for has_arched_doors in (True, False):
+            for door_style, door_geometry in DOOR_GEOMETRY.items():
+                heads[drawers_missing, has_arched_doors, door_style] = sys.intern(f"""LOOK AT THE IMAGE AND FOLLOW THESE ACTIONS EXACTLY:
 
 1. ANALYZE STRUCTURE
 - Identify all cabinets, doors, drawers, openings, and hardware in the image.
@@ -150,16 +166,21 @@ def build_kitchen_refacing_prompt(
 - Do NOT modify anything except cabinets, drawers, and hardware.
 
 2. RECONSTRUCT MISSING PARTS
-{missing_parts_section}
+{MISSING_PARTS[drawers_missing]}
 
 3. ERASE OLD STYLES
-{erase_section}
+{ERASE_STYLES[has_arched_doors]}
 
 4. DRAW NEW DOOR STYLE
 {door_geometry}
 
 5. APPLY NEW COLOR
-Recolor all cabinet surfaces to {color_name} ({color_hex}) with a smooth satin finish.
+Recolor all cabinet surfaces to """)
+
+    hardware = {}
+    for hardware_style, hardware_geometry in HARDWARE_GEOMETRY.items():
+        for hardware_finish, hardware_color in HARDWARE_FINISH.items():
+            hardware[hardware_style, hardware_finish] = sys.intern(f""") with a smooth satin finish.
 Do not change shadows or reflections on surrounding objects.
 
 6. REMOVE OLD HARDWARE AND ADD NEW
@@ -169,97 +190,245 @@ Erase all existing handles and knobs completely.
 Place handles centered and aligned with standard orientation.
 
 7. ANGLE / PERSPECTIVE HANDLING
-{angle_section}
-{warp_section}
+""")
+
+    tails = {}
+    for is_angled_photo in (True, False):
+        for warped_perspective in (True, False):
+            for lighting, lighting_section in LIGHTING.items():
+                for needs_cleanup in (True, False):
+                    tails[is_angled_photo, warped_perspective, lighting, needs_cleanup] = sys.intern(f"""{ANGLE_HANDLING[is_angled_photo]}
+{WARP_CORRECTION[warped_perspective]}
 
 8. LIGHTING CONDITIONS
 {lighting_section}
 
 9. CLEANUP
-{cleanup_section}
+{CLEANUP[needs_cleanup]}
 
 10. FINAL DIRECTIVE
 Generate the updated kitchen with the new cabinet style, color, and hardware while keeping all other room elements unchanged.
 Maintain photorealism and match the original shadows, angle, and lighting.
 
 IMAGE REFERENCE:
-{image_description}"""
+""")
+
+    return heads, hardware, tails
+
+
+_HEADS, _HARDWARE, _TAILS = _compile_fragments()
 
-    return prompt.strip()
+
+def _normalize_keys(
+    door_style: str,
+    hardware_style: str,
+    hardware_finish: str,
+    lighting: str
+) -> tuple[str, str, str, str]:
+    """Apply the documented fallbacks for unknown styles, finishes and lighting"""
+    return (
+        door_style if door_style in DOOR_GEOMETRY else "shaker",
+        hardware_style if hardware_style in HARDWARE_GEOMETRY else "bar",
+        hardware_finish if hardware_finish in HARDWARE_FINISH else "nickel",
+        lighting if lighting in LIGHTING else "neutral",
+    )
 
 
-async def analyze_kitchen_image(image_url: str) -> KitchenAnalysis:
+def build_kitchen_refacing_prompt(
+    image_description: str,
+    door_style: DoorStyle,
+    color_hex: str,
+    color_name: str,
+    hardware_style: HardwareStyle,
+    hardware_finish: HardwareFinish,
+    drawers_missing: bool = False,
+    is_angled_photo: bool = False,
+    has_arched_doors: bool = False,
+    lighting: LightingType = "neutral",
+    needs_cleanup: bool = False,
+    warped_perspective: bool = False
+) -> str:
+    """
+    AEON Universal Prompt Generator
+    Builds a complete chain-of-command prompt for Nano-Banana
+    """
+    try:
+        head = _HEADS[drawers_missing, has_arched_doors, door_style]
+        hardware = _HARDWARE[hardware_style, hardware_finish]
+        tail = _TAILS[is_angled_photo, warped_perspective, lighting, needs_cleanup]
+    except (KeyError, TypeError):
+        door_style, hardware_style, hardware_finish, lighting = _normalize_keys(
+            door_style, hardware_style, hardware_finish, lighting
+        )
+        head = _HEADS[bool(drawers_missing), bool(has_arched_doors), door_style]
+        hardware = _HARDWARE[hardware_style, hardware_finish]
+        tail = _TAILS[bool(is_angled_photo), bool(warped_perspective), lighting, bool(needs_cleanup)]
+
+    return "".join((head, color_name, " (", color_hex, hardware, tail, image_description)).rstrip()
+
+
+def build_kitchen_refacing_prompts(
+    variants: Iterable[Mapping[str, str]],
+    image_description: str,
+    drawers_missing: bool = False,
+    is_angled_photo: bool = False,
+    has_arched_doors: bool = False,
+    lighting: LightingType = "neutral",
+    needs_cleanup: bool = False,
+    warped_perspective: bool = False
+) -> list[str]:
+    """
+    Build prompts for many variants of one analyzed image.
+    Each variant maps door_style, color_hex, color_name, hardware_style and
+    hardware_finish; the analysis-dependent tail is resolved once.
+    """
+    drawers_missing, has_arched_doors = bool(drawers_missing), bool(has_arched_doors)
+    tail = _TAILS[
+        bool(is_angled_photo),
+        bool(warped_perspective),
+        lighting if lighting in LIGHTING else "neutral",
+        bool(needs_cleanup)
+    ]
+
+    prompts = []
+    for variant in variants:
+        door_style, hardware_style, hardware_finish, _ = _normalize_keys(
+            variant["door_style"], variant["hardware_style"], variant["hardware_finish"], "neutral"
+        )
+        prompts.append("".join((
+            _HEADS[drawers_missing, has_arched_doors, door_style],
+            variant["color_name"], " (", variant["color_hex"],
+            _HARDWARE[hardware_style, hardware_finish],
+            tail,
+            image_description
+        )).rstrip())
+    return prompts
+
+
+async def analyze_kitchen_image(
+    image_url: str,
+    client: Optional[httpx.AsyncClient] = None,
+    cache_key: Optional[str] = None,
+    image_bytes: Optional[bytes] = None,
+    local_estimate: Optional[LocalEstimate] = None
+) -> KitchenAnalysis:
     """
     Analyze kitchen image using Replicate's BLIP-2 vision model
     Returns structured analysis for prompt generation
+
+    Results are cached under cache_key (pass content_key(image_bytes) when the
+    bytes are at hand) or the normalized image URL. Concurrent calls for the
+    same image share one prediction.
+
+    With LOCAL_ANALYSIS on, a local estimate (see local_analyzer.py) runs
+    first, from image_bytes or the fetched image; when it is confident,
+    BLIP-2 is skipped. Pass local_estimate when the caller already ran it.
+
+    When BLIP-2 cannot be used (no token, rate limited, circuit open, failed
+    or out of time) the default analysis is returned with fallback_reason
+    set. Fallback analyses are never cached.
     """
+    key = cache_key or url_key(image_url)
+    with span("analysis.cache_lookup"):
+        cached = await analysis_cache.get(key)
+    if cached is not None:
+        return cached
+
+    client = client or get_http_client()
+    return await analysis_flight.do(
+        key, lambda: _analyze_uncached(image_url, key, client, image_bytes, local_estimate)
+    )
+
+
+async def _analyze_uncached(
+    image_url: str,
+    key: str,
+    client: httpx.AsyncClient,
+    image_bytes: Optional[bytes],
+    local: Optional[LocalEstimate] = None
+) -> KitchenAnalysis:
+    """Local estimate when it is confident enough, BLIP-2 otherwise"""
+    if LOCAL_ANALYSIS:
+        if local is None:
+            with span("analysis.local"):
+                local = await estimate_kitchen_image(image_url, client, image_bytes)
+        if local is not None and local.confident():
+            analysis = {
+                **get_default_analysis(),
+                **local.fields,
+                "source": "local",
+                "confidence": local.confidence,
+            }
+            await analysis_cache.set(key, analysis)
+            return analysis
+
     replicate_token = os.environ.get("REPLICATE_API_TOKEN")
-    
+
     if not replicate_token:
-        print("⚠️ REPLICATE_API_TOKEN not set, using default analysis")
-        return get_default_analysis()
+        logger.warning("REPLICATE_API_TOKEN not set, using default analysis")
+        return fallback_analysis("no_token")
 
+    return await _caption_kitchen_image(image_url, key, replicate_token, client)
+
+
+async def _caption_kitchen_image(
+    image_url: str,
+    key: str,
+    replicate_token: str,
+    client: httpx.AsyncClient
+) -> KitchenAnalysis:
+    """Run BLIP-2 once and cache the parsed result"""
     try:
-        async with httpx.AsyncClient() as client:
-            # Use Salesforce BLIP-2 for image captioning
-            response = await client.post(
-                "https://api.replicate.com/v1/predictions",
-                headers={
-                    "Authorization": f"Bearer {replicate_token}",
-                    "Content-Type": "application/json",
-                },
-                json={
-                    "version": "2e1dddc8621f72155f24cf2e0adbde548458d3cab9f00c0139eea840d0ac4746",
-                    "input": {
-                        "image": image_url,
-                        "question": "Describe this kitchen in detail including: cabinet style (arched, raised panel, flat, shaker), lighting (warm, cool, neutral), camera angle (straight-on or angled), any missing drawer fronts, and overall condition."
-                    }
-                },
-                timeout=60.0
-            )
-
-            if response.status_code != 201:
-                raise Exception(f"BLIP-2 API error: {response.status_code}")
-
-            prediction = response.json()
-            
-            # Poll for result
-            result = prediction
-            while result.get("status") in ("starting", "processing"):
-                await asyncio.sleep(1)
-                poll_response = await client.get(
-                    f"https://api.replicate.com/v1/predictions/{result['id']}",
-                    headers={"Authorization": f"Bearer {replicate_token}"},
-                    timeout=30.0
-                )
-                result = poll_response.json()
-
-            if result.get("status") != "succeeded" or not result.get("output"):
-                raise Exception("BLIP-2 prediction failed")
-
-            output = result["output"]
-            description = output if isinstance(output, str) else " ".join(output)
-            
-            return parse_image_description(description)
-            
-    except Exception as err:
-        print(f"⚠️ Kitchen analysis failed: {err}")
-        return get_default_analysis()
+        # Use Salesforce BLIP-2 for image captioning
+        result = await run_prediction(
+            client,
+            {
+                "version": "2e1dddc8621f72155f24cf2e0adbde548458d3cab9f00c0139eea840d0ac4746",
+                "input": {
+                    "image": image_url,
+                    "question": "Describe this kitchen in detail including: cabinet style (arched, raised panel, flat, shaker), lighting (warm, cool, neutral), camera angle (straight-on or angled), any missing drawer fronts, and overall condition."
+                }
+            },
+            replicate_token,
+            timeout=ANALYSIS_TIMEOUT,
+            model="blip2",
+            ledger_key="analysis:" + key
+        )
+
+        if result.get("status") != "succeeded" or not result.get("output"):
+            raise ReplicateError(f"BLIP-2 prediction {result.get('status')}: {result.get('error') or 'no output'}")
+
+        output = result["output"]
+        description = output if isinstance(output, str) else " ".join(output)
+        
+        with span("analysis.parse"):
+            analysis = parse_image_description(description)
+        await analysis_cache.set(key, analysis)
+        return analysis
+        
+    except CircuitOpenError:
+        # Already logged when the breaker opened; skip BLIP-2 without waiting
+        return fallback_analysis("circuit_open")
+    except RateLimitedError as err:
+        logger.warning("Kitchen analysis rate limited, using default analysis: %s", err)
+        return fallback_analysis("rate_limited")
+    except DeadlineExceeded:
+        logger.warning("No time left for kitchen analysis, using default analysis")
+        return fallback_analysis("deadline")
+    except (ReplicateError, httpx.HTTPError) as err:
+        logger.warning("Kitchen analysis failed, using default analysis: %s", err)
+        return fallback_analysis("error")
+
+
+def fallback_analysis(reason: str) -> KitchenAnalysis:
+    """Default analysis tagged with why BLIP-2 was not used"""
+    analysis_fallbacks.inc(reason=reason)
+    return {**get_default_analysis(), "fallback_reason": reason}
 
 
 def parse_image_description(description: str) -> KitchenAnalysis:
     """Parse the BLIP-2 description for key features"""
-    lower_desc = description.lower()
-    
-    return {
-        "image_description": description,
-        "drawers_missing": any(word in lower_desc for word in ["missing", "no drawer", "empty"]),
-        "is_angled_photo": any(word in lower_desc for word in ["angle", "corner", "perspective"]),
-        "has_arched_doors": any(word in lower_desc for word in ["arch", "raised panel", "cathedral"]),
-        "lighting": "warm" if "warm" in lower_desc else ("cool" if "cool" in lower_desc else "neutral"),
-        "needs_cleanup": any(word in lower_desc for word in ["dirty", "tape", "debris", "mess"]),
-        "warped_perspective": any(word in lower_desc for word in ["distort", "warp", "fisheye"])
-    }
+    return {"image_description": description, **caption_matcher.match(description)}
 
 
 def get_default_analysis() -> KitchenAnalysis:
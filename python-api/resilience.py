@@ -0,0 +1,208 @@
+"""
+Retry policy, request deadlines and circuit breakers for Replicate calls
+
+- RetryPolicy decides which failures are worth another attempt and how long
+  to back off. Prediction creation is only retried when Replicate cannot
+  have started a prediction: the connection failed, or Replicate answered
+  with a 5xx. A read timeout after the request was sent is not retried,
+  because that could start (and bill) a second prediction.
+- deadline() bounds a whole request. Every stage asks remaining() for its
+  share, so a slow analysis leaves less time for the render instead of each
+  stage getting its full timeout.
+- CircuitBreaker tracks consecutive failures per model. While open, calls
+  fail immediately (analysis falls back to the default right away instead of
+  waiting on BLIP-2 per request); after BREAKER_RESET_TIMEOUT one probe call
+  is let through and its outcome closes or re-opens the breaker.
+
+Configuration (environment):
+    REPLICATE_CREATE_RETRIES    Extra attempts for a failed creation (default 2)
+    REQUEST_DEADLINE            Seconds budgeted for one visualization (default 150)
+    BREAKER_FAILURE_THRESHOLD   Consecutive failures that open a breaker (default 5)
+    BREAKER_RESET_TIMEOUT       Seconds a breaker stays open before probing (default 30)
+"""
+
+import os
+import time
+import random
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, Optional
+
+import httpx
+
+from telemetry import CallbackMetric, Counter, register
+
+logger = logging.getLogger(__name__)
+
+REPLICATE_CREATE_RETRIES = int(os.environ.get("REPLICATE_CREATE_RETRIES", "2"))
+REQUEST_DEADLINE = float(os.environ.get("REQUEST_DEADLINE", "150"))
+BREAKER_FAILURE_THRESHOLD = int(os.environ.get("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_TIMEOUT = float(os.environ.get("BREAKER_RESET_TIMEOUT", "30"))
+
+retries_total = register(Counter(
+    "aeon_replicate_retries_total", "Prediction creations retried after a transient failure", ("model", "reason")
+))
+breaker_rejections = register(Counter(
+    "aeon_breaker_rejections_total", "Calls failed fast by an open circuit breaker", ("model",)
+))
+
+
+# ============ RETRIES ============
+
+class RetryPolicy:
+    """Which creation failures to retry, and the backoff between attempts"""
+
+    # Errors raised before the request reached Replicate
+    UNSENT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+    def __init__(self, retries: int = REPLICATE_CREATE_RETRIES, base_delay: float = 0.5, max_delay: float = 8.0):
+        self.retries = retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def reason(self, err: Exception) -> Optional[str]:
+        """Why err is retryable, or None when it is not"""
+        if isinstance(err, self.UNSENT_ERRORS):
+            return "connect"
+        status_code = getattr(err, "status_code", None)
+        if status_code is not None and 500 <= status_code < 600:
+            return "5xx"
+        return None
+
+    def delay(self, attempt: int) -> float:
+        """Full-jitter exponential backoff"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+
+create_retry_policy = RetryPolicy()
+
+
+# ============ DEADLINES ============
+
+class DeadlineExceeded(Exception):
+    """The request's time budget ran out before a stage could start"""
+
+
+_deadline: ContextVar[Optional[float]] = ContextVar("deadline", default=None)
+
+
+@contextmanager
+def deadline(seconds: float = REQUEST_DEADLINE) -> Iterator[None]:
+    """Bound everything inside the block (tasks started inside inherit it). Nested deadlines only shrink."""
+    current = _deadline.get()
+    limit = time.monotonic() + seconds
+    token = _deadline.set(limit if current is None else min(current, limit))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining(timeout: float) -> float:
+    """
+    The smaller of `timeout` and the time left in the current deadline.
+    Raises DeadlineExceeded when the budget is already spent.
+    """
+    limit = _deadline.get()
+    if limit is None:
+        return timeout
+    left = limit - time.monotonic()
+    if left <= 0:
+        raise DeadlineExceeded("Request deadline exceeded")
+    return min(timeout, left)
+
+
+# ============ CIRCUIT BREAKERS ============
+
+class CircuitOpenError(Exception):
+    """The breaker for a model is open; the call was not attempted"""
+
+    def __init__(self, model: str, retry_after: float):
+        super().__init__(f"{model} is unavailable (circuit open, retry in {retry_after:.0f}s)")
+        self.model = model
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Closed -> open after consecutive failures -> half-open probe -> closed"""
+
+    def __init__(self, model: str, threshold: int = BREAKER_FAILURE_THRESHOLD, reset_timeout: float = BREAKER_RESET_TIMEOUT):
+        self.model = model
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.opened_count = 0
+        self._probing = False
+
+    def before_call(self) -> None:
+        """Raise CircuitOpenError unless a call may go ahead"""
+        if self.state == "closed":
+            return
+        if self.state == "open":
+            waited = time.monotonic() - self.opened_at
+            if waited < self.reset_timeout:
+                breaker_rejections.inc(model=self.model)
+                raise CircuitOpenError(self.model, self.reset_timeout - waited)
+            self.state = "half_open"
+        # Half-open: exactly one probe at a time
+        if self._probing:
+            breaker_rejections.inc(model=self.model)
+            raise CircuitOpenError(self.model, 1.0)
+        self._probing = True
+
+    def record_success(self) -> None:
+        if self.state != "closed":
+            logger.info("%s circuit closed", self.model)
+        self.state = "closed"
+        self.failures = 0
+        self._probing = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        self._probing = False
+        if self.state == "half_open" or self.failures >= self.threshold:
+            if self.state != "open":
+                self.opened_count += 1
+                logger.warning(
+                    "%s circuit opened after %d consecutive failures; failing fast for %.0fs",
+                    self.model, self.failures, self.reset_timeout
+                )
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+    def release(self) -> None:
+        """The call ended without telling us anything about health (e.g. cancelled)"""
+        self._probing = False
+
+    def stats(self) -> dict:
+        retry_in = self.reset_timeout - (time.monotonic() - self.opened_at) if self.state == "open" else 0.0
+        return {
+            "state": self.state,
+            "consecutive_failures": self.failures,
+            "times_opened": self.opened_count,
+            "retry_in": round(max(retry_in, 0.0), 1),
+        }
+
+
+_breakers: dict[str, CircuitBreaker] = {}
+
+
+def breaker(model: str) -> CircuitBreaker:
+    if model not in _breakers:
+        _breakers[model] = CircuitBreaker(model)
+    return _breakers[model]
+
+
+def breaker_stats() -> dict:
+    return {model: b.stats() for model, b in _breakers.items()}
+
+
+_STATE_VALUES = {"closed": 0, "half_open": 1, "open": 2}
+
+register(CallbackMetric(
+    "aeon_breaker_state", "Circuit breaker state per model (0 closed, 1 half-open, 2 open)", "gauge",
+    lambda: {(model,): _STATE_VALUES[b.state] for model, b in _breakers.items()}, ("model",)
+))
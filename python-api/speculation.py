@@ -0,0 +1,125 @@
+"""
+Speculative rendering - start Nano-Banana before BLIP-2 finishes
+
+The analysis only changes a few sentences of the prompt, through six flags,
+and most photos get the default for most of them. With SPECULATIVE_RENDER
+on, /visualize and /jobs/visualize start the render at once from a guessed
+analysis while BLIP-2 runs:
+    - the guess is the default analysis, with lighting / angle / warp taken
+      from the local estimate when LOCAL_ANALYSIS is on;
+    - hit: BLIP-2's flags equal the guess; the render keeps going and the
+      analysis time is saved. The prompt keeps the guessed image
+      description, which only closes the prompt.
+    - miss: the speculative prediction is cancelled on Replicate and a render
+      with the real analysis starts; the part of a prediction that already
+      ran is wasted.
+Photos whose analysis is already known (cached, or a confident local
+estimate) are rendered normally, as are uploads through /visualize/upload.
+
+Configuration (environment):
+    SPECULATIVE_RENDER   "1" to render before the analysis is known (default 0)
+"""
+
+import os
+from dataclasses import dataclass
+from typing import Optional
+
+import httpx
+
+from local_analyzer import LOCAL_ANALYSIS, LocalEstimate, estimate_kitchen_image
+from prompt_generator import analysis_cache, get_default_analysis
+from telemetry import Counter, Histogram, register, span
+
+SPECULATIVE_RENDER = os.environ.get("SPECULATIVE_RENDER", "0") == "1"
+
+# The analysis fields that select prompt fragments
+PROMPT_FLAGS = (
+    "drawers_missing",
+    "is_angled_photo",
+    "has_arched_doors",
+    "lighting",
+    "needs_cleanup",
+    "warped_perspective",
+)
+
+speculations = register(Counter(
+    "aeon_speculative_renders_total",
+    "Speculative renders by outcome (hit = kept, miss = cancelled and re-rendered)",
+    ("outcome", "source")
+))
+saved_seconds = register(Histogram(
+    "aeon_speculation_saved_seconds",
+    "Render time gained on a hit: how long the render ran before the analysis arrived",
+))
+wasted_seconds = register(Histogram(
+    "aeon_speculation_wasted_seconds",
+    "Prediction time thrown away on a miss",
+))
+
+
+@dataclass
+class Guess:
+    analysis: dict
+    source: str                               # cache, local or default
+    local: Optional[LocalEstimate] = None
+
+    @property
+    def settled(self) -> bool:
+        """The real analysis is already known, so there is nothing to speculate on"""
+        return self.source == "cache" or (self.local is not None and self.local.confident())
+
+
+async def guess_analysis(image_url: str, key: str, client: httpx.AsyncClient) -> Guess:
+    cached = await analysis_cache.peek(key)
+    if cached is not None:
+        return Guess(cached, "cache")
+
+    guess = get_default_analysis()
+    if LOCAL_ANALYSIS:
+        with span("analysis.local"):
+            local = await estimate_kitchen_image(image_url, client)
+        if local is not None:
+            return Guess({**guess, **local.fields}, "local", local)
+    return Guess(guess, "default")
+
+
+def matches(guess: dict, analysis: dict) -> bool:
+    return all(guess[flag] == analysis[flag] for flag in PROMPT_FLAGS)
+
+
+class SpeculationStats:
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+        self.wasted_seconds = 0.0
+
+    def hit(self, source: str, seconds: float) -> None:
+        self.hits += 1
+        self.saved_seconds += seconds
+        speculations.inc(outcome="hit", source=source)
+        saved_seconds.observe(seconds)
+
+    def miss(self, source: str, seconds: float) -> None:
+        self.misses += 1
+        self.wasted_seconds += seconds
+        speculations.inc(outcome="miss", source=source)
+        wasted_seconds.observe(seconds)
+
+    def as_dict(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "enabled": SPECULATIVE_RENDER,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else None,
+            "saved_seconds": round(self.saved_seconds, 1),
+            "wasted_seconds": round(self.wasted_seconds, 1),
+        }
+
+
+stats = SpeculationStats()
+
+
+def speculation_stats() -> dict:
+    return stats.as_dict()
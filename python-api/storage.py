@@ -0,0 +1,294 @@
+"""
+Object storage for direct-to-storage uploads
+
+POST /uploads/presign hands the browser a short-lived signed upload target,
+so photo bytes go straight to object storage instead of streaming through
+the API and being re-uploaded; /visualize then receives only the resulting
+image URL. The target is always a multipart form POST (url + fields, with
+the photo as the "file" field), so the frontend has one code path for every
+backend:
+    - s3: S3 or an S3-compatible store (MinIO, R2) through a presigned POST
+      policy that pins the key, content type and size range. Needs boto3.
+    - local: files on disk behind POST / GET /uploads/{key} on this API,
+      signed with an HMAC, each key written once. A stand-in for development and tests: the bytes
+      do pass through this API, objects expire after STORAGE_LOCAL_TTL and
+      uploads are refused once STORAGE_LOCAL_MAX_BYTES are stored.
+Direct uploads are off unless STORAGE_BACKEND is set; the routes then 404.
+
+Direct uploads skip the server-side downscale in ingest.py; POST
+/visualize/upload remains for clients that cannot upload directly.
+
+Configuration (environment):
+    STORAGE_BACKEND          s3 or local; unset disables direct uploads (default)
+    STORAGE_UPLOAD_TTL       Seconds a presigned upload stays valid (default 300)
+    STORAGE_READ_TTL         Seconds a presigned s3 read URL stays valid (default 3600)
+    STORAGE_PUBLIC_BASE_URL  Public URL prefix of stored objects (default: presigned
+                             read URLs for s3, this API's URL for local)
+    STORAGE_DIR              Directory of the local backend (default ./storage)
+    STORAGE_SECRET           HMAC key of the local backend (default: random per
+                             process; set it when running several workers)
+    STORAGE_LOCAL_TTL        Seconds the local backend keeps an object (default 3600)
+    STORAGE_LOCAL_MAX_BYTES  Bytes the local backend stores at most (default 1 GiB)
+    STORAGE_BUCKET           Bucket of the s3 backend
+    STORAGE_ENDPOINT_URL     S3-compatible endpoint, e.g. http://localhost:9000 for MinIO
+    STORAGE_REGION           Region of the s3 backend
+"""
+
+import os
+import re
+import hmac
+import time
+import uuid
+import hashlib
+import secrets
+from dataclasses import dataclass, asdict
+
+try:
+    import boto3
+    from botocore.config import Config as BotoConfig
+except ImportError:  # STORAGE_BACKEND=s3 unavailable; the local backend still works
+    boto3 = None
+
+from ingest import UPLOAD_MAX_BYTES
+
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "").lower()
+STORAGE_UPLOAD_TTL = int(os.environ.get("STORAGE_UPLOAD_TTL", "300"))
+STORAGE_READ_TTL = int(os.environ.get("STORAGE_READ_TTL", "3600"))
+STORAGE_PUBLIC_BASE_URL = os.environ.get("STORAGE_PUBLIC_BASE_URL", "").rstrip("/")
+STORAGE_DIR = os.environ.get("STORAGE_DIR", "storage")
+STORAGE_SECRET = os.environ.get("STORAGE_SECRET", "")
+STORAGE_LOCAL_TTL = int(os.environ.get("STORAGE_LOCAL_TTL", "3600"))
+STORAGE_LOCAL_MAX_BYTES = int(os.environ.get("STORAGE_LOCAL_MAX_BYTES", str(1024 ** 3)))
+STORAGE_BUCKET = os.environ.get("STORAGE_BUCKET", "")
+STORAGE_ENDPOINT_URL = os.environ.get("STORAGE_ENDPOINT_URL", "")
+STORAGE_REGION = os.environ.get("STORAGE_REGION", "")
+
+# Accepted upload types and the extension their objects are stored under
+CONTENT_TYPES = {"image/jpeg": "jpg", "image/png": "png", "image/webp": "webp"}
+
+
+class StorageError(Exception):
+    """An upload target could not be issued or an upload was refused"""
+
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+@dataclass
+class PresignedUpload:
+    key: str
+    url: str              # POST the form here
+    fields: dict          # form fields to send before the "file" field
+    image_url: str        # pass to /visualize once the upload succeeded
+    expires_at: int
+    max_bytes: int
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+def new_object_name(content_type: str) -> str:
+    extension = CONTENT_TYPES.get(content_type)
+    if extension is None:
+        raise StorageError(
+            f"Unsupported content type {content_type!r} (expected one of {', '.join(CONTENT_TYPES)})", 415
+        )
+    return f"{uuid.uuid4().hex}.{extension}"
+
+
+class LocalStorage:
+    """Filesystem stand-in for object storage, served by this API"""
+
+    name = "local"
+    _KEY = re.compile(r"^[0-9a-f]{32}\.(jpg|png|webp)$")
+
+    def __init__(self, directory: str, secret: str, public_base_url: str = "",
+                 ttl: int = STORAGE_LOCAL_TTL, max_bytes: int = STORAGE_LOCAL_MAX_BYTES):
+        self.directory = directory
+        self.secret = (secret or secrets.token_hex(32)).encode()
+        self.public_base_url = public_base_url
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.expired = 0
+
+    def _signature(self, key: str, content_type: str, expires: int, max_bytes: int) -> str:
+        message = f"{key}\n{content_type}\n{expires}\n{max_bytes}".encode()
+        return hmac.new(self.secret, message, hashlib.sha256).hexdigest()
+
+    def presign(self, content_type: str, base_url: str) -> PresignedUpload:
+        key = new_object_name(content_type)
+        expires = int(time.time()) + STORAGE_UPLOAD_TTL
+        url = f"{(self.public_base_url or base_url).rstrip('/')}/uploads/{key}"
+        return PresignedUpload(
+            key=key,
+            url=url,
+            fields={
+                "Content-Type": content_type,
+                "expires": str(expires),
+                "max_bytes": str(UPLOAD_MAX_BYTES),
+                "signature": self._signature(key, content_type, expires, UPLOAD_MAX_BYTES),
+            },
+            image_url=url,
+            expires_at=expires,
+            max_bytes=UPLOAD_MAX_BYTES,
+        )
+
+    def path(self, key: str) -> str:
+        if not self._KEY.match(key):
+            raise StorageError("Not found", 404)
+        return os.path.join(self.directory, key)
+
+    def verify(self, key: str, content_type: str, expires: str, max_bytes: str, signature: str) -> int:
+        """Check an upload form against its signature. Returns the byte limit it was issued with."""
+        self.path(key)
+        try:
+            expires_at, limit = int(expires), int(max_bytes)
+        except ValueError:
+            raise StorageError("Malformed upload form", 400)
+        expected = self._signature(key, content_type, expires_at, limit)
+        if not hmac.compare_digest(expected, signature):
+            raise StorageError("Invalid upload signature", 403)
+        if expires_at < time.time():
+            raise StorageError("Upload URL expired", 403)
+        return limit
+
+    def fresh(self, path: str) -> bool:
+        """Whether a stored object exists and has not expired"""
+        try:
+            return os.stat(path).st_mtime + self.ttl >= time.time()
+        except FileNotFoundError:
+            return False
+
+    def sweep(self) -> int:
+        """Delete expired objects (blocking). Returns the bytes still stored."""
+        used = 0
+        cutoff = time.time() - self.ttl
+        try:
+            entries = list(os.scandir(self.directory))
+        except FileNotFoundError:
+            return 0
+        for entry in entries:
+            if not entry.is_file() or not self._KEY.match(entry.name):
+                continue
+            try:
+                info = entry.stat()
+                if info.st_mtime < cutoff:
+                    os.remove(entry.path)
+                    self.expired += 1
+                else:
+                    used += info.st_size
+            except FileNotFoundError:
+                continue
+        return used
+
+    def exists(self, key: str) -> bool:
+        return os.path.exists(self.path(key))
+
+    def write(self, key: str, data: bytes) -> None:
+        """
+        Store an object atomically (blocking; run it in a thread). Keys are
+        written once: a second upload to a signed URL, while the signature
+        is still valid, is refused with 409 instead of replacing the object.
+        """
+        path = self.path(key)
+        if self.exists(key):
+            raise StorageError("Object already uploaded", 409)
+        if self.sweep() + len(data) > self.max_bytes:
+            raise StorageError("Upload storage is full, try again later", 507)
+        os.makedirs(self.directory, exist_ok=True)
+        partial = f"{path}.{uuid.uuid4().hex}.part"
+        with open(partial, "wb") as f:
+            f.write(data)
+        try:
+            # Unlike os.replace, a link fails when a concurrent upload got there first
+            os.link(partial, path)
+        except FileExistsError:
+            raise StorageError("Object already uploaded", 409)
+        finally:
+            os.remove(partial)
+
+
+class S3Storage:
+    """S3 or an S3-compatible store, uploaded to through presigned POST policies"""
+
+    name = "s3"
+    PREFIX = "uploads/"
+
+    def __init__(self, bucket: str, endpoint_url: str = "", region: str = "", public_base_url: str = ""):
+        if boto3 is None:
+            raise RuntimeError("STORAGE_BACKEND=s3 needs the boto3 package (pip install boto3)")
+        if not bucket:
+            raise RuntimeError("STORAGE_BACKEND=s3 needs STORAGE_BUCKET")
+        self.bucket = bucket
+        self.public_base_url = public_base_url
+        self.client = boto3.client(
+            "s3",
+            endpoint_url=endpoint_url or None,
+            region_name=region or None,
+            config=BotoConfig(signature_version="s3v4"),
+        )
+
+    def presign(self, content_type: str, base_url: str) -> PresignedUpload:
+        key = self.PREFIX + new_object_name(content_type)
+        post = self.client.generate_presigned_post(
+            Bucket=self.bucket,
+            Key=key,
+            Fields={"Content-Type": content_type},
+            Conditions=[{"Content-Type": content_type}, ["content-length-range", 1, UPLOAD_MAX_BYTES]],
+            ExpiresIn=STORAGE_UPLOAD_TTL,
+        )
+        return PresignedUpload(
+            key=key,
+            url=post["url"],
+            fields=post["fields"],
+            image_url=self.read_url(key),
+            expires_at=int(time.time()) + STORAGE_UPLOAD_TTL,
+            max_bytes=UPLOAD_MAX_BYTES,
+        )
+
+    def read_url(self, key: str) -> str:
+        if self.public_base_url:
+            return f"{self.public_base_url}/{key}"
+        return self.client.generate_presigned_url(
+            "get_object", Params={"Bucket": self.bucket, "Key": key}, ExpiresIn=STORAGE_READ_TTL
+        )
+
+
+def build_storage():
+    """The configured backend, or None when direct uploads are off"""
+    if STORAGE_BACKEND in ("", "none"):
+        return None
+    if STORAGE_BACKEND == "local":
+        return LocalStorage(STORAGE_DIR, STORAGE_SECRET, STORAGE_PUBLIC_BASE_URL)
+    if STORAGE_BACKEND == "s3":
+        return S3Storage(STORAGE_BUCKET, STORAGE_ENDPOINT_URL, STORAGE_REGION, STORAGE_PUBLIC_BASE_URL)
+    raise ValueError(f"Unknown STORAGE_BACKEND {STORAGE_BACKEND!r} (expected s3, local or unset)")
+
+
+storage = build_storage()
+
+
+class UploadStats:
+    def __init__(self):
+        self.presigned = 0
+        self.local_uploads = 0
+        self.local_bytes = 0
+        self.rejected = 0
+
+    def as_dict(self) -> dict:
+        return {
+            "backend": storage.name if storage is not None else None,
+            "presigned": self.presigned,
+            "local_uploads": self.local_uploads,
+            "local_bytes": self.local_bytes,
+            "local_expired": storage.expired if isinstance(storage, LocalStorage) else 0,
+            "rejected": self.rejected,
+        }
+
+
+stats = UploadStats()
+
+
+def storage_stats() -> dict:
+    return stats.as_dict()
@@ -0,0 +1,295 @@
+"""
+Request tracing, structured logs and Prometheus metrics
+
+- Every request gets an id (the incoming X-Request-ID header, or a new one)
+  that is echoed on the response and stamped on every log line written
+  while the request - or a job it queued - is being served.
+- span(stage) times one pipeline stage: the duration is observed in the
+  aeon_stage_duration_seconds histogram and logged with the request id.
+- observe_prediction() splits a finished Replicate prediction into queue
+  time (created -> started) and run time (started -> completed) using the
+  timestamps Replicate returns.
+- render_metrics() writes every metric in the Prometheus text format for
+  GET /metrics.
+
+Configuration (environment):
+    LOG_LEVEL   Root log level (default INFO; DEBUG adds a line per span)
+"""
+
+import os
+import re
+import time
+import uuid
+import logging
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Callable, Iterator, Optional
+
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+
+REQUEST_ID_HEADER = "x-request-id"
+# Accept caller-supplied ids only if they are short and log-safe
+_VALID_REQUEST_ID = re.compile(r"^[A-Za-z0-9._:-]{1,128}$")
+
+request_id_var: ContextVar[str] = ContextVar("request_id", default="-")
+
+logger = logging.getLogger("telemetry")
+
+
+# ============ METRICS ============
+
+# Seconds; pipeline stages range from sub-millisecond prompt builds to
+# multi-minute renders
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+
+
+def _format_labels(names: tuple[str, ...], values: tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Histogram:
+    """Cumulative-bucket histogram with a fixed set of label names"""
+
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = (), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [per-bucket counts..., +Inf count], sum
+        self._series: dict[tuple[str, ...], tuple[list[int], list[float]]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = ([0] * (len(self.buckets) + 1), [0.0])
+        counts, total = series
+        counts[bisect_left(self.buckets, value)] += 1
+        total[0] += value
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total) in sorted(self._series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = _format_labels(self.labelnames, key, f'le="{_format_value(bound)}"')
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total[0])}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Counter:
+    """Monotonic counter with a fixed set of label names"""
+
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for key, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class CallbackMetric:
+    """
+    Gauge or counter read from existing runtime counters at scrape time.
+    fn returns a number, or a dict of label-value tuple -> number.
+    """
+
+    def __init__(self, name: str, help: str, type: str, fn: Callable, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.type = type
+        self.fn = fn
+        self.labelnames = labelnames
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        values = self.fn()
+        if not isinstance(values, dict):
+            values = {(): values}
+        for key, value in sorted(values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+_metrics: list = []
+
+
+def register(metric):
+    _metrics.append(metric)
+    return metric
+
+
+def render_metrics() -> str:
+    lines: list[str] = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+stage_duration = register(Histogram(
+    "aeon_stage_duration_seconds", "Duration of one pipeline stage", ("stage",)
+))
+prediction_duration = register(Histogram(
+    "aeon_prediction_duration_seconds",
+    "Replicate prediction time by phase (queue = created to started, run = started to completed)",
+    ("model", "phase")
+))
+predictions_finished = register(Counter(
+    "aeon_predictions_total", "Replicate predictions by final status", ("model", "status")
+))
+http_duration = register(Histogram(
+    "aeon_http_request_duration_seconds", "HTTP request duration", ("method", "route", "status")
+))
+
+
+# ============ SPANS ============
+
+@contextmanager
+def span(stage: str) -> Iterator[None]:
+    """Time a pipeline stage into the stage histogram and the debug log"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        stage_duration.observe(elapsed, stage=stage)
+        logger.debug("span stage=%s duration_ms=%.1f", stage, elapsed * 1000)
+
+
+def _parse_timestamp(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    try:
+        # Python < 3.11 rejects "Z" and more than six fractional digits
+        value = re.sub(r"(\.\d{6})\d+", r"\1", value.replace("Z", "+00:00"))
+        return datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        return None
+
+
+def prediction_phases(prediction: dict) -> dict[str, float]:
+    """Queue and run seconds of a prediction, from its Replicate timestamps"""
+    created = _parse_timestamp(prediction.get("created_at"))
+    started = _parse_timestamp(prediction.get("started_at"))
+    completed = _parse_timestamp(prediction.get("completed_at"))
+    phases = {}
+    if created is not None and started is not None:
+        phases["queue"] = max(started - created, 0.0)
+    if started is not None and completed is not None:
+        phases["run"] = max(completed - started, 0.0)
+    return phases
+
+
+def observe_prediction(model: str, prediction: dict) -> dict[str, float]:
+    """Record a finished prediction's queue / run time. Returns the phases in seconds."""
+    status = prediction.get("status", "unknown")
+    phases = prediction_phases(prediction)
+    for phase, seconds in phases.items():
+        prediction_duration.observe(seconds, model=model, phase=phase)
+    predictions_finished.inc(model=model, status=status)
+    logger.info(
+        "prediction model=%s id=%s status=%s queue_ms=%s run_ms=%s",
+        model, prediction.get("id"), status,
+        *(f"{phases[p] * 1000:.0f}" if p in phases else "-" for p in ("queue", "run"))
+    )
+    return phases
+
+
+# ============ REQUEST IDS ============
+
+def current_request_id() -> str:
+    return request_id_var.get()
+
+
+class RequestIdFilter(logging.Filter):
+    """Adds the current request id to every log record as %(request_id)s"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not hasattr(record, "request_id"):
+            record.request_id = request_id_var.get()
+        return True
+
+
+def configure_logging(level: str = LOG_LEVEL) -> None:
+    """Log to stderr with the request id on every line"""
+    handler = logging.StreamHandler()
+    handler.addFilter(RequestIdFilter())
+    handler.setFormatter(logging.Formatter(
+        "%(asctime)s %(levelname)s [%(request_id)s] %(name)s: %(message)s"
+    ))
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(level)
+    # One line per outbound Replicate call is too chatty outside DEBUG
+    logging.getLogger("httpx").setLevel(max(root.level, logging.WARNING))
+
+
+class RequestIdMiddleware:
+    """
+    ASGI middleware that binds a request id for the duration of each request,
+    echoes it in the X-Request-ID response header and records the request
+    duration by route. Pure ASGI so streaming responses are not buffered.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        incoming = dict(scope["headers"]).get(REQUEST_ID_HEADER.encode(), b"").decode("latin-1")
+        request_id = incoming if _VALID_REQUEST_ID.match(incoming) else uuid.uuid4().hex
+        token = request_id_var.set(request_id)
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_id(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = list(message.get("headers", []))
+                headers.append((REQUEST_ID_HEADER.encode(), request_id.encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            route = scope.get("route")
+            http_duration.observe(
+                time.perf_counter() - start,
+                method=scope["method"],
+                route=getattr(route, "path", "unmatched"),
+                status=str(status)
+            )
+            request_id_var.reset(token)
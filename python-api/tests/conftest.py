@@ -0,0 +1,31 @@
+"""
+Test settings, applied before the API modules read their environment: every
+Replicate call goes to the in-process fake (see fake_replicate.py) and state
+stays in memory.
+"""
+
+import os
+import sys
+
+import pytest
+
+os.environ.update(
+    REPLICATE_API_BASE="http://fake-replicate/v1",
+    REPLICATE_API_TOKEN="test-token",
+    REPLICATE_WEBHOOK_URL="",
+    REPLICATE_WEBHOOK_SECRET="",
+    STATE_BACKEND="memory",
+    PREDICTION_LEDGER_DB="",
+    LOCAL_ANALYSIS="0",
+    LOG_LEVEL="WARNING",
+)
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import resilience  # noqa: E402  (reads the environment above)
+
+
+@pytest.fixture(autouse=True)
+def fresh_breakers(monkeypatch):
+    # Failures in one test must not open a model's breaker for the next
+    monkeypatch.setattr(resilience, "_breakers", {})
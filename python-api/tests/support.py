@@ -0,0 +1,57 @@
+"""Helpers shared by the tests: the in-process fake Replicate and fresh inputs"""
+
+import uuid
+import base64
+
+import httpx
+
+import api
+from fake_replicate import create_fake_replicate
+
+# What the fake signs its webhook deliveries with (see the webhook-mode tests)
+WEBHOOK_SECRET = "whsec_" + base64.b64encode(b"test webhook signing key").decode()
+
+
+def new_image_url() -> str:
+    # A fresh URL per test, so the caches start cold
+    return f"https://example.com/{uuid.uuid4().hex}.jpg"
+
+
+def fake_replicate(**kwargs) -> httpx.AsyncClient:
+    """A client of a fake Replicate whose webhooks are delivered to the API app"""
+    fake = create_fake_replicate(**{
+        "queue_delay": 0.02, "run_time": 0.05, "webhook_transport": httpx.ASGITransport(app=api.app),
+        "webhook_secret": WEBHOOK_SECRET, **kwargs
+    })
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=fake), base_url="http://fake-replicate")
+
+
+async def fake_stats(client: httpx.AsyncClient) -> dict:
+    return (await client.get("/_stats")).json()["requests"]
+
+
+class Scripted:
+    """
+    A client whose POSTs get the given responses in turn (an exception is
+    raised instead of answered); the last one repeats. Counts the calls.
+    """
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.calls = 0
+        self.client = httpx.AsyncClient(transport=httpx.MockTransport(self._handle))
+
+    def _handle(self, request: httpx.Request) -> httpx.Response:
+        self.calls += 1
+        response = self.responses[min(self.calls, len(self.responses)) - 1]
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+
+def created(prediction_id: str = "p-1") -> httpx.Response:
+    return httpx.Response(201, json={"id": prediction_id, "status": "starting"})
+
+
+def throttled(retry_after: str = None) -> httpx.Response:
+    return httpx.Response(429, text="throttled", headers={"Retry-After": retry_after} if retry_after else {})
@@ -0,0 +1,67 @@
+"""
+BLIP-2 analysis against the fake Replicate server, in both completion modes
+(polling and webhook), uncached and then from the analysis cache.
+"""
+
+import asyncio
+
+import pytest
+
+import predictions
+from fake_replicate import FAKE_CAPTION
+from prompt_generator import analyze_kitchen_image
+from support import WEBHOOK_SECRET, fake_replicate, fake_stats, new_image_url
+
+
+@pytest.fixture(params=["polling", "webhook"])
+def completion_mode(request, monkeypatch):
+    if request.param == "webhook":
+        monkeypatch.setattr(predictions, "REPLICATE_WEBHOOK_URL", "http://api/webhooks/replicate")
+        monkeypatch.setattr(predictions, "REPLICATE_WEBHOOK_SECRET", WEBHOOK_SECRET)
+    return request.param
+
+
+def test_uncached_analysis_runs_blip2_then_serves_the_cache(completion_mode):
+    async def scenario():
+        image_url = new_image_url()
+        async with fake_replicate() as client:
+            analysis = await analyze_kitchen_image(image_url, client)
+            assert "fallback_reason" not in analysis
+            assert analysis["image_description"] == FAKE_CAPTION
+            first = await fake_stats(client)
+            assert first["predictions_create"] == 1
+            if completion_mode == "webhook":
+                # The webhook resolved the wait long before the safety poll
+                assert first["webhooks_sent"] == 1
+                assert "predictions_get" not in first
+            else:
+                assert first["predictions_get"] >= 1
+
+            cached = await analyze_kitchen_image(image_url, client)
+            assert cached == analysis
+            assert await fake_stats(client) == first
+
+    asyncio.run(scenario())
+
+
+def test_concurrent_analyses_share_one_prediction(completion_mode):
+    async def scenario():
+        image_url = new_image_url()
+        async with fake_replicate() as client:
+            results = await asyncio.gather(*[analyze_kitchen_image(image_url, client) for _ in range(5)])
+            assert all(result == results[0] for result in results)
+            assert (await fake_stats(client))["predictions_create"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_failed_prediction_falls_back_and_is_not_cached(completion_mode):
+    async def scenario():
+        image_url = new_image_url()
+        async with fake_replicate(failure_rate=1.0) as client:
+            analysis = await analyze_kitchen_image(image_url, client)
+            assert analysis["fallback_reason"] == "error"
+            await analyze_kitchen_image(image_url, client)
+            assert (await fake_stats(client))["predictions_create"] == 2
+
+    asyncio.run(scenario())
@@ -0,0 +1,136 @@
+"""
+Predictions nobody waits for any more are cancelled on Replicate: the
+client disconnecting, the request deadline cutting the wait short, and a
+shared render whose last waiter leaves.
+"""
+
+import asyncio
+
+import pytest
+
+import predictions
+import progress
+from cache import SingleFlight
+from progress import ClientDisconnected, until_disconnected
+from resilience import deadline
+from support import fake_replicate, fake_stats
+
+BODY = {"version": "v", "input": {"prompt": "a kitchen"}}
+
+# Long enough that every prediction is still queued when it is given up on
+SLOW = {"queue_delay": 1.0, "run_time": 0.05}
+
+
+@pytest.fixture(autouse=True)
+def quick_disconnect_checks(monkeypatch):
+    monkeypatch.setattr(progress, "DISCONNECT_CHECK_INTERVAL", 0.01)
+
+
+async def fake_statuses(client) -> dict:
+    return (await client.get("/_stats")).json()["predictions"]
+
+
+async def settle() -> None:
+    """Let the background cancel requests reach the fake"""
+    await asyncio.gather(*predictions._cancellations)
+
+
+def canceled(reason: str) -> int:
+    return predictions.cancellations.reasons.get(reason, 0)
+
+
+def test_cancelling_the_wait_cancels_the_prediction():
+    async def scenario():
+        async with fake_replicate(**SLOW) as client:
+            task = asyncio.create_task(predictions.run_prediction(client, BODY, "token", 30, "blip2"))
+            await asyncio.sleep(0.1)
+            task.cancel("client_disconnected")
+            with pytest.raises(asyncio.CancelledError):
+                await task
+            await settle()
+            return await fake_stats(client), await fake_statuses(client)
+
+    before = canceled("client_disconnected")
+    stats, statuses = asyncio.run(scenario())
+    assert stats["predictions_cancel"] == 1
+    assert statuses == {"canceled": 1}
+    assert canceled("client_disconnected") == before + 1
+
+
+def test_client_disconnect_cancels_the_pipeline():
+    async def scenario():
+        async with fake_replicate(**SLOW) as client:
+            loop = asyncio.get_running_loop()
+            gone_at = loop.time() + 0.1
+
+            async def disconnected() -> bool:
+                return loop.time() >= gone_at
+
+            with pytest.raises(ClientDisconnected):
+                await until_disconnected(
+                    lambda: predictions.run_prediction(client, BODY, "token", 30, "blip2"), disconnected
+                )
+            await settle()
+            return await fake_stats(client), await fake_statuses(client)
+
+    stats, statuses = asyncio.run(scenario())
+    assert stats["predictions_cancel"] == 1
+    assert statuses == {"canceled": 1}
+
+
+def test_deadline_cut_wait_cancels_with_reason_deadline():
+    async def scenario():
+        async with fake_replicate(**SLOW) as client:
+            with deadline(0.2):
+                result = await predictions.run_prediction(client, BODY, "token", 30, "blip2")
+            await settle()
+            return result, await fake_stats(client), await fake_statuses(client)
+
+    before = canceled("deadline")
+    result, stats, statuses = asyncio.run(scenario())
+    assert result["status"] == "starting"
+    assert stats["predictions_cancel"] == 1
+    assert statuses == {"canceled": 1}
+    assert canceled("deadline") == before + 1
+
+
+def test_finished_prediction_is_not_cancelled():
+    async def scenario():
+        async with fake_replicate() as client:
+            task = asyncio.create_task(predictions.run_prediction(client, BODY, "token", 30, "blip2"))
+            result = await task
+            task.cancel("client_disconnected")
+            await settle()
+            return result, await fake_stats(client)
+
+    result, stats = asyncio.run(scenario())
+    assert result["status"] == "succeeded"
+    assert stats.get("predictions_cancel", 0) == 0
+
+
+def test_shared_render_is_cancelled_only_when_its_last_waiter_leaves():
+    async def scenario():
+        flight = SingleFlight(cancel_orphans=True)
+        async with fake_replicate(**SLOW) as client:
+            def render():
+                return flight.do("render", lambda: predictions.run_prediction(client, BODY, "token", 30, "blip2"))
+
+            first, second = asyncio.create_task(render()), asyncio.create_task(render())
+            await asyncio.sleep(0.1)
+
+            first.cancel("client_disconnected")
+            await asyncio.gather(first, return_exceptions=True)
+            await asyncio.sleep(0.05)
+            still_running = await fake_statuses(client)
+
+            second.cancel("client_disconnected")
+            await asyncio.gather(second, return_exceptions=True)
+            await settle()
+            return still_running, await fake_stats(client), await fake_statuses(client), flight
+
+    still_running, stats, statuses, flight = asyncio.run(scenario())
+    assert still_running == {"starting": 1}
+    assert stats["predictions_create"] == 1
+    assert stats["predictions_cancel"] == 1
+    assert statuses == {"canceled": 1}
+    assert flight.stats()["orphaned"] == 1
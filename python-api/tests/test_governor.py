@@ -0,0 +1,188 @@
+"""
+Outbound governor: the FIFO token bucket, the fair in-flight limiter and
+the 429 handling of create_prediction_governed, which must not wait past
+the request deadline.
+"""
+
+import time
+import asyncio
+
+import pytest
+
+import predictions
+import resilience
+from governor import FairLimiter, Governor, GovernorTimeout, TokenBucket
+from support import Scripted, created, throttled
+
+
+def test_bucket_allows_the_burst_then_the_rate():
+    async def scenario():
+        bucket = TokenBucket(rate=20, burst=3)
+        start = time.monotonic()
+        for _ in range(3):
+            await bucket.acquire()
+        burst = time.monotonic() - start
+        await bucket.acquire()
+        return burst, time.monotonic() - start
+
+    burst, total = asyncio.run(scenario())
+    assert burst < 0.02
+    assert 0.04 <= total < 0.2
+
+
+def test_bucket_serves_waiters_in_arrival_order():
+    async def scenario():
+        bucket = TokenBucket(rate=100, burst=1)
+        order = []
+
+        async def take(n):
+            await bucket.acquire()
+            order.append(n)
+
+        await asyncio.gather(*[take(n) for n in range(6)])
+        return order
+
+    assert asyncio.run(scenario()) == list(range(6))
+
+
+def test_pause_holds_creations_and_drops_the_burst():
+    async def scenario():
+        bucket = TokenBucket(rate=1000, burst=5)
+        bucket.pause(0.1)
+        assert bucket.tokens == 0
+        start = time.monotonic()
+        await bucket.acquire()
+        return time.monotonic() - start
+
+    assert 0.09 <= asyncio.run(scenario()) < 0.3
+
+
+def test_zero_rate_disables_the_bucket():
+    async def scenario():
+        bucket = TokenBucket(rate=0, burst=1)
+        for _ in range(100):
+            await bucket.acquire()
+
+    asyncio.run(asyncio.wait_for(scenario(), 1))
+
+
+def test_limiter_admits_waiters_in_arrival_order():
+    async def scenario():
+        limiter = FairLimiter(2)
+        await limiter.acquire()
+        await limiter.acquire()
+        order = []
+
+        async def wait(n):
+            await limiter.acquire()
+            order.append(n)
+
+        waiters = [asyncio.create_task(wait(n)) for n in range(3)]
+        await asyncio.sleep(0)
+        assert limiter.waiting == 3 and order == []
+
+        limiter.release()
+        await asyncio.sleep(0)
+        # The slot went straight to the oldest waiter; a newcomer cannot barge in
+        assert order == [0] and limiter.in_flight == 2
+        late = asyncio.create_task(wait("late"))
+        limiter.release()
+        limiter.release()
+        await asyncio.sleep(0)
+        assert order == [0, 1, 2]
+        limiter.release()
+        await asyncio.gather(*waiters, late)
+        assert order == [0, 1, 2, "late"]
+        for _ in range(2):
+            limiter.release()
+        assert limiter.in_flight == 0
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_waiter_gives_up_its_place_or_its_slot():
+    async def scenario():
+        limiter = FairLimiter(1)
+        await limiter.acquire()
+        first = asyncio.create_task(limiter.acquire())
+        second = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0)
+
+        # Cancelled while queued: leaves the queue
+        second.cancel()
+        await asyncio.gather(second, return_exceptions=True)
+        assert limiter.waiting == 1
+
+        # Handed the slot but cancelled before running: passes it on
+        limiter.release()
+        first.cancel()
+        await asyncio.gather(first, return_exceptions=True)
+        assert limiter.in_flight == 0 and limiter.waiting == 0
+
+    asyncio.run(scenario())
+
+
+def test_governor_gives_up_after_the_queue_timeout():
+    async def scenario():
+        governor = Governor(create_rate=0, max_in_flight=1, queue_timeout=0.05)
+        async with governor.slot("blip2"):
+            with pytest.raises(GovernorTimeout) as err:
+                async with governor.slot("blip2"):
+                    pass
+        assert err.value.retry_after == 0.05
+        assert governor.stats()["models"]["blip2"] == {"limit": 1, "in_flight": 0, "waiting": 0}
+
+    asyncio.run(scenario())
+
+
+@pytest.fixture
+def fresh_governor(monkeypatch):
+    governor = Governor(create_rate=1000, create_burst=10, max_in_flight=8)
+    monkeypatch.setattr(predictions, "governor", governor)
+    return governor
+
+
+def create(replicate: Scripted) -> dict:
+    return predictions.create_prediction_governed(replicate.client, {"model": "m"}, "token", "m")
+
+
+def test_429_pauses_and_retries(fresh_governor):
+    replicate = Scripted(throttled("0.1"), throttled("0.1"), created())
+
+    async def scenario():
+        start = time.monotonic()
+        prediction = await create(replicate)
+        return prediction, time.monotonic() - start
+
+    prediction, seconds = asyncio.run(scenario())
+    assert prediction["id"] == "p-1"
+    assert replicate.calls == 3
+    assert seconds >= 0.2
+
+
+@pytest.mark.parametrize("retry_after, calls", [
+    ("0.01", predictions.REPLICATE_MAX_429_RETRIES + 1),
+    (str(predictions.REPLICATE_MAX_RETRY_AFTER + 1), 1),
+])
+def test_429_gives_up_with_rate_limited(fresh_governor, retry_after, calls):
+    replicate = Scripted(throttled(retry_after))
+    with pytest.raises(predictions.RateLimitedError) as err:
+        asyncio.run(create(replicate))
+    assert err.value.status_code == 429
+    assert replicate.calls == calls
+
+
+def test_429_does_not_wait_past_the_deadline(fresh_governor):
+    replicate = Scripted(throttled("2"), created())
+
+    async def scenario():
+        with resilience.deadline(0.5):
+            start = time.monotonic()
+            with pytest.raises(predictions.RateLimitedError) as err:
+                await create(replicate)
+            return err.value, time.monotonic() - start
+
+    err, seconds = asyncio.run(scenario())
+    assert seconds < 0.1
+    assert err.retry_after == 2
+    assert replicate.calls == 1
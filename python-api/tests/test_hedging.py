@@ -0,0 +1,144 @@
+"""
+Hedged renders against the fake Replicate: the hedge budget, a backup for a
+slow-starting primary, the loser cancelled as hedge_lost, and both
+predictions cancelled when the render is abandoned.
+"""
+
+import asyncio
+
+import pytest
+
+import hedging
+import predictions
+from hedging import HedgePolicy, hedged
+from support import fake_replicate, fake_stats
+
+BODY = {"model": "google/nano-banana", "input": {"prompt": "a kitchen", "output_format": "jpg"}}
+
+
+@pytest.fixture(autouse=True)
+def quick_hedges(monkeypatch):
+    monkeypatch.setattr(hedging, "policy", HedgePolicy())
+    monkeypatch.setattr(hedging, "HEDGE_DEFAULT_DELAY", 0.1)
+    monkeypatch.setattr(hedging, "HEDGE_MIN_DELAY", 0.05)
+    monkeypatch.setattr(predictions, "POLL_INITIAL_DELAY", 0.02)
+
+
+def queue_delays(*delays: float):
+    """Queue time of each prediction the fake creates, in turn; the last one repeats"""
+    remaining = list(delays)
+    return lambda: remaining.pop(0) if len(remaining) > 1 else remaining[0]
+
+
+def render(client):
+    def run(on_start=None, reuse=True):
+        return predictions.run_prediction(
+            client, BODY, "token", timeout=30, model="nano_banana", on_start=on_start, reuse=reuse
+        )
+    return run
+
+
+async def fake_statuses(client) -> dict:
+    return (await client.get("/_stats")).json()["predictions"]
+
+
+async def settle() -> None:
+    """Let the cancelled losers and their background cancel requests reach the fake"""
+    await asyncio.sleep(0.05)
+    await asyncio.gather(*predictions._cancellations)
+
+
+def canceled(reason: str) -> int:
+    return predictions.cancellations.reasons.get(reason, 0)
+
+
+def test_budget_allows_about_its_share_of_hedges(monkeypatch):
+    monkeypatch.setattr(hedging, "HEDGE_BUDGET", 0.5)
+    monkeypatch.setattr(hedging, "HEDGE_BUDGET_BURST", 1.0)
+    policy = HedgePolicy()
+
+    assert policy.spend()
+    assert not policy.spend()
+    policy.earn()
+    assert not policy.spend()
+    policy.earn()
+    assert policy.spend()
+    policy.earn()
+    policy.earn()
+    policy.earn()
+    assert policy.tokens == 1.0
+    assert (policy.hedged, policy.denied) == (2, 2)
+
+
+def test_threshold_uses_the_default_until_enough_samples(monkeypatch):
+    monkeypatch.setattr(hedging, "HEDGE_MIN_SAMPLES", 4)
+    policy = HedgePolicy()
+    assert policy.threshold() == 0.1
+
+    policy.queue_times.extend([0.01, 0.01, 0.01])
+    assert policy.threshold() == 0.1
+    policy.queue_times.append(0.01)
+    assert policy.threshold() == 0.05
+    policy.queue_times.extend([3.0] * 10)
+    assert policy.threshold() == 3.0
+
+
+def test_fast_primary_gets_no_backup():
+    async def scenario():
+        async with fake_replicate(queue_delay=0.02) as client:
+            result = await hedged(render(client))
+            return result, await fake_stats(client)
+
+    result, stats = asyncio.run(scenario())
+    assert result["status"] == "succeeded"
+    assert stats["predictions_create"] == 1
+    assert hedging.policy.hedged == 0
+
+
+def test_slow_primary_loses_to_its_backup_and_is_cancelled():
+    async def scenario():
+        async with fake_replicate(queue_delay=queue_delays(1.0, 0.02)) as client:
+            result = await hedged(render(client))
+            await settle()
+            return result, await fake_stats(client), await fake_statuses(client)
+
+    before = canceled("hedge_lost")
+    result, stats, statuses = asyncio.run(scenario())
+    assert result["status"] == "succeeded"
+    assert stats["predictions_create"] == 2
+    assert stats["predictions_cancel"] == 1
+    assert statuses == {"succeeded": 1, "canceled": 1}
+    assert canceled("hedge_lost") == before + 1
+    assert (hedging.policy.hedged, hedging.policy.backup_wins) == (1, 1)
+
+
+def test_no_backup_over_budget():
+    async def scenario():
+        hedging.policy.tokens = 0.0
+        async with fake_replicate(queue_delay=0.3) as client:
+            result = await hedged(render(client))
+            return result, await fake_stats(client)
+
+    result, stats = asyncio.run(scenario())
+    assert result["status"] == "succeeded"
+    assert stats["predictions_create"] == 1
+    assert (hedging.policy.hedged, hedging.policy.denied) == (0, 1)
+
+
+def test_abandoned_render_cancels_both_predictions():
+    async def scenario():
+        async with fake_replicate(queue_delay=1.0) as client:
+            task = asyncio.create_task(hedged(render(client)))
+            await asyncio.sleep(0.3)
+            task.cancel("client_disconnected")
+            with pytest.raises(asyncio.CancelledError):
+                await task
+            await settle()
+            return await fake_stats(client), await fake_statuses(client)
+
+    before = canceled("client_disconnected")
+    stats, statuses = asyncio.run(scenario())
+    assert stats["predictions_create"] == 2
+    assert stats["predictions_cancel"] == 2
+    assert statuses == {"canceled": 2}
+    assert canceled("client_disconnected") == before + 2
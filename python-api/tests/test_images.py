@@ -0,0 +1,138 @@
+"""
+GET /images/{id}: width snapping, format negotiation, ETag / 304 and the
+bounded local store.
+"""
+
+import io
+import os
+import asyncio
+
+import httpx
+import pytest
+
+Image = pytest.importorskip("PIL.Image")
+
+import api  # noqa: E402
+import images  # noqa: E402
+from support import new_image_url  # noqa: E402
+
+
+def jpeg(width: int = 1536, height: int = 1152) -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", (width, height), (180, 160, 140)).save(buffer, "JPEG")
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def proxy(tmp_path, monkeypatch):
+    """The images module with a temporary store and renders served from memory"""
+    render = jpeg()
+    renders = httpx.AsyncClient(transport=httpx.MockTransport(lambda request: httpx.Response(200, content=render)))
+    monkeypatch.setattr(images, "get_http_client", lambda: renders)
+    monkeypatch.setattr(images, "store", images.LocalImageStore(str(tmp_path)))
+    return images
+
+
+def get(proxy_path: str, **headers) -> httpx.Response:
+    async def request():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=api.app), base_url="http://api") as client:
+            return await client.get(proxy_path, headers=headers)
+
+    return asyncio.run(request())
+
+
+def registered() -> str:
+    async def register():
+        key = await images.remember(new_image_url())
+        await asyncio.gather(*images._prefetches)
+        return key
+
+    return f"/images/{asyncio.run(register())}"
+
+
+@pytest.mark.parametrize("requested, snapped", [
+    (None, None), (1, 320), (320, 320), (321, 640), (700, 828), (1600, 1600), (5000, 1600),
+])
+def test_widths_snap_to_the_configured_sizes(requested, snapped):
+    assert images.snap_width(requested) == snapped
+
+
+@pytest.mark.parametrize("requested, accept, expected", [
+    (None, "image/avif,image/webp,*/*", ("avif", True)),
+    (None, "image/webp,*/*", ("webp", True)),
+    (None, "*/*", ("jpeg", True)),
+    (None, "", ("jpeg", True)),
+    ("jpg", "image/webp", ("jpeg", False)),
+    ("WEBP", "", ("webp", False)),
+])
+def test_format_negotiation(monkeypatch, requested, accept, expected):
+    monkeypatch.setattr(images, "avif_available", lambda: True)
+    assert images.negotiate_format(requested, accept) == expected
+
+
+def test_unknown_format_is_refused():
+    with pytest.raises(ValueError):
+        images.negotiate_format("bmp", "")
+
+
+@pytest.mark.parametrize("header, matches", [
+    ('"abc-640-webp"', True),
+    ('W/"abc-640-webp"', True),
+    ('"other", "abc-640-webp"', True),
+    ('"other",W/"abc-640-webp"', True),
+    ("*", True),
+    ('"abc-640"', False),
+    ('"abc-640-webp-x"', False),
+    ('"x-abc-640-webp"', False),
+    ("", False),
+])
+def test_if_none_match_compares_whole_tags(header, matches):
+    assert images.etag_matches(header, '"abc-640-webp"') is matches
+
+
+def test_variant_is_resized_encoded_and_revalidated(proxy):
+    path = registered()
+    response = get(f"{path}?w=500", accept="image/webp,*/*")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "image/webp"
+    assert "Accept" in response.headers["vary"]
+    assert Image.open(io.BytesIO(response.content)).width == 640
+    tag = response.headers["etag"]
+
+    for header in (tag, f"W/{tag}", f'"stale", {tag}', "*"):
+        assert get(f"{path}?w=500", accept="image/webp", **{"if-none-match": header}).status_code == 304
+    # A tag that merely contains this one is a different variant
+    assert get(f"{path}?w=500", accept="image/webp", **{"if-none-match": tag[:-1] + '0"'}).status_code == 200
+    # Another width or format is another variant with its own tag
+    other = get(f"{path}?w=1000&format=jpeg", **{"if-none-match": tag})
+    assert other.status_code == 200
+    assert other.headers["content-type"] == "image/jpeg"
+    assert Image.open(io.BytesIO(other.content)).width == 1080
+
+
+def test_missing_original_without_pillow_is_not_found(proxy, monkeypatch):
+    path = registered()
+    monkeypatch.setattr(images, "Image", None)
+    assert get(path).headers["content-type"] == "image/jpeg"
+
+    for root, _, names in os.walk(proxy.store.directory):
+        for name in names:
+            os.remove(os.path.join(root, name))
+    assert get(path).status_code == 404
+
+
+def test_local_store_evicts_the_least_recently_used(tmp_path):
+    store = images.LocalImageStore(str(tmp_path), max_bytes=1000)
+
+    async def scenario():
+        for n in range(3):
+            await store.put(f"d{n}/original", b"x" * 300)
+            os.utime(store._path(f"d{n}/original"), (n, n))
+        assert await store.get("d0/original") is not None  # now the most recent
+        await store.put("d3/original", b"x" * 300)
+        return [await store.get(f"d{n}/original") is not None for n in range(4)]
+
+    assert asyncio.run(scenario()) == [True, False, True, True]
+    assert store.evicted == 1
+    assert store.used <= 1000
+    assert not os.path.exists(tmp_path / "d1")
@@ -0,0 +1,66 @@
+"""
+Upload size limits: the request body limit (Content-Length or streamed)
+and the per-file limit of read_upload.
+"""
+
+import io
+import asyncio
+
+import httpx
+import pytest
+from fastapi import HTTPException, UploadFile
+
+import api
+import ingest
+
+LIMIT = 64 * 1024
+
+
+def post(path: str, **kwargs) -> httpx.Response:
+    """POST to the API behind a BodyLimitMiddleware with a small limit"""
+    app = ingest.BodyLimitMiddleware(api.app, max_bytes=LIMIT)
+
+    async def request():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://api") as client:
+            return await client.post(path, **kwargs)
+
+    return asyncio.run(request())
+
+
+def test_content_length_over_the_limit_is_refused_up_front():
+    before = ingest.stats.rejected_requests
+    response = post("/visualize/upload", files={"file": ("k.jpg", b"x" * 2 * LIMIT, "image/jpeg")})
+    assert response.status_code == 413
+    assert ingest.stats.rejected_requests == before + 1
+
+
+@pytest.mark.parametrize("path", ["/visualize/upload", "/webhooks/replicate"])
+def test_streamed_body_over_the_limit_is_refused(path):
+    sent = []
+
+    async def chunks():
+        yield b'--x\r\nContent-Disposition: form-data; name="file"; filename="k.jpg"\r\n\r\n'
+        for _ in range(20):
+            sent.append(1)
+            yield b"x" * (LIMIT // 4)
+
+    response = post(path, content=chunks(), headers={"Content-Type": "multipart/form-data; boundary=x"})
+    assert response.status_code == 413
+    # Refused once past the limit, not after the whole body
+    assert len(sent) < 20
+
+
+def test_body_under_the_limit_passes():
+    assert post("/webhooks/replicate", content=b"{}").status_code == 401
+
+
+@pytest.mark.parametrize("size, accepted", [(1000, True), (1024, True), (1025, False)])
+def test_read_upload_enforces_the_file_limit(size, accepted):
+    upload = UploadFile(io.BytesIO(b"x" * size), filename="k.jpg")
+    if accepted:
+        assert len(asyncio.run(ingest.read_upload(upload, max_bytes=1024))) == size
+    else:
+        with pytest.raises(HTTPException) as err:
+            asyncio.run(ingest.read_upload(upload, max_bytes=1024))
+        assert err.value.status_code == 413
+    assert ingest.stats.buffered_bytes == 0
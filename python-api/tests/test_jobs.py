@@ -0,0 +1,169 @@
+"""
+Job mode: POST /jobs/visualize queues a job, GET /jobs/{id} reports its
+stage and result, and a full queue answers 429.
+"""
+
+import asyncio
+from contextlib import asynccontextmanager
+
+import httpx
+import pytest
+
+import api
+import http_client
+from jobs import JobQueue
+from support import fake_replicate, fake_stats, new_image_url
+
+OPTIONS = dict(door_style="shaker", color_hex="#ffffff", color_name="White", hardware_style="loft",
+               hardware_finish="gold", name="Jo", phone="555-0100")
+
+
+@asynccontextmanager
+async def jobs_api(monkeypatch, workers: int = 1, maxsize: int = 8):
+    """An API client with its own started job queue"""
+    queue = JobQueue(workers=workers, maxsize=maxsize)
+    monkeypatch.setattr(api, "job_queue", queue)
+    await queue.start()
+    try:
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=api.app), base_url="http://api") as client:
+            yield client
+    finally:
+        await queue.stop()
+
+
+class Pipeline:
+    """Stands in for run_visualization_pipeline, advancing one stage per step()"""
+
+    def __init__(self, fail: bool = False):
+        self.fail = fail
+        self.gates: list[asyncio.Event] = []
+
+    async def __call__(self, on_stage, **kwargs):
+        gate = asyncio.Event()
+        self.gates.append(gate)
+        on_stage("analyzing")
+        await gate.wait()
+        gate.clear()
+        on_stage("rendering")
+        await gate.wait()
+        if self.fail:
+            raise RuntimeError("render failed")
+        return {"final_url": "https://example.com/render.jpg"}
+
+    async def started(self, job: int = 0) -> None:
+        while len(self.gates) <= job:
+            await asyncio.sleep(0.005)
+
+    async def step(self, job: int = 0) -> None:
+        await self.started(job)
+        self.gates[job].set()
+        await asyncio.sleep(0.01)
+
+
+def submit(client: httpx.AsyncClient, image_url: str = "https://example.com/k.jpg"):
+    return client.post("/jobs/visualize", json={"image_url": image_url, **OPTIONS})
+
+
+async def status(client: httpx.AsyncClient, job_id: str) -> dict:
+    return (await client.get(f"/jobs/{job_id}")).json()
+
+
+def test_job_moves_through_its_stages_to_a_result(monkeypatch):
+    pipeline = Pipeline()
+    monkeypatch.setattr(api, "run_visualization_pipeline", pipeline)
+
+    async def scenario():
+        async with jobs_api(monkeypatch) as client:
+            accepted = await submit(client)
+            assert accepted.status_code == 202
+            job_id = accepted.json()["job_id"]
+            assert accepted.json()["status_url"] == f"/jobs/{job_id}"
+
+            await pipeline.started()
+            seen = [(await status(client, job_id))["status"]]
+            for _ in range(2):
+                await pipeline.step()
+                seen.append((await status(client, job_id))["status"])
+            assert seen == ["analyzing", "rendering", "succeeded"]
+
+            job = await status(client, job_id)
+            assert job["result"] == {"success": True, "final_url": "https://example.com/render.jpg"}
+            assert job["error"] is None
+            assert job["created_at"] <= job["started_at"] <= job["finished_at"]
+
+            events = (await client.get(f"/jobs/{job_id}/events")).text
+            stages = [line.split(": ", 1)[1] for line in events.splitlines() if line.startswith("event:")]
+            assert stages == ["queued", "analyzing", "rendering", "succeeded"]
+
+    asyncio.run(scenario())
+
+
+def test_failed_job_reports_its_error(monkeypatch):
+    pipeline = Pipeline(fail=True)
+    monkeypatch.setattr(api, "run_visualization_pipeline", pipeline)
+
+    async def scenario():
+        async with jobs_api(monkeypatch) as client:
+            job_id = (await submit(client)).json()["job_id"]
+            await pipeline.step()
+            await pipeline.step()
+            job = await status(client, job_id)
+            assert job["status"] == "failed"
+            assert job["error"] == "render failed"
+            assert job["result"] is None
+
+    asyncio.run(scenario())
+
+
+def test_full_queue_answers_429(monkeypatch):
+    pipeline = Pipeline()
+    monkeypatch.setattr(api, "run_visualization_pipeline", pipeline)
+
+    async def scenario():
+        async with jobs_api(monkeypatch, workers=1, maxsize=2) as client:
+            running = (await submit(client)).json()["job_id"]
+            await pipeline.step()  # the worker has taken the first job, now rendering
+            queued = [(await submit(client)).json()["job_id"] for _ in range(2)]
+            assert [(await status(client, job_id))["status"] for job_id in queued] == ["queued", "queued"]
+
+            refused = await submit(client)
+            assert refused.status_code == 429
+            assert refused.headers["retry-after"] == "5"
+            assert api.job_queue.stats()["rejected"] == 1
+
+            # Once the running job finishes a slot frees up
+            await pipeline.step()
+            assert (await status(client, running))["status"] == "succeeded"
+            assert (await submit(client)).status_code == 202
+
+    asyncio.run(scenario())
+
+
+def test_unknown_job_is_404(monkeypatch):
+    async def scenario():
+        async with jobs_api(monkeypatch) as client:
+            assert (await client.get("/jobs/0123456789abcdef")).status_code == 404
+            assert (await client.get("/jobs/0123456789abcdef/events")).status_code == 404
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.parametrize("skip_analysis", [False, True])
+def test_job_renders_through_replicate(monkeypatch, skip_analysis):
+    async def scenario():
+        async with fake_replicate() as replicate, jobs_api(monkeypatch) as client:
+            monkeypatch.setattr(http_client, "_client", replicate)
+            job_id = (await client.post("/jobs/visualize", json={
+                "image_url": new_image_url(), "skip_analysis": skip_analysis, **OPTIONS
+            })).json()["job_id"]
+            for _ in range(200):
+                job = await status(client, job_id)
+                if job["status"] in ("succeeded", "failed"):
+                    break
+                await asyncio.sleep(0.02)
+            assert job["status"] == "succeeded", job["error"]
+            assert job["result"]["final_url"].startswith("http://fake-replicate/delivery/")
+            stats = await fake_stats(replicate)
+            assert stats["predictions_create"] == (1 if skip_analysis else 2)
+
+    asyncio.run(scenario())
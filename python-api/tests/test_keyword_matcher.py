@@ -0,0 +1,126 @@
+"""
+Caption keyword matching, with both engines: word boundaries, stems,
+multi-word keywords, choice precedence and the shipped keyword table.
+"""
+
+import json
+
+import pytest
+
+import keyword_matcher
+from keyword_matcher import KeywordMatcher
+
+TABLE = {
+    "flags": {
+        "has_arched_doors": ["arch", "arched", "raised panel*"],
+        "drawers_missing": ["no drawer*", "missing"],
+        "warped_perspective": ["warp*", "fish-eye"],
+    },
+    "choices": {
+        "lighting": {"default": "neutral", "options": {"warm": ["warm*"], "cool": ["cool*"]}},
+    },
+}
+
+
+@pytest.fixture(params=["regex", "aho-corasick"])
+def engine(request, monkeypatch):
+    if request.param == "regex":
+        monkeypatch.setattr(keyword_matcher, "ahocorasick", None)
+    else:
+        pytest.importorskip("ahocorasick")
+    return request.param
+
+
+@pytest.fixture
+def matcher(engine):
+    built = KeywordMatcher(TABLE)
+    assert built.engine == engine
+    return built
+
+
+@pytest.mark.parametrize("caption, arched", [
+    ("a kitchen with an arch over the range", True),
+    ("Arch doors.", True),
+    ("arched cabinet doors", True),
+    ("search the archive", False),
+    ("an archway into the dining room", False),
+    ("monarch butterfly magnet", False),
+    ("arch_way", False),
+])
+def test_whole_words_need_boundaries_on_both_sides(matcher, caption, arched):
+    assert matcher.match(caption)["has_arched_doors"] is arched
+
+
+@pytest.mark.parametrize("caption, warped", [
+    ("a warped photo", True),
+    ("WARPING near the edges", True),
+    ("shot with a fish-eye lens", True),
+    ("a lukewarp effect", False),
+    ("fish eye", False),
+])
+def test_stems_match_word_prefixes_only(matcher, caption, warped):
+    assert matcher.match(caption)["warped_perspective"] is warped
+
+
+@pytest.mark.parametrize("caption, field", [
+    ("cabinets with raised panels", "has_arched_doors"),
+    ("a raised panel door", "has_arched_doors"),
+    ("there are no drawers below the sink", "drawers_missing"),
+    ("no drawer fronts", "drawers_missing"),
+])
+def test_multi_word_keywords(matcher, caption, field):
+    assert matcher.match(caption)[field] is True
+
+
+@pytest.mark.parametrize("caption", ["raised", "a panel raised high", "no  drawers", "nodrawers"])
+def test_multi_word_keywords_need_every_word_in_order(matcher, caption):
+    result = matcher.match(caption)
+    assert not result["has_arched_doors"] and not result["drawers_missing"]
+
+
+@pytest.mark.parametrize("caption, lighting", [
+    ("a bright kitchen", "neutral"),
+    ("cool daylight", "cool"),
+    ("warm and cool light", "warm"),
+    ("cool then warmer light", "warm"),
+])
+def test_choices_default_and_follow_precedence(matcher, caption, lighting):
+    assert matcher.match(caption)["lighting"] == lighting
+
+
+def test_unmatched_caption_gives_the_defaults(matcher):
+    assert matcher.match("") == {
+        "has_arched_doors": False, "drawers_missing": False, "warped_perspective": False, "lighting": "neutral",
+    }
+
+
+@pytest.mark.parametrize("table, message", [
+    ({}, "empty"),
+    ({"flags": {"a": ["-dash"]}}, "must start with a letter or digit"),
+    ({"flags": {"a": ["same"], "b": ["same"]}}, "mapped to both"),
+])
+def test_invalid_tables_are_refused(table, message):
+    with pytest.raises(ValueError, match=message):
+        KeywordMatcher(table)
+
+
+def test_keyword_table_loads_from_a_file(tmp_path, engine):
+    path = tmp_path / "keywords.json"
+    path.write_text(json.dumps(TABLE), encoding="utf-8")
+    assert KeywordMatcher.from_file(str(path)).match("arched and warm") == {
+        "has_arched_doors": True, "drawers_missing": False, "warped_perspective": False, "lighting": "warm",
+    }
+
+
+@pytest.mark.parametrize("caption, expected", [
+    ("a kitchen with white raised panel cabinets and warm lighting, photo taken from an angle",
+     dict(has_arched_doors=True, lighting="warm", is_angled_photo=True)),
+    ("search the archive for a messy corner shot, slightly distorted, cool tones",
+     dict(needs_cleanup=True, is_angled_photo=True, warped_perspective=True, lighting="cool")),
+    ("empty cabinet with painter's tape", dict(drawers_missing=True, needs_cleanup=True)),
+])
+def test_shipped_table(engine, caption, expected):
+    defaults = dict(drawers_missing=False, is_angled_photo=False, has_arched_doors=False,
+                    needs_cleanup=False, warped_perspective=False, lighting="neutral")
+    matcher = KeywordMatcher.from_file(keyword_matcher.DEFAULT_KEYWORDS_PATH)
+    assert matcher.match(caption) == {**defaults, **expected}
@@ -0,0 +1,130 @@
+"""
+Prediction ledger: what is stored, reuse of a recorded result, reattaching
+to predictions an earlier process left running, and shutdown behaviour.
+"""
+
+import asyncio
+import sqlite3
+import time
+
+import pytest
+
+import predictions
+from ledger import Entry, PredictionLedger
+from support import fake_replicate
+
+BODY = {"version": "v", "input": {"image": "data:image/jpeg;base64,/9j/4AAQSkZJRgABAQ", "prompt": "describe"}}
+
+
+@pytest.fixture
+def ledger(tmp_path, monkeypatch):
+    recorded = PredictionLedger(str(tmp_path / "ledger.db"), ttl=3000)
+    monkeypatch.setattr(predictions, "ledger", recorded)
+    return recorded
+
+
+def rows(ledger: PredictionLedger) -> list[dict]:
+    conn = sqlite3.connect(ledger.path)
+    conn.row_factory = sqlite3.Row
+    try:
+        return [dict(row) for row in conn.execute("SELECT * FROM predictions ORDER BY seq")]
+    finally:
+        conn.close()
+
+
+async def fake_statuses(client) -> dict:
+    return (await client.get("/_stats")).json()["predictions"]
+
+
+def test_ledger_is_off_without_a_path():
+    assert not PredictionLedger("", ttl=3000).enabled
+
+
+def test_only_id_status_key_and_output_are_stored(ledger):
+    prediction = {
+        "id": "p-1", "status": "succeeded", "input": BODY["input"], "output": "a kitchen",
+        "logs": "100%|##########|", "urls": {"cancel": "https://api.replicate.com/v1/predictions/p-1/cancel"},
+    }
+    asyncio.run(ledger.record(Entry("render:abc", "blip2", prediction, time.time())))
+
+    [row] = rows(ledger)
+    assert set(row) == {"seq", "key", "prediction_id", "model", "status", "output", "created_at", "recorded_at"}
+    assert (row["key"], row["prediction_id"], row["status"]) == ("render:abc", "p-1", "succeeded")
+    assert "base64" not in str(row)
+
+    entry = asyncio.run(ledger.find("render:abc"))
+    assert entry.prediction == {"id": "p-1", "status": "succeeded", "output": "a kitchen"}
+
+
+def test_table_of_an_earlier_version_is_dropped(tmp_path):
+    path = str(tmp_path / "old.db")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE predictions (seq INTEGER PRIMARY KEY, key TEXT, prediction TEXT)")
+    conn.execute("INSERT INTO predictions (key, prediction) VALUES ('k', '{\"input\": \"data:...\"}')")
+    conn.commit()
+    conn.close()
+
+    ledger = PredictionLedger(path, ttl=3000)
+    assert rows(ledger) == []
+    asyncio.run(ledger.record(Entry("k", "blip2", {"id": "p", "status": "starting"}, time.time())))
+    assert asyncio.run(ledger.find("k")).status == "starting"
+
+
+def test_succeeded_prediction_is_reused(ledger):
+    async def scenario():
+        async with fake_replicate() as client:
+            first = await predictions.run_prediction(client, BODY, "token", 30, "blip2")
+            again = await predictions.run_prediction(client, BODY, "token", 30, "blip2")
+            fresh = await predictions.run_prediction(client, BODY, "token", 30, "blip2", reuse=False)
+            return first, again, fresh, (await client.get("/_stats")).json()["requests"]
+
+    first, again, fresh, stats = asyncio.run(scenario())
+    assert again == {"id": first["id"], "status": "succeeded", "output": first["output"]}
+    assert fresh["id"] != first["id"]
+    assert stats["predictions_create"] == 2
+    assert ledger.reused == 1
+    assert [row["status"] for row in rows(ledger)] == ["starting", "succeeded", "starting", "succeeded"]
+
+
+def test_running_prediction_is_reattached_after_a_restart(ledger):
+    async def scenario():
+        async with fake_replicate(run_time=0.3) as client:
+            # Left running by an earlier process
+            response = await client.post("/v1/predictions", json=BODY)
+            running = response.json()
+            await ledger.record(Entry("analysis:k", "blip2", running, time.time()))
+
+            assert await predictions.resume_unfinished(client, "token") == 1
+            # A request for the same key waits for it instead of creating another
+            result = await predictions.run_prediction(client, BODY, "token", 30, "blip2", ledger_key="analysis:k")
+            await predictions.stop_following()
+            return running, result, (await client.get("/_stats")).json()["requests"]
+
+    running, result, stats = asyncio.run(scenario())
+    assert result["id"] == running["id"]
+    assert result["status"] == "succeeded"
+    assert stats["predictions_create"] == 1
+    assert ledger.reattached == 1
+    assert rows(ledger)[-1]["status"] == "succeeded"
+    assert asyncio.run(ledger.unfinished()) == []
+
+
+@pytest.mark.parametrize("enabled", [True, False])
+def test_shutdown_leaves_predictions_running_only_for_the_ledger(tmp_path, monkeypatch, enabled):
+    monkeypatch.setattr(predictions, "ledger", PredictionLedger(str(tmp_path / "l.db") if enabled else "", 3000))
+
+    async def scenario():
+        async with fake_replicate(run_time=5) as client:
+            task = asyncio.create_task(predictions.run_prediction(client, BODY, "token", 30, "blip2"))
+            await asyncio.sleep(0.2)
+            task.cancel(predictions.SHUTDOWN)
+            await asyncio.gather(task, return_exceptions=True)
+            await asyncio.sleep(0.1)
+            return await fake_statuses(client)
+
+    statuses = asyncio.run(scenario())
+    if enabled:
+        assert "canceled" not in statuses
+        assert [e.status for e in asyncio.run(predictions.ledger.unfinished())] in (["starting"], ["processing"])
+    else:
+        assert statuses == {"canceled": 1}
@@ -0,0 +1,60 @@
+"""
+Local pre-analysis: degenerate images and analyzer failures escalate to
+BLIP-2 instead of failing the request.
+"""
+
+import io
+import asyncio
+
+import pytest
+
+pytest.importorskip("numpy")
+Image = pytest.importorskip("PIL.Image")
+
+import local_analyzer  # noqa: E402
+import prompt_generator  # noqa: E402
+from support import fake_replicate, fake_stats, new_image_url  # noqa: E402
+
+
+def png(width: int, height: int) -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", (width, height), (200, 150, 100)).save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+@pytest.mark.parametrize("size", [(1, 1), (2, 2), (1200, 2), (2, 900), (3, 3)])
+def test_tiny_images_give_no_geometry_confidence(size):
+    estimate = local_analyzer.estimate(png(*size))
+    assert estimate.confidence["is_angled_photo"] == 0.5
+    assert estimate.confidence["warped_perspective"] == 0.5
+    assert not estimate.confident()
+
+
+def test_analyzer_failure_returns_no_estimate(monkeypatch):
+    def broken(data: bytes):
+        raise IndexError("index -1 is out of bounds")
+
+    monkeypatch.setattr(local_analyzer, "estimate", broken)
+
+    async def scenario():
+        async with fake_replicate() as client:
+            return await local_analyzer.estimate_kitchen_image("https://example.com/k.jpg", client, png(64, 64))
+
+    assert asyncio.run(scenario()) is None
+
+
+@pytest.mark.parametrize("broken", [False, True])
+def test_tiny_or_failing_estimate_escalates_to_blip2(monkeypatch, broken):
+    monkeypatch.setattr(prompt_generator, "LOCAL_ANALYSIS", True)
+    if broken:
+        monkeypatch.setattr(local_analyzer, "estimate", lambda data: 1 / 0)
+
+    async def scenario():
+        async with fake_replicate() as client:
+            analysis = await prompt_generator.analyze_kitchen_image(new_image_url(), client, image_bytes=png(2, 2))
+            return analysis, await fake_stats(client)
+
+    analysis, stats = asyncio.run(scenario())
+    assert analysis.get("source") != "local"
+    assert "fallback_reason" not in analysis
+    assert stats["predictions_create"] == 1
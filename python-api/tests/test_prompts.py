@@ -0,0 +1,157 @@
+"""
+Prompt builder equivalence: the precompiled fragments must produce exactly
+the prompts of the original f-string builder (kept in
+benchmarks/bench_prompt.py), for single prompts and batches alike.
+"""
+
+import itertools
+
+import pytest
+
+from benchmarks.bench_prompt import reference_build_prompt
+from prompt_generator import (
+    DOOR_GEOMETRY,
+    HARDWARE_FINISH,
+    HARDWARE_GEOMETRY,
+    LIGHTING,
+    build_kitchen_refacing_prompt,
+    build_kitchen_refacing_prompts,
+)
+
+DESCRIPTION = "White shaker cabinets with granite counters"
+
+STRAIGHT_ON = """LOOK AT THE IMAGE AND FOLLOW THESE ACTIONS EXACTLY:
+
+1. ANALYZE STRUCTURE
+- Identify all cabinets, doors, drawers, openings, and hardware in the image.
+- Preserve countertops, walls, appliances, windows, lighting, and flooring.
+- Do NOT modify anything except cabinets, drawers, and hardware.
+
+2. RECONSTRUCT MISSING PARTS
+All drawers appear present; keep their size and outer boundaries unchanged.
+
+3. ERASE OLD STYLES
+Remove all existing panel lines, bevels, grooves, and decorative shapes to prepare for the new style.
+
+4. DRAW NEW DOOR STYLE
+Erase all existing lines and draw a new recessed rectangular center panel with even borders on each door. Add a shorter horizontal recessed panel on each drawer.
+
+5. APPLY NEW COLOR
+Recolor all cabinet surfaces to Classic White (#FFFFFF) with a smooth satin finish.
+Do not change shadows or reflections on surrounding objects.
+
+6. REMOVE OLD HARDWARE AND ADD NEW
+Erase all existing handles and knobs completely.
+Add a cylindrical bar handle with rounded posts, positioned vertically on doors and horizontally on drawers.
+Apply a satin nickel brushed finish.
+Place handles centered and aligned with standard orientation.
+
+7. ANGLE / PERSPECTIVE HANDLING
+Keep all geometry perfectly parallel since the photo is taken straight-on.
+
+
+8. LIGHTING CONDITIONS
+Use neutral white lighting reflections.
+
+9. CLEANUP
+Keep image clarity but do not over-smooth the rest of the kitchen.
+
+10. FINAL DIRECTIVE
+Generate the updated kitchen with the new cabinet style, color, and hardware while keeping all other room elements unchanged.
+Maintain photorealism and match the original shadows, angle, and lighting.
+
+IMAGE REFERENCE:"""
+
+EVERY_FLAG = """LOOK AT THE IMAGE AND FOLLOW THESE ACTIONS EXACTLY:
+
+1. ANALYZE STRUCTURE
+- Identify all cabinets, doors, drawers, openings, and hardware in the image.
+- Preserve countertops, walls, appliances, windows, lighting, and flooring.
+- Do NOT modify anything except cabinets, drawers, and hardware.
+
+2. RECONSTRUCT MISSING PARTS
+Some drawers are missing. Draw new drawer fronts as flat rectangles that match the size, shape, and alignment of surrounding drawers.
+
+3. ERASE OLD STYLES
+Remove all arched or raised panel shapes. Flatten them completely before drawing the new style.
+
+4. DRAW NEW DOOR STYLE
+Remove all interior lines and make each door and drawer a completely flat smooth rectangle with no panels, grooves, or decorative elements.
+
+5. APPLY NEW COLOR
+Recolor all cabinet surfaces to Navy (#1F2A44) with a smooth satin finish.
+Do not change shadows or reflections on surrounding objects.
+
+6. REMOVE OLD HARDWARE AND ADD NEW
+Erase all existing handles and knobs completely.
+Add a straight bar pull with squared posts, placed vertically on doors and horizontally on drawers.
+Apply a matte black non-reflective finish.
+Place handles centered and aligned with standard orientation.
+
+7. ANGLE / PERSPECTIVE HANDLING
+Match the angle and perspective of the original photo when drawing all new rectangles and hardware. Maintain consistent vanishing points.
+Straighten any warped or distorted cabinet faces before applying the new geometry. Correct vertical and horizontal alignment.
+
+8. LIGHTING CONDITIONS
+Adjust reflections and highlights to match warm indoor lighting.
+
+9. CLEANUP
+Remove noise, smudges, debris, and painter's tape before generating final output.
+
+10. FINAL DIRECTIVE
+Generate the updated kitchen with the new cabinet style, color, and hardware while keeping all other room elements unchanged.
+Maintain photorealism and match the original shadows, angle, and lighting.
+
+IMAGE REFERENCE:
+White shaker cabinets with granite counters"""
+
+
+@pytest.mark.parametrize("kwargs, expected", [
+    (dict(image_description="", door_style="shaker", color_hex="#FFFFFF", color_name="Classic White",
+          hardware_style="bar", hardware_finish="nickel"), STRAIGHT_ON),
+    (dict(image_description=DESCRIPTION, door_style="slab", color_hex="#1F2A44", color_name="Navy",
+          hardware_style="loft", hardware_finish="black", drawers_missing=True, is_angled_photo=True,
+          has_arched_doors=True, lighting="warm", needs_cleanup=True, warped_perspective=True), EVERY_FLAG),
+    # Unknown keys fall back to shaker / bar / nickel / neutral
+    (dict(image_description="", door_style="gothic", color_hex="#FFFFFF", color_name="Classic White",
+          hardware_style="rope", hardware_finish="copper", lighting="ultraviolet"), STRAIGHT_ON),
+    # Truthy non-bool flags behave like True
+    (dict(image_description=DESCRIPTION, door_style="slab", color_hex="#1F2A44", color_name="Navy",
+          hardware_style="loft", hardware_finish="black", drawers_missing=1, is_angled_photo="yes",
+          has_arched_doors=[1], lighting="warm", needs_cleanup=2, warped_perspective=1.0), EVERY_FLAG),
+], ids=["straight-on", "every-flag", "fallbacks", "truthy-flags"])
+def test_prompt_matches_the_expected_text(kwargs, expected):
+    assert build_kitchen_refacing_prompt(**kwargs) == expected
+    assert reference_build_prompt(**kwargs) == expected
+
+
+@pytest.mark.parametrize("door_style, hardware_style", list(itertools.product(DOOR_GEOMETRY, HARDWARE_GEOMETRY)))
+def test_every_combination_matches_the_reference_builder(door_style, hardware_style):
+    for hardware_finish, lighting in itertools.product(HARDWARE_FINISH, LIGHTING):
+        for flags in itertools.product((True, False), repeat=5):
+            kwargs = dict(
+                image_description=DESCRIPTION, door_style=door_style, color_hex="#FFFFFF",
+                color_name="Classic White", hardware_style=hardware_style, hardware_finish=hardware_finish,
+                drawers_missing=flags[0], is_angled_photo=flags[1], has_arched_doors=flags[2],
+                lighting=lighting, needs_cleanup=flags[3], warped_perspective=flags[4],
+            )
+            assert build_kitchen_refacing_prompt(**kwargs) == reference_build_prompt(**kwargs), kwargs
+
+
+@pytest.mark.parametrize("analysis", [
+    {},
+    dict(drawers_missing=True, is_angled_photo=True, has_arched_doors=True, lighting="cool",
+         needs_cleanup=True, warped_perspective=True),
+    dict(lighting="ultraviolet", is_angled_photo=1),
+])
+def test_batch_matches_single_prompts(analysis):
+    variants = [
+        dict(door_style="shaker", color_hex="#FFFFFF", color_name="Classic White",
+             hardware_style="bar", hardware_finish="nickel"),
+        dict(door_style="fusion-slide", color_hex="#2F4F4F", color_name="Slate",
+             hardware_style="arch", hardware_finish="rose_gold"),
+        dict(door_style="gothic", color_hex="#000000", color_name="Black",
+             hardware_style="rope", hardware_finish="copper"),
+    ]
+    batch = build_kitchen_refacing_prompts(variants, DESCRIPTION, **analysis)
+    assert batch == [reference_build_prompt(DESCRIPTION, **variant, **analysis) for variant in variants]
@@ -0,0 +1,99 @@
+"""
+Nano-Banana renders against the fake Replicate server: cached by image and
+prompt, shared while in flight, and re-rendered on bypass_cache.
+"""
+
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+import api
+import http_client
+import images
+from support import fake_replicate, fake_stats, new_image_url
+
+PROMPT = "Reface the cabinets in white shaker doors with brass bar pulls"
+
+
+@pytest.fixture(autouse=True)
+def image_store(tmp_path, monkeypatch):
+    # Finished renders are fetched into the image store; keep it out of the tree
+    monkeypatch.setattr(images, "store", images.LocalImageStore(str(tmp_path)))
+
+
+def render(scenario):
+    """Run scenario(client) against a fake Replicate, letting image prefetches finish"""
+    async def run():
+        async with fake_replicate() as client:
+            http_client._client = client
+            try:
+                result = await scenario(client)
+                await asyncio.gather(*images._prefetches)
+                return result
+            finally:
+                http_client._client = None
+
+    return asyncio.run(run())
+
+
+def test_identical_render_is_served_from_the_cache():
+    async def scenario(client):
+        image_url = new_image_url()
+        first = await api.run_nano_banana(image_url, PROMPT, "test-token", client)
+        assert first.startswith("http://fake-replicate/delivery/")
+        hits = api.render_cache.stats()["hits"]
+
+        assert await api.run_nano_banana(image_url, PROMPT, "test-token", client) == first
+        assert api.render_cache.stats()["hits"] == hits + 1
+        assert (await fake_stats(client))["predictions_create"] == 1
+
+        # Another prompt for the same image is another render
+        await api.run_nano_banana(image_url, PROMPT + " and a marble backsplash", "test-token", client)
+        assert (await fake_stats(client))["predictions_create"] == 2
+
+    render(scenario)
+
+
+def test_concurrent_identical_renders_share_one_prediction():
+    async def scenario(client):
+        image_url = new_image_url()
+        coalesced = api.render_flight.stats()["coalesced"]
+        results = await asyncio.gather(*[
+            api.run_nano_banana(image_url, PROMPT, "test-token", client) for _ in range(5)
+        ])
+        assert len(set(results)) == 1
+        assert api.render_flight.stats()["coalesced"] == coalesced + 4
+        assert (await fake_stats(client))["predictions_create"] == 1
+
+    render(scenario)
+
+
+def test_bypass_cache_renders_again_and_refreshes_the_cache():
+    async def scenario(client):
+        image_url = new_image_url()
+        cached = await api.run_nano_banana(image_url, PROMPT, "test-token", client)
+        fresh = await api.run_nano_banana(image_url, PROMPT, "test-token", client, bypass_cache=True)
+        assert fresh != cached
+        assert (await fake_stats(client))["predictions_create"] == 2
+        # The fresh render replaced the cached one
+        assert await api.run_nano_banana(image_url, PROMPT, "test-token", client) == fresh
+        assert (await fake_stats(client))["predictions_create"] == 2
+
+    render(scenario)
+
+
+def test_failed_render_is_not_cached():
+    async def scenario(client):
+        image_url = new_image_url()
+        for _ in range(2):
+            with pytest.raises(HTTPException) as err:
+                await api.run_nano_banana(image_url, PROMPT, "test-token", client)
+            assert err.value.status_code == 500
+        assert (await fake_stats(client))["predictions_create"] == 2
+
+    async def failing():
+        async with fake_replicate(failure_rate=1.0) as client:
+            await scenario(client)
+
+    asyncio.run(failing())
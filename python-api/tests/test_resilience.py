@@ -0,0 +1,218 @@
+"""
+Retry policy, request deadlines and circuit breakers, and which prediction
+outcomes count against a model's breaker.
+"""
+
+import asyncio
+import random
+
+import httpx
+import pytest
+
+import predictions
+import resilience
+from resilience import CircuitBreaker, CircuitOpenError, DeadlineExceeded, RetryPolicy, deadline, remaining
+from support import Scripted, created, fake_replicate
+
+REQUEST = httpx.Request("POST", "http://fake-replicate/v1/predictions")
+
+
+@pytest.mark.parametrize("err, reason", [
+    (httpx.ConnectError("refused", request=REQUEST), "connect"),
+    (httpx.ConnectTimeout("slow", request=REQUEST), "connect"),
+    (httpx.PoolTimeout("pool", request=REQUEST), "connect"),
+    (predictions.ReplicateError("503 - unavailable", 503), "5xx"),
+    (predictions.ReplicateError("500 - oops", 500), "5xx"),
+    # Sent, so Replicate may have started (and will bill) a prediction
+    (httpx.ReadTimeout("slow", request=REQUEST), None),
+    (predictions.ReplicateError("422 - bad input", 422), None),
+    (ValueError("bug"), None),
+])
+def test_only_unsent_or_5xx_creations_are_retryable(err, reason):
+    assert RetryPolicy().reason(err) == reason
+
+
+def test_backoff_is_full_jitter_under_a_cap():
+    random.seed(7)
+    policy = RetryPolicy(base_delay=0.5, max_delay=4.0)
+    for attempt in range(8):
+        ceiling = min(4.0, 0.5 * 2 ** attempt)
+        delays = [policy.delay(attempt) for _ in range(200)]
+        assert all(0 <= d <= ceiling for d in delays)
+        # Spread over the whole range, not pinned to the ceiling
+        assert min(delays) < ceiling * 0.2 and max(delays) > ceiling * 0.8
+
+
+def test_remaining_without_a_deadline_is_the_timeout():
+    assert remaining(42.0) == 42.0
+
+
+def test_deadlines_nest_by_shrinking_and_reach_tasks():
+    async def scenario():
+        with deadline(10):
+            assert 9 < remaining(60) <= 10
+            with deadline(100):
+                assert remaining(60) <= 10
+            with deadline(0.5):
+                assert remaining(60) <= 0.5
+                # Tasks started inside inherit the budget
+                assert await asyncio.create_task(_remaining_later(60)) <= 0.5
+            assert remaining(60) > 0.5
+
+    asyncio.run(scenario())
+
+
+async def _remaining_later(timeout: float) -> float:
+    await asyncio.sleep(0)
+    return remaining(timeout)
+
+
+def test_spent_deadline_raises():
+    async def scenario():
+        with deadline(0.02):
+            await asyncio.sleep(0.03)
+            with pytest.raises(DeadlineExceeded):
+                remaining(60)
+
+    asyncio.run(scenario())
+
+
+def test_breaker_opens_probes_and_closes(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(resilience.time, "monotonic", lambda: clock[0])
+    gate = CircuitBreaker("blip2", threshold=3, reset_timeout=30)
+
+    for _ in range(2):
+        gate.before_call()
+        gate.record_failure()
+    assert gate.state == "closed"
+    gate.before_call()
+    gate.record_failure()
+    assert gate.state == "open" and gate.opened_count == 1
+
+    with pytest.raises(CircuitOpenError) as err:
+        gate.before_call()
+    assert err.value.retry_after == 30
+
+    # After the reset timeout exactly one probe goes through
+    clock[0] += 30
+    gate.before_call()
+    assert gate.state == "half_open"
+    with pytest.raises(CircuitOpenError):
+        gate.before_call()
+
+    # A failed probe re-opens it at once
+    gate.record_failure()
+    assert gate.state == "open" and gate.opened_count == 2
+
+    clock[0] += 30
+    gate.before_call()
+    gate.record_success()
+    assert gate.stats() == {"state": "closed", "consecutive_failures": 0, "times_opened": 2, "retry_in": 0.0}
+
+
+def test_released_probe_lets_the_next_call_probe():
+    gate = CircuitBreaker("blip2", threshold=1, reset_timeout=0)
+    gate.before_call()
+    gate.record_failure()
+    gate.before_call()
+    gate.release()
+    assert gate.state == "half_open"
+    gate.before_call()
+
+
+@pytest.fixture
+def quick_retries(monkeypatch):
+    monkeypatch.setattr(predictions, "create_retry_policy", RetryPolicy(retries=2, base_delay=0.01, max_delay=0.02))
+
+
+def create(replicate: Scripted):
+    return predictions.create_prediction_governed(replicate.client, {"model": "m"}, "token", "m")
+
+
+def test_transient_creation_failures_are_retried(quick_retries):
+    replicate = Scripted(
+        httpx.ConnectError("refused"), httpx.Response(503, text="unavailable"), created("p-retried")
+    )
+    assert asyncio.run(create(replicate))["id"] == "p-retried"
+    assert replicate.calls == 3
+
+
+@pytest.mark.parametrize("response, calls", [
+    (httpx.Response(503, text="unavailable"), 3),   # retries run out
+    (httpx.ReadTimeout("slow"), 1),                 # may have been created
+    (httpx.Response(422, text="bad input"), 1),     # our request is wrong
+])
+def test_creation_retries_stop(quick_retries, response, calls):
+    replicate = Scripted(response)
+    with pytest.raises((predictions.ReplicateError, httpx.HTTPError)):
+        asyncio.run(create(replicate))
+    assert replicate.calls == calls
+
+
+def test_creation_is_not_retried_past_the_deadline(monkeypatch):
+    monkeypatch.setattr(predictions, "create_retry_policy", RetryPolicy(retries=2, base_delay=5, max_delay=5))
+    monkeypatch.setattr(random, "uniform", lambda low, high: high)
+    replicate = Scripted(httpx.Response(503, text="unavailable"), created())
+
+    async def scenario():
+        with deadline(1):
+            await create(replicate)
+
+    with pytest.raises(predictions.ReplicateError):
+        asyncio.run(scenario())
+    assert replicate.calls == 1
+
+
+# ============ WHAT COUNTS AGAINST THE BREAKER ============
+
+def run(client: httpx.AsyncClient, timeout: float = 30.0):
+    return predictions.run_prediction(client, {"version": "v", "input": {}}, "token", timeout, "blip2")
+
+
+def failures() -> int:
+    return resilience.breaker("blip2").failures
+
+
+def test_failed_predictions_do_not_count():
+    async def scenario():
+        async with fake_replicate(failure_rate=1.0) as client:
+            return await asyncio.gather(*[
+                run(client) for _ in range(resilience.BREAKER_FAILURE_THRESHOLD + 1)
+            ])
+
+    assert {result["status"] for result in asyncio.run(scenario())} == {"failed"}
+    assert resilience.breaker("blip2").state == "closed"
+    assert failures() == 0
+
+
+def test_deadline_cut_waits_do_not_count():
+    async def scenario():
+        async with fake_replicate(run_time=5) as client:
+            with deadline(0.6):
+                return await run(client)
+
+    assert asyncio.run(scenario())["status"] in ("starting", "processing")
+    assert failures() == 0
+
+
+def test_model_timeouts_count():
+    async def scenario():
+        async with fake_replicate(run_time=5) as client:
+            return await run(client, timeout=0.6)
+
+    assert asyncio.run(scenario())["status"] in ("starting", "processing")
+    assert failures() == 1
+
+
+@pytest.mark.parametrize("response, counted", [
+    (httpx.Response(503, text="unavailable"), 1),
+    (httpx.ConnectError("refused"), 1),
+    (httpx.Response(422, text="bad input"), 0),
+])
+def test_upstream_errors_count_and_request_errors_do_not(monkeypatch, response, counted):
+    monkeypatch.setattr(predictions, "create_retry_policy", RetryPolicy(retries=0))
+    replicate = Scripted(response)
+    with pytest.raises((predictions.ReplicateError, httpx.HTTPError)):
+        asyncio.run(run(replicate.client))
+    assert failures() == counted
@@ -0,0 +1,87 @@
+"""
+Local direct uploads (STORAGE_BACKEND=local): signed, expiring and
+write-once.
+"""
+
+import os
+import time
+import asyncio
+
+import httpx
+import pytest
+
+import api
+from storage import LocalStorage, StorageError
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    local = LocalStorage(str(tmp_path), "test-secret")
+    monkeypatch.setattr(api, "storage", local)
+    return local
+
+
+def post_upload(url: str, fields: dict, data: bytes = b"\xff\xd8\xff photo") -> httpx.Response:
+    async def post():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=api.app), base_url="http://api") as client:
+            return await client.post(url, data=fields, files={"file": ("kitchen.jpg", data, "image/jpeg")})
+
+    return asyncio.run(post())
+
+
+def presigned(store: LocalStorage) -> tuple[str, dict]:
+    upload = store.presign("image/jpeg", "http://api")
+    return upload.url, upload.fields
+
+
+def test_signed_upload_is_stored_and_served(store):
+    url, fields = presigned(store)
+    assert post_upload(url, fields).status_code == 204
+
+    async def fetch():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=api.app), base_url="http://api") as client:
+            return await client.get(url)
+
+    response = asyncio.run(fetch())
+    assert response.status_code == 200
+    assert response.content == b"\xff\xd8\xff photo"
+
+
+@pytest.mark.parametrize("field, value", [
+    ("signature", "0" * 64),
+    ("max_bytes", str(50 * 1024 * 1024)),
+    ("Content-Type", "image/png"),
+])
+def test_tampered_form_is_refused(store, field, value):
+    url, fields = presigned(store)
+    assert post_upload(url, {**fields, field: value}).status_code == 403
+    assert not store.exists(url.rsplit("/", 1)[-1])
+
+
+def test_expired_signature_is_refused(store, monkeypatch):
+    url, fields = presigned(store)
+    monkeypatch.setattr(time, "time", lambda: int(fields["expires"]) + 1)
+    response = post_upload(url, fields)
+    assert response.status_code == 403
+    assert response.json()["detail"] == "Upload URL expired"
+
+
+def test_replayed_upload_does_not_replace_the_object(store):
+    url, fields = presigned(store)
+    assert post_upload(url, fields).status_code == 204
+    assert post_upload(url, fields, b"\xff\xd8\xff something else").status_code == 409
+    with open(store.path(url.rsplit("/", 1)[-1]), "rb") as f:
+        assert f.read() == b"\xff\xd8\xff photo"
+
+
+def test_racing_write_loses_with_409(store, monkeypatch):
+    key = presigned(store)[0].rsplit("/", 1)[-1]
+    store.write(key, b"first")
+    # Both uploads passed the existence check; the second must still not replace the first
+    monkeypatch.setattr(store, "exists", lambda key: False)
+    with pytest.raises(StorageError) as err:
+        store.write(key, b"second")
+    assert err.value.status_code == 409
+    with open(store.path(key), "rb") as f:
+        assert f.read() == b"first"
+    assert [name for name in os.listdir(store.directory) if name.endswith(".part")] == []
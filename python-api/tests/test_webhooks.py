@@ -0,0 +1,65 @@
+"""
+POST /webhooks/replicate only accepts deliveries signed with
+REPLICATE_WEBHOOK_SECRET; without a secret webhook mode stays off.
+"""
+
+import hmac
+import json
+import time
+import base64
+import asyncio
+import hashlib
+
+import httpx
+import pytest
+
+import api
+import predictions
+from support import WEBHOOK_SECRET
+
+DELIVERY = json.dumps({"id": "p-unknown", "status": "succeeded", "output": "a kitchen"}).encode()
+
+
+def signed(body: bytes, secret: str = WEBHOOK_SECRET, timestamp: float = None) -> dict:
+    webhook_id, stamp = "msg_test", str(int(time.time() if timestamp is None else timestamp))
+    key = base64.b64decode(secret.split("_", 1)[-1])
+    digest = hmac.new(key, f"{webhook_id}.{stamp}.".encode() + body, hashlib.sha256).digest()
+    return {
+        "webhook-id": webhook_id,
+        "webhook-timestamp": stamp,
+        "webhook-signature": f"v1,{base64.b64encode(digest).decode()}",
+    }
+
+
+def deliver(headers: dict) -> httpx.Response:
+    async def post():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=api.app), base_url="http://api") as client:
+            return await client.post("/webhooks/replicate", content=DELIVERY, headers=headers)
+
+    return asyncio.run(post())
+
+
+def test_without_a_secret_webhook_mode_is_off_and_deliveries_are_rejected(monkeypatch):
+    monkeypatch.setattr(predictions, "REPLICATE_WEBHOOK_URL", "http://api/webhooks/replicate")
+    monkeypatch.setattr(predictions, "REPLICATE_WEBHOOK_SECRET", "")
+    assert not predictions.webhook_enabled()
+    assert deliver({}).status_code == 401
+    assert deliver(signed(DELIVERY)).status_code == 401
+
+
+@pytest.mark.parametrize("headers", [
+    {},
+    signed(DELIVERY, secret="whsec_" + base64.b64encode(b"some other key").decode()),
+    signed(DELIVERY, timestamp=time.time() - predictions.WEBHOOK_TOLERANCE_SECONDS - 60),
+    signed(b"{}"),
+], ids=["unsigned", "wrong-secret", "stale", "other-body"])
+def test_unverified_deliveries_are_rejected(monkeypatch, headers):
+    monkeypatch.setattr(predictions, "REPLICATE_WEBHOOK_SECRET", WEBHOOK_SECRET)
+    assert deliver(headers).status_code == 401
+
+
+def test_signed_delivery_is_accepted(monkeypatch):
+    monkeypatch.setattr(predictions, "REPLICATE_WEBHOOK_SECRET", WEBHOOK_SECRET)
+    response = deliver(signed(DELIVERY))
+    assert response.status_code == 200
+    assert response.json() == {"received": True, "matched": False}
@@ -0,0 +1,56 @@
+"""
+Per-request stage timings returned in visualization responses
+
+Stages may overlap (e.g. the upload runs while the analysis cache is
+checked), so the durations do not sum to total_ms. Every measured stage is
+also a telemetry span, so it lands in the /metrics stage histogram.
+
+The newest StageTimer in the current context also collects durations that
+deeper layers report with record_stage(), such as the Replicate queue and
+run time of each prediction.
+"""
+
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Awaitable, Iterator, Optional, TypeVar
+
+from telemetry import span
+
+T = TypeVar("T")
+
+_current_timer: ContextVar[Optional["StageTimer"]] = ContextVar("stage_timer", default=None)
+
+
+class StageTimer:
+    """Wall-clock duration of each named stage of one request"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages: dict[str, float] = {}
+        _current_timer.set(self)
+
+    @contextmanager
+    def measure(self, stage: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            with span(stage):
+                yield
+        finally:
+            self.stages[stage] = (time.perf_counter() - start) * 1000
+
+    async def track(self, stage: str, awaitable: Awaitable[T]) -> T:
+        with self.measure(stage):
+            return await awaitable
+
+    def as_dict(self) -> dict:
+        timings = {f"{stage}_ms": round(ms, 1) for stage, ms in self.stages.items()}
+        timings["total_ms"] = round((time.perf_counter() - self.started) * 1000, 1)
+        return timings
+
+
+def record_stage(stage: str, ms: float) -> None:
+    """Add a duration measured elsewhere to the current request's timer, if any"""
+    timer = _current_timer.get()
+    if timer is not None:
+        timer.stages[stage] = ms